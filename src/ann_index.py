@@ -0,0 +1,247 @@
+"""
+Índices FAISS aproximados (IVF-Flat, IVF-PQ, HNSW, SQ8) construidos a partir del índice plano.
+
+El índice plano de cada generación (src/index_store.py) sigue siendo la referencia: admite las
+actualizaciones incrementales y queda mapeado en disco. El índice aproximado se entrena con una
+muestra de sus vectores, se mide su recall@k frente a él con consultas que no contiene y se guarda
+junto a la generación con sus parámetros, así que solo se vuelve a construir si cambian el corpus
+o la configuración. Si su recall no llega al mínimo se busca en el plano.
+
+    python -m src.ann_index [tipo ...]   # compara recall, tamaño y latencia de cada tipo
+"""
+import os
+import sys
+import json
+import time
+import faiss
+import numpy as np
+from src.utils.utils import BLUE, PASTEL_YELLOW, PURPLE, RED, RESET
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw", "sq8")
+
+# Parámetros por defecto de cada tipo; se pueden cambiar con RAG_INDEX_PARAMS ("nlist=256,nprobe=16")
+DEFAULT_PARAMS = {
+    "flat": {},
+    "ivf_flat": {"nlist": 0, "nprobe": 16},  # nlist=0: 4·√n
+    "ivf_pq": {"nlist": 0, "nprobe": 16, "m": 64, "nbits": 8},
+    "hnsw": {"m": 32, "ef_construction": 200, "ef_search": 64},
+    "sq8": {},
+}
+TRAIN_SIZE = 20000
+EVAL_QUERIES = 200
+RECALL_K = 10
+# Recall@k mínimo frente al plano; por debajo se usa el plano (RAG_INDEX_MIN_RECALL)
+MIN_RECALL = 0.9
+
+
+def parse_params(text):
+    """"nlist=256,nprobe=16" -> {"nlist": 256, "nprobe": 16}."""
+    params = {}
+    for item in filter(None, (part.strip() for part in (text or "").split(","))):
+        name, _, value = item.partition("=")
+        params[name.strip()] = int(value)
+    return params
+
+
+def flat_vectors(index):
+    """Vectores e ids de un IndexIDMap sobre un índice plano (ids en el orden interno)."""
+    index = faiss.downcast_index(index)
+    vectors = faiss.downcast_index(index.index).reconstruct_n(0, index.ntotal)
+    return np.ascontiguousarray(vectors, dtype=np.float32), faiss.vector_to_array(index.id_map).astype(np.int64)
+
+
+def _sample(vectors, size, seed=0):
+    if len(vectors) <= size:
+        return vectors
+    rows = np.random.default_rng(seed).choice(len(vectors), size, replace=False)
+    return vectors[np.sort(rows)]
+
+
+def build(kind, vectors, ids, params=None, train_size=TRAIN_SIZE):
+    """
+    Construye un índice de tipo `kind` con `vectors` (float32, n x d) y sus ids de chunk.
+    Devuelve (índice, parámetros efectivos); los que dependen del tamaño del corpus se resuelven aquí.
+    """
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Tipo de índice desconocido: {kind}. Opciones: {', '.join(INDEX_TYPES)}")
+    params = {**DEFAULT_PARAMS[kind], **(params or {})}
+    n, dim = vectors.shape
+    train = _sample(vectors, train_size)
+
+    if kind == "flat":
+        index = faiss.IndexIDMap(faiss.IndexFlatL2(dim))
+    elif kind in ("ivf_flat", "ivf_pq"):
+        # FAISS necesita al menos un punto de entrenamiento por lista (y recomienda 39)
+        nlist = params["nlist"] or int(4 * np.sqrt(n))
+        params["nlist"] = nlist = max(1, min(nlist, len(train) // 39 or 1))
+        params["nprobe"] = min(params["nprobe"], nlist)
+        quantizer = faiss.IndexFlatL2(dim)
+        if kind == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_L2)
+        else:
+            # m debe dividir la dimensión y cada subcuantizador necesita unos 39·2^nbits puntos de entrenamiento
+            params["m"] = max(m for m in range(1, min(params["m"], dim) + 1) if dim % m == 0)
+            nbits = max(1, min(params["nbits"], int(np.log2(max(len(train) / 39, 2)))))
+            if nbits < params["nbits"]:
+                print(f"⚠️ {PASTEL_YELLOW}IVF-PQ: {len(train)} vectores de entrenamiento solo dan para nbits={nbits} "
+                      f"(se pidió {params['nbits']}); el recall será bajo con un corpus tan pequeño.{RESET}")
+            params["nbits"] = nbits
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, params["m"], params["nbits"])
+        index.train(train)
+        index.nprobe = params["nprobe"]
+    elif kind == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dim, params["m"])
+        hnsw.hnsw.efConstruction = params["ef_construction"]
+        hnsw.hnsw.efSearch = params["ef_search"]
+        index = faiss.IndexIDMap(hnsw)
+    else:
+        quantized = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+        quantized.train(train)
+        index = faiss.IndexIDMap(quantized)
+
+    index.add_with_ids(vectors, ids)
+    return index, params
+
+
+def _held_out_rows(n, size=EVAL_QUERIES, seed=1):
+    """Máscara con hasta `size` filas (como mucho una de cada diez) apartadas para la evaluación."""
+    rows = np.zeros(n, dtype=bool)
+    rows[np.random.default_rng(seed).choice(n, min(size, n // 10), replace=False)] = True
+    return rows
+
+
+def build_and_evaluate(kind, vectors, ids, params=None, train_size=TRAIN_SIZE):
+    """
+    Construye el índice y mide su recall@k con consultas que no contiene: se entrena y se llena sin
+    una muestra de los vectores, que se buscan en él y en un plano con el resto, y después se añaden.
+    Con los propios vectores del índice como consultas cada una se encuentra a sí misma y el recall
+    sale inflado, sobre todo con IVF-PQ. Devuelve (índice, parámetros efectivos, recall, consultas).
+    """
+    held_out = _held_out_rows(len(vectors))
+    queries = vectors[held_out]
+    index, effective = build(kind, vectors[~held_out], ids[~held_out], params, train_size)
+    reference = faiss.IndexIDMap(faiss.IndexFlatL2(vectors.shape[1]))
+    reference.add_with_ids(vectors[~held_out], ids[~held_out])
+    recall = recall_at_k(reference, index, queries)
+    index.add_with_ids(queries, ids[held_out])
+    return index, effective, recall, queries
+
+
+def configure(index, kind, params):
+    """Aplica los parámetros de búsqueda (no siempre se serializan con el índice)."""
+    if kind in ("ivf_flat", "ivf_pq"):
+        faiss.extract_index_ivf(index).nprobe = params["nprobe"]
+    elif kind == "hnsw":
+        faiss.downcast_index(faiss.downcast_index(index).index).hnsw.efSearch = params["ef_search"]
+    return index
+
+
+def recall_at_k(baseline, candidate, queries, k=RECALL_K):
+    """Fracción de los k vecinos exactos (índice plano) que también devuelve el índice aproximado."""
+    k = min(k, baseline.ntotal)
+    _, expected = baseline.search(queries, k)
+    _, found = candidate.search(queries, k)
+    hits = sum(len(set(row_expected) & set(row_found)) for row_expected, row_found in zip(expected, found))
+    return hits / (len(queries) * k) if len(queries) else 1.0
+
+
+def index_bytes(index):
+    return len(faiss.serialize_index(index))
+
+
+def _read_built(index_path, meta_path, kind, requested):
+    """Índice ya construido con los mismos parámetros, o None."""
+    if not (os.path.exists(index_path) and os.path.exists(meta_path)):
+        return None
+    with open(meta_path, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("requested") != requested:
+        return None
+    return configure(faiss.read_index(index_path), kind, meta["params"]), meta
+
+
+def load_or_build(store, kind, params=None, train_size=TRAIN_SIZE, min_recall=MIN_RECALL):
+    """
+    Índice aproximado de la generación activa de `store`. Se lee de disco si ya se construyó con
+    los mismos parámetros; si no, se entrena con los vectores del índice plano, se mide su
+    recall@k y se guarda (ann-<tipo>.faiss y ann-<tipo>.json) en la misma generación.
+    Si el recall no llega a `min_recall` devuelve el índice plano (meta["fallback"] = "flat").
+    """
+    requested = {"kind": kind, "params": dict(params or {}), "train_size": train_size, "eval": "held_out"}
+    generation = store.current_generation()
+    if generation is None:
+        raise FileNotFoundError(f"No hay ningún índice en {store.directory}")
+    built = _read_built(os.path.join(generation, f"ann-{kind}.faiss"), os.path.join(generation, f"ann-{kind}.json"),
+                        kind, requested)
+    if built is None:
+        # Con el cerrojo del almacén no se cruzan dos construcciones ni una reindexación
+        with store.lock():
+            built = _build_and_save(store, kind, params, train_size, requested)
+    index, meta = built
+
+    recall = meta[f"recall@{RECALL_K}"]
+    if recall < min_recall:
+        print(f"🚨 {RED}El índice {kind} solo tiene recall@{RECALL_K} {recall:.3f}, por debajo del mínimo "
+              f"{min_recall:.2f} (RAG_INDEX_MIN_RECALL): SE USA EL ÍNDICE PLANO. Revisa RAG_INDEX_TYPE y "
+              f"RAG_INDEX_PARAMS ({meta['params']}).{RESET}")
+        baseline, _ = store.load(mmap=True)
+        return baseline, dict(meta, fallback="flat")
+    return index, meta
+
+
+def _build_and_save(store, kind, params, train_size, requested):
+    generation = store.current_generation()
+    index_path = os.path.join(generation, f"ann-{kind}.faiss")
+    meta_path = os.path.join(generation, f"ann-{kind}.json")
+    # Otro proceso pudo construirlo mientras se esperaba el cerrojo
+    built = _read_built(index_path, meta_path, kind, requested)
+    if built is not None:
+        return built
+
+    started = time.perf_counter()
+    baseline, _ = store.load(mmap=True)
+    vectors, ids = flat_vectors(baseline)
+    index, effective, recall, _ = build_and_evaluate(kind, vectors, ids, params, train_size)
+    meta = {
+        "requested": requested,
+        "params": effective,
+        "ntotal": int(index.ntotal),
+        f"recall@{RECALL_K}": recall,
+        "bytes": index_bytes(index),
+        "flat_bytes": int(vectors.nbytes),
+    }
+
+    # Escritura atómica: otro proceso puede estar leyendo la misma generación
+    faiss.write_index(index, f"{index_path}.tmp")
+    os.replace(f"{index_path}.tmp", index_path)
+    with open(f"{meta_path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    os.replace(f"{meta_path}.tmp", meta_path)
+    print(f"🧮 {PURPLE}Índice {kind} construido en {time.perf_counter() - started:.1f} s: "
+          f"recall@{RECALL_K} {recall:.3f}, "
+          f"{meta['bytes'] / 2**20:.1f} MB (plano {meta['flat_bytes'] / 2**20:.1f} MB).{RESET}")
+    return index, meta
+
+
+def compare(store, kinds=INDEX_TYPES, params=None, repetitions=EVAL_QUERIES):
+    """
+    Construye cada tipo en memoria y muestra su recall@k (con consultas apartadas del índice),
+    tamaño y latencia frente al plano.
+    """
+    baseline, _ = store.load(mmap=True)
+    vectors, ids = flat_vectors(baseline)
+    print(f"\n{BLUE}Corpus:{RESET} {len(vectors)} vectores de {vectors.shape[1]} dimensiones")
+    for kind in kinds:
+        index, effective, recall, queries = build_and_evaluate(kind, vectors, ids, params if kind != "flat" else None)
+        started = time.perf_counter()
+        for query in queries[:repetitions]:
+            index.search(query.reshape(1, -1), RECALL_K)
+        latency = (time.perf_counter() - started) * 1000 / max(len(queries[:repetitions]), 1)
+        print(f"{PASTEL_YELLOW}{kind:9}{RESET} recall@{RECALL_K} {recall:.3f}  "
+              f"{index_bytes(index) / 2**20:8.2f} MB  {latency:.3f} ms/consulta  {effective}")
+
+
+if __name__ == "__main__":
+    from src.index_store import IndexStore
+
+    compare(IndexStore("data/rag_index"), sys.argv[1:] or INDEX_TYPES)
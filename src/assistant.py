@@ -1,39 +1,49 @@
+import asyncio
 import requests
 import pycountry
 import streamlit as st
 from src.llm_client import LlmClient
-from src.utils.utils import get_env_key, WORLD, RED, RESET, THINKING, BRIGHT_GREEN, TURQUOISE, PASTEL_YELLOW, SPARKLES, RESET, RED, RAISED_HAND
+from src.config import get_config
+from src.prompt_registry import PromptRegistry
+from src.utils.utils import WORLD, RED, RESET, THINKING, BRIGHT_GREEN, TURQUOISE, PASTEL_YELLOW, SPARKLES, RESET, RED, RAISED_HAND
 from src.tarot_reader import TarotReader
+from src.guard_classifier import GuardClassifier
 
 class Assistant:
     """Clase que configura la personalidad y el flujo del asistente."""
     def __init__(self):
-        try:
-            # Cargar el prompt inicial de LAILA
-            prompt_file = get_env_key("PROMPT_FILE")
-            with open(prompt_file, "r", encoding="utf-8") as file:
-                base_prompt = file.read()
-        except FileNotFoundError:
-            raise ValueError("Error: No se encontró el archivo de prompt.")
-        
-        self.personality = base_prompt
         self.client = LlmClient()
+        # Clasificador local que resuelve las verificaciones sin llamar al LLM cuando tiene confianza
+        self.guard_classifier = GuardClassifier.shared()
         self.welcome_message = None
         
-        # Registro de herramientas
-        if "tools" not in st.session_state:
-            st.session_state.tools = {
-                "detect_country": self.detect_country_tool,
-                "generate_welcome_message": self.generate_welcome_message_tool,
-                "is_comprensible_message": self.is_comprensible_message_tool,
-                "is_disrespectful": self.is_disrespectful_tool,
-                "is_valid_question" : self.is_valid_question_tool,
-                "is_anything_else": self.is_anything_else_tool,
-                "laila_tarot_reading": self.laila_tarot_reading_tool,
-            }
-
-        self.tools = st.session_state.tools
-
+        # Registro de herramientas (el Assistant se comparte entre sesiones; cada sesión las
+        # registra en su st.session_state al iniciarse, ver ChatApp.initialize_session_state)
+        self.tools = {
+            "detect_country": self.detect_country_tool,
+            "generate_welcome_message": self.generate_welcome_message_tool,
+            "is_comprensible_message": self.is_comprensible_message_tool,
+            "is_disrespectful": self.is_disrespectful_tool,
+            "is_valid_question" : self.is_valid_question_tool,
+            "is_anything_else": self.is_anything_else_tool,
+            "laila_tarot_reading": self.laila_tarot_reading_tool,
+        }
+        # Las mismas verificaciones como corrutinas, para lanzarlas a la vez en el bucle del LlmClient
+        self.guard_tools = {
+            "is_comprensible_message": self.ais_comprensible_message_tool,
+            "is_disrespectful": self.ais_disrespectful_tool,
+            "is_valid_question": self.ais_valid_question_tool,
+            "is_anything_else": self.ais_anything_else_tool,
+        }
+
+    @property
+    def prompts(self):
+        """Prompts vigentes (personalidad de LAILA y plantillas); se recargan si se editan."""
+        return PromptRegistry.shared()
+
+    @property
+    def personality(self):
+        return self.prompts.text("personality")
 
     def detect_country_tool(self):
         """Detecta el país y el idioma del usuario utilizando su IP."""
@@ -70,12 +80,11 @@ class Assistant:
         country, country_code, language = self.detect_country_tool()
         print(f"{PASTEL_YELLOW}{WORLD} Pais: {country}, Idioma: {country_code}{RESET}")
 
-        prompt = get_env_key('PROMPT_INTRO')
         messages_with_context = [
             {"role": "system", "content": self.personality},
-            {"role": "user", "content": f"{prompt} Genera el mensaje en {language}."}
+            {"role": "user", "content": self.prompts.render("welcome", intro=get_config().prompt_intro, language=language)}
         ]
-        return self.client.get_response(messages_with_context)
+        return self.client.get_response(messages_with_context, use_cache=False)
 
     def laila_tarot_reading_tool(self,asking, info):
         return TarotReader().reading(asking, info)
@@ -83,92 +92,109 @@ class Assistant:
     # Verificacion de mensajes de chat
     def is_comprensible_message_tool(self, user_response):
         """Verifica si la respuesta del usuario contiene se entiende."""
-        comprensible_prompt = (
-            f""""¿Entiendes este texto? {user_response} Ejemplos:
-Texto: "El sol brilla intensamente hoy." → Sí
-Texto: "lorem ipsum dolor sit amet" → No
-Texto: "gdfgjgdfklg" → No
-Texto: "El libro está sobre la mesaa." → Sí
-Responde unicamente: 'sí' o 'no'"""
-        )
-        raw_response = self.client.get_response([
-            {"role": "user", "content": comprensible_prompt}
-        ])
-
-        response = 'sí' in raw_response.strip().lower()
+        response = self.guard_classifier.classify("is_comprensible_message", user_response)
+        if response is None:
+            response = self._llm_comprensible_message(user_response)
 
         print(f"\n{PASTEL_YELLOW}{THINKING} Se entiende la respuesta?{RESET} {response}")  # Imprime la respuesta completa para depuración
 
         return response
 
+    def _llm_comprensible_message(self, user_response):
+        raw_response = self._llm_guard("guard_comprensible", self.prompts.render("guard_text", text=user_response))
+        return 'sí' in raw_response.strip().lower()
+
+    def _llm_guard(self, template, user_content):
+        """
+        Verificación sí/no con el LLM. Las instrucciones y ejemplos van en un mensaje de sistema fijo
+        (idéntico en todas las llamadas, así el proveedor puede reutilizar su caché de prompts)
+        y el texto a evaluar en el mensaje del usuario.
+        """
+        return self.client.get_response([
+            {"role": "system", "content": self.prompts.text(template)},
+            {"role": "user", "content": user_content}
+        ], route="guard")
+
     # Es ofensivo?
     def is_disrespectful_tool(self, user_response):
         """Verifica si la respuesta del usuario contiene una solicitud de cambio de rol o funcionalidad."""
-        disrespect_prompt = (
-            f"El usuario ha dicho: '{user_response}'\n"
-            "Te está faltando al respeto? Responde únicamente 'Sí' o 'No'."
-        )        
-        response = self.client.get_response([
-            {"role": "user", "content": disrespect_prompt}
-        ])
-        disrespectful = 'sí' in response.strip().lower()
+        # En local solo se descarta la falta de respeto; un 'sí' siempre lo confirma el LLM
+        disrespectful = self.guard_classifier.classify("is_disrespectful", user_response)
+        if disrespectful is None:
+            disrespectful = self._llm_disrespectful(user_response)
         print(f"\n{THINKING} {PASTEL_YELLOW}Te está faltando al respeto?{RESET} {disrespectful}")
         return disrespectful
+
+    def _llm_disrespectful(self, user_response):
+        response = self._llm_guard("guard_disrespectful", self.prompts.render("guard_text", text=user_response))
+        return 'sí' in response.strip().lower()
     
     # Verificacion de preguntas validas para el tarot
     def is_valid_question_tool(self, user_response):
         """Verifica si la respuesta del usuario contiene se entiende."""
-        question_prompt = (
-            f""""Eres una pitonisa con más de 20 años de experiencia leyendo las cartas del tarot. Evalúa si la siguiente entrada puede interpretarse como una consulta válida para realizar una lectura de tarot: {user_response} 
-Ejemplos:
-Texto: "¿Qué me depara el futuro en el amor?" → Sí
-Texto: "Hola, ¿cómo estás?" → No
-Texto: "¿Debería tomar una decisión importante esta semana?" → Sí
-Texto: "El clima está agradable hoy." → No
-Texto: "Hablemos de criptomonedas." → No
-Texto: "Ahi va mi pregunta [pero no hace ninguna]" → No
-Si el usuario se disculpa, o te cuenta un chiste → No
-
-Responde únicamente: 'Sí' o 'No'""")
-        
-        raw_response = self.client.get_response([
-            {"role": "user", "content": question_prompt}
-        ])
-
-        response = 'sí' in raw_response.strip().lower()
+        response = self.guard_classifier.classify("is_valid_question", user_response)
+        if response is None:
+            response = self._llm_valid_question(user_response)
 
         print(f"\n{PASTEL_YELLOW}{THINKING} Es una pregunta válida para las cartas?{RESET} {response}")  # Imprime la respuesta completa para depuración
 
         return response
 
+    def _llm_valid_question(self, user_response):
+        raw_response = self._llm_guard("guard_valid_question", self.prompts.render("guard_text", text=user_response))
+        return 'sí' in raw_response.strip().lower()
+
     def is_anything_else_tool(self, user_response, issue):
         """Verifica si se ha añadido informacion util para la tirada."""
-        info_prompt = (
-            f""""Eres una pitonisa con más de 20 años de experiencia leyendo las cartas del tarot. 
-Se te ha hecho una consulta sobre este tema: {issue}.
-Ahora responde, ¿Es el siguiente texto un dato valioso para comprender la situación actual del consultante? 
-Texto: {user_response} 
-Ejemplos:
-Texto: "'Quiero saber sobre mi vida amorosa...'o 'Ahora no tengo novio...'" → Sí
-Texto: "Me gusta [algo o alguien]."  → Sí
-Texto: "Estoy pasando por un momento difícil y necesito claridad sobre mi futuro." → Sí
-Texto: "Hola, ¿cómo estás?" → No
-Texto: "Lorem ipsum dolor sit amet." → No
-Texto: "Ahi va lo que tengo que añadir [pero no dice nada]" → No
-Si el usuario se disculpa, o te cuenta un chiste → No
-
-Responde únicamente: 'Sí' o 'No'""")
-        
-        raw_response = self.client.get_response([
-            {"role": "user", "content": info_prompt}
-        ])
-
-        response = 'sí' in raw_response.strip().lower()
+        # Depende del tema de la consulta (`issue`), así que no hay atajo local: decide el LLM
+        response = self._llm_anything_else(user_response, issue)
 
         print(f"\n{PASTEL_YELLOW}{THINKING} Se ha añadido información?{RESET} {response}")  # Imprime la respuesta completa para depuración
 
         return response
 
+    def _llm_anything_else(self, user_response, issue):
+        raw_response = self._llm_guard("guard_anything_else", self.prompts.render("guard_issue_text", issue=issue, text=user_response))
+        return 'sí' in raw_response.strip().lower()
+
+    # Variantes asíncronas de las verificaciones (ver GuardPipeline)
+    async def _aguard(self, check, template, user_content, text):
+        """Clasificador local (en un hilo, es CPU) y, si no decide, la misma verificación sí/no con el LLM."""
+        verdict = None
+        if check is not None:
+            verdict = await asyncio.to_thread(self.guard_classifier.classify, check, text)
+        if verdict is None:
+            raw_response = await self.client.aget_response([
+                {"role": "system", "content": self.prompts.text(template)},
+                {"role": "user", "content": user_content}
+            ], route="guard")
+            verdict = 'sí' in raw_response.strip().lower()
+        return verdict
+
+    async def ais_comprensible_message_tool(self, user_response):
+        response = await self._aguard("is_comprensible_message", "guard_comprensible",
+                                      self.prompts.render("guard_text", text=user_response), user_response)
+        print(f"\n{PASTEL_YELLOW}{THINKING} Se entiende la respuesta?{RESET} {response}")
+        return response
+
+    async def ais_disrespectful_tool(self, user_response):
+        disrespectful = await self._aguard("is_disrespectful", "guard_disrespectful",
+                                           self.prompts.render("guard_text", text=user_response), user_response)
+        print(f"\n{THINKING} {PASTEL_YELLOW}Te está faltando al respeto?{RESET} {disrespectful}")
+        return disrespectful
+
+    async def ais_valid_question_tool(self, user_response):
+        response = await self._aguard("is_valid_question", "guard_valid_question",
+                                      self.prompts.render("guard_text", text=user_response), user_response)
+        print(f"\n{PASTEL_YELLOW}{THINKING} Es una pregunta válida para las cartas?{RESET} {response}")
+        return response
+
+    async def ais_anything_else_tool(self, user_response, issue):
+        response = await self._aguard(None, "guard_anything_else",
+                                      self.prompts.render("guard_issue_text", issue=issue, text=user_response), user_response)
+        print(f"\n{PASTEL_YELLOW}{THINKING} Se ha añadido información?{RESET} {response}")
+        return response
+
     def use_tool(self, tool_name, *args):
         """Invoca una herramienta registrada desde st.session_state con control de ejecución."""
         if tool_name in st.session_state.tools:
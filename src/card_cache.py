@@ -0,0 +1,122 @@
+import os
+import json
+import hashlib
+from src.llm_client import is_error_response
+from src.rate_limiter import BACKGROUND
+from src.resources import get_resource
+from src.utils.utils import PASTEL_YELLOW, PURPLE, RED, RESET
+
+SPREAD_NAME = "Pirámide Invertida de 6 cartas"
+
+
+def card_question(card):
+    """Pregunta que se lanza al RAG para obtener la información de una carta."""
+    return f"Dame toda la información sobre la carta {card}"
+
+
+def spread_question():
+    """Pregunta que se lanza al RAG para obtener la explicación de la tirada."""
+    return f"Explícame la reading '{SPREAD_NAME}'"
+
+
+class CardCache:
+    """
+    Caché en disco con el resumen de cada una de las 78 cartas y de la tirada.
+    Se construye una sola vez (offline) y queda invalidada si cambia el corpus de `context/`.
+    """
+    VERSION = 1
+
+    def __init__(self, cache_file="data/card_cache.json", data_dir="context"):
+        self.cache_file = cache_file
+        self.data_dir = data_dir
+        self.corpus_hash = None
+        self.entries = {}
+
+    @classmethod
+    def shared(cls, cache_file="data/card_cache.json", data_dir="context"):
+        """Devuelve la caché del proceso, leyendo el fichero solo la primera vez."""
+        def load():
+            cache = cls(cache_file, data_dir)
+            cache.load()
+            return cache
+        return get_resource(("card_cache", cache_file, data_dir), load)
+
+    @staticmethod
+    def compute_corpus_hash(data_dir):
+        """Calcula un hash estable del contenido de todos los documentos del corpus."""
+        digest = hashlib.sha256()
+        for file_name in sorted(os.listdir(data_dir)):
+            file_path = os.path.join(data_dir, file_name)
+            if not os.path.isfile(file_path):
+                continue
+            digest.update(file_name.encode("utf-8"))
+            with open(file_path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+        return digest.hexdigest()
+
+    def load(self):
+        """
+        Carga la caché desde disco si existe, es de la versión actual y corresponde al corpus.
+        Devuelve True si quedó cargada.
+        """
+        if not os.path.exists(self.cache_file):
+            print(f"{PASTEL_YELLOW}📜 No existe la caché de cartas:{RESET} {self.cache_file}")
+            return False
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"{RED}Error al leer la caché de cartas:{RESET} {e}")
+            return False
+
+        corpus_hash = self.compute_corpus_hash(self.data_dir)
+        if data.get("version") != self.VERSION or data.get("corpus_hash") != corpus_hash:
+            print(f"{PASTEL_YELLOW}📜 La caché de cartas está desactualizada, se ignora.{RESET}")
+            return False
+
+        self.corpus_hash = corpus_hash
+        self.entries = data.get("entries", {})
+        print(f"🃏 {PURPLE}Caché de cartas cargada con {len(self.entries)} entradas.{RESET}")
+        return True
+
+    def get(self, card):
+        """Devuelve la información precalculada de una carta o None."""
+        return self.entries.get(card)
+
+    def get_spread(self):
+        """Devuelve la explicación precalculada de la tirada o None."""
+        return self.entries.get(SPREAD_NAME)
+
+    def build(self, tarot_reader):
+        """Resume todas las cartas y la tirada con el RAG y guarda el resultado."""
+        names = list(tarot_reader.tarot_cards) + [SPREAD_NAME]
+        questions = [card_question(card) for card in tarot_reader.tarot_cards] + [spread_question()]
+        # Trabajo en segundo plano: cede el presupuesto del LLM a las consultas de los usuarios
+        answers = tarot_reader.rag_questions(questions, priority=BACKGROUND, cards=list(tarot_reader.tarot_cards) + [None])
+
+        self.corpus_hash = self.compute_corpus_hash(self.data_dir)
+        self.entries = {name: answer for name, answer in zip(names, answers) if not is_error_response(answer)}
+        missing = len(names) - len(self.entries)
+        if missing:
+            print(f"{RED}⚠️ {missing} entradas no se pudieron generar; se resolverán con el RAG en cada tirada.{RESET}")
+        self.save()
+
+    def save(self):
+        """Escribe la caché de forma atómica."""
+        directory = os.path.dirname(self.cache_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        data = {"version": self.VERSION, "corpus_hash": self.corpus_hash, "entries": self.entries}
+        tmp_file = f"{self.cache_file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.cache_file)
+        print(f"📑 Caché de cartas guardada en {self.cache_file} ({len(self.entries)} entradas)")
+
+
+if __name__ == "__main__":
+    from src.tarot_reader import TarotReader
+
+    cache = CardCache()
+    cache.build(TarotReader())
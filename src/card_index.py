@@ -0,0 +1,194 @@
+import re
+import json
+import time
+import unicodedata
+import numpy as np
+from src.utils.utils import PURPLE, RESET
+
+# Las 78 cartas del Tarot con el nombre que usa la aplicación
+MAJOR_ARCANA = [
+    "El Loco", "El Mago", "La Sacerdotisa", "La Emperatriz", "El Emperador",
+    "El Hierofante", "Los Enamorados", "El Carro", "La Justicia", "El Ermitaño",
+    "La Rueda de la Fortuna", "La Fuerza", "El Colgado", "La Muerte", "La Templanza",
+    "El Diablo", "La Torre", "La Estrella", "La Luna", "El Sol", "El Juicio", "El Mundo",
+]
+RANKS = ["As", "Dos", "Tres", "Cuatro", "Cinco", "Seis", "Siete", "Ocho", "Nueve", "Diez",
+         "Sota", "Caballo", "Reina", "Rey"]
+SUITS = ["Bastos", "Copas", "Espadas", "Oros"]
+TAROT_CARDS = MAJOR_ARCANA + [f"{rank} de {suit}" for suit in SUITS for rank in RANKS]
+
+# Otros nombres con los que aparecen las cartas en los documentos (traducciones y barajas)
+MAJOR_ALIASES = {
+    "El Loco": ["the fool"],
+    "El Mago": ["el prestidigitador", "the magician"],
+    "La Sacerdotisa": ["la papisa", "la suma sacerdotisa", "the high priestess"],
+    "La Emperatriz": ["the empress"],
+    "El Emperador": ["the emperor"],
+    "El Hierofante": ["el papa", "el sumo sacerdote", "the hierophant"],
+    "Los Enamorados": ["los amantes", "el enamorado", "the lovers"],
+    "El Carro": ["la carroza", "the chariot"],
+    "La Justicia": ["justice"],
+    "El Ermitaño": ["the hermit"],
+    "La Rueda de la Fortuna": ["rueda de la fortuna", "wheel of fortune"],
+    "La Fuerza": ["strength"],
+    "El Colgado": ["el ahorcado", "the hanged man"],
+    "La Muerte": ["death"],
+    "La Templanza": ["temperance"],
+    "El Diablo": ["the devil"],
+    "La Torre": ["the tower"],
+    "La Estrella": ["the star"],
+    "La Luna": ["the moon"],
+    "El Sol": ["the sun"],
+    "El Juicio": ["el juicio final", "judgement", "judgment"],
+    "El Mundo": ["the world"],
+}
+RANK_ALIASES = {
+    "As": ["1", "uno", "ace"], "Dos": ["2", "two"], "Tres": ["3", "three"], "Cuatro": ["4", "four"],
+    "Cinco": ["5", "five"], "Seis": ["6", "six"], "Siete": ["7", "seven"], "Ocho": ["8", "eight"],
+    "Nueve": ["9", "nine"], "Diez": ["10", "ten"], "Sota": ["paje", "page"],
+    "Caballo": ["caballero", "knight"], "Reina": ["queen"], "Rey": ["king"],
+}
+SUIT_ALIASES = {
+    "Bastos": ["basto", "varas", "wands", "rods"],
+    "Copas": ["copa", "cups"],
+    "Espadas": ["espada", "swords"],
+    "Oros": ["oro", "pentaculos", "pentacles", "coins", "discos"],
+}
+
+# Ruido típico del OCR: palabras partidas a final de línea y ceros en lugar de oes ("0ros")
+HYPHENATION_RE = re.compile(r"(\w)-\s*\n\s*(\w)")
+ZERO_AS_O_RE = re.compile(r"(?<=[a-zA-Z])0|0(?=[a-zA-Z])")
+WORD_RE = re.compile(r"[^\W_]+")
+
+# Versión de las reglas de etiquetado: los fragmentos etiquetados con otra se vuelven a etiquetar al cargar
+CARD_TAGS_VERSION = 2
+
+# Palabras que identifican por sí solas un Arcano Mayor. Los demás nombres ("el mundo", "la fuerza",
+# "el sol"...) son también frases corrientes y solo cuentan como carta si van en mayúscula o cerca
+# de "carta"/"arcano".
+DISTINCTIVE_WORDS = frozenset((
+    "sacerdotisa", "papisa", "emperatriz", "emperador", "hierofante", "ermitano", "fortuna", "colgado",
+    "ahorcado", "templanza", "carroza", "prestidigitador", "priestess", "empress", "emperor",
+    "hierophant", "hermit", "hanged", "temperance", "chariot", "magician",
+))
+ARTICLES = frozenset(("el", "la", "los", "las", "the", "de", "of"))
+CONTEXT_WORDS = frozenset(("carta", "cartas", "arcano", "arcanos", "naipe", "lamina", "card", "cards", "trump"))
+CONTEXT_WINDOW = 6
+
+
+def _fold(word):
+    """Palabra en minúsculas y sin tildes."""
+    word = unicodedata.normalize("NFKD", word.lower())
+    return "".join(char for char in word if not unicodedata.combining(char))
+
+
+def words(text):
+    """Palabras del texto como pares (original, normalizada), sin el ruido del OCR."""
+    text = ZERO_AS_O_RE.sub("o", HYPHENATION_RE.sub(r"\1\2", text))
+    return [(word, _fold(word)) for word in WORD_RE.findall(text)]
+
+
+def _card_aliases():
+    """Alias (tupla de palabras normalizadas) -> carta, en español e inglés."""
+    aliases = {}
+    for card in MAJOR_ARCANA:
+        for alias in [card] + MAJOR_ALIASES[card]:
+            aliases[tuple(folded for _, folded in words(alias))] = card
+    for suit in SUITS:
+        for rank in RANKS:
+            card = f"{rank} de {suit}"
+            for rank_alias in [rank] + RANK_ALIASES[rank]:
+                for suit_alias in [suit] + SUIT_ALIASES[suit]:
+                    for joiner in ("de", "of"):
+                        aliases[tuple(folded for _, folded in words(f"{rank_alias} {joiner} {suit_alias}"))] = card
+    return aliases
+
+
+CARD_ALIASES = _card_aliases()
+SUIT_NAMES = {_fold(alias): suit for suit in SUITS for alias in [suit] + SUIT_ALIASES[suit]}
+ALIAS_WORDS = frozenset(word for alias in CARD_ALIASES for word in alias) | frozenset(SUIT_NAMES)
+MINOR_CARDS = frozenset(TAROT_CARDS[len(MAJOR_ARCANA):])
+
+# Alias agrupados por su primera palabra, los más largos primero ("el juicio final" antes que "el juicio")
+_ALIASES_BY_FIRST = {}
+for _alias in sorted(CARD_ALIASES, key=len, reverse=True):
+    _ALIASES_BY_FIRST.setdefault(_alias[0], []).append(_alias)
+
+
+def _join_splits(tokens):
+    """
+    Une las palabras que el OCR partió con un espacio ("Carro za" -> "Carroza") cuando juntas forman
+    una palabra de algún alias y por separado no son las dos palabras de alias.
+    """
+    joined = []
+    i = 0
+    while i < len(tokens):
+        if i + 1 < len(tokens):
+            (raw, folded), (next_raw, next_folded) = tokens[i], tokens[i + 1]
+            merged = folded + next_folded
+            if (len(merged) >= 5 and merged in ALIAS_WORDS
+                    and not (folded in ALIAS_WORDS and next_folded in ALIAS_WORDS)):
+                joined.append((raw + next_raw, merged))
+                i += 2
+                continue
+        joined.append(tokens[i])
+        i += 1
+    return joined
+
+
+def _is_card_mention(alias, card, tokens, start):
+    """Los nombres ambiguos solo cuentan en mayúscula ("el Mundo", "EL MUNDO") o tras "carta"/"arcano"."""
+    if card in MINOR_CARDS or DISTINCTIVE_WORDS.intersection(alias):
+        return True
+    nouns = [raw for raw, folded in tokens[start:start + len(alias)] if folded not in ARTICLES]
+    if nouns and all(raw[0].isupper() for raw in nouns):
+        return True
+    return any(folded in CONTEXT_WORDS for _, folded in tokens[max(0, start - CONTEXT_WINDOW):start])
+
+
+def tag_chunk(text):
+    """Cartas y palos que menciona un fragmento, en orden de aparición y sin repetir."""
+    tokens = _join_splits(words(text))
+    folded_tokens = [folded for _, folded in tokens]
+    cards, suits = {}, {}  # dicts como conjuntos ordenados
+    for i, folded in enumerate(folded_tokens):
+        if folded in SUIT_NAMES:
+            suits[SUIT_NAMES[folded]] = None
+        for alias in _ALIASES_BY_FIRST.get(folded, ()):
+            if tuple(folded_tokens[i:i + len(alias)]) == alias:
+                card = CARD_ALIASES[alias]
+                if _is_card_mention(alias, card, tokens, i):
+                    cards[card] = None
+                break
+    return {"cards": list(cards), "suits": list(suits), "card_tags_version": CARD_TAGS_VERSION}
+
+
+class CardIndex:
+    """
+    Postings de cartas: nombre -> ids de chunk que la mencionan.
+
+    Las etiquetas se calculan al indexar (metadatos "cards" y "suits" de cada fragmento), así que
+    los fragmentos candidatos de una carta salen de una consulta a un diccionario.
+    """
+    def __init__(self, postings):
+        self.postings = {name: np.asarray(ids, dtype=np.int64) for name, ids in postings.items()}
+
+    @classmethod
+    def from_chunk_store(cls, chunk_store):
+        started = time.perf_counter()
+        postings = {}
+        for row, chunk_id in enumerate(chunk_store.ids):
+            metadata = json.loads(chunk_store.metadata[row])
+            # Fragmentos indexados sin etiquetas o con otras reglas: se etiquetan ahora
+            if metadata.get("card_tags_version") != CARD_TAGS_VERSION:
+                metadata = tag_chunk(chunk_store.texts[row])
+            for card in metadata["cards"]:
+                postings.setdefault(card, []).append(int(chunk_id))
+        index = cls(postings)
+        print(f"🃏 {PURPLE}Índice de cartas construido: {sum(name in postings for name in TAROT_CARDS)} cartas "
+              f"en {len(chunk_store)} fragmentos ({(time.perf_counter() - started) * 1000:.0f} ms).{RESET}")
+        return index
+
+    def lookup(self, card):
+        """Ids de chunk que mencionan la carta (vacío si no aparece o no es una carta conocida)."""
+        return self.postings.get(card, np.zeros(0, dtype=np.int64))
@@ -1,18 +1,67 @@
 import streamlit as st
-import base64
 from src.assistant import Assistant
 from src.chat_history import ChatHistory
+from src.conversation_summary import ConversationSummarizer
 from src.flow_manager import FlowManager
+from src.session_store import Session
+from src.static_assets import asset_url
 from src.rag import RAG
-from src.chat_history import ChatHistory
-from src.utils.utils import get_env_key, BLUE, BRIGHT_WHITE, PASTEL_YELLOW, RESET
+from src.guard_pipeline import GuardPipeline
+from src.resources import get_resource
+from src.config import get_config
+from src.prompt_registry import PromptRegistry
+from src.llm_client import LlmResponseError, is_error_response
+from src.utils.utils import BLUE, BRIGHT_WHITE, PASTEL_YELLOW, RESET
 
-class ChatApp:
-    """Clase principal que orquesta el funcionamiento de la aplicación."""
-    def __init__(self):        
-        
+class ChatCore:
+    """
+    Parte de la aplicación que no depende de la sesión: asistente, RAG, pipeline de verificaciones,
+    resumidor, plantillas de prompts y avatares. Se crea una sola vez por proceso y no se modifica después,
+    así que la comparten todas las sesiones y cada rerun de Streamlit solo construye el ChatApp.
+    """
+    def __init__(self):
+        # Si falta alguna clave obligatoria del .env, se avisa al arrancar y no a mitad de la conversación
+        get_config().validate()
         self.assistant = Assistant()
-        self.history = ChatHistory()
+        self.rag = RAG()
+        # Verificaciones del turno en paralelo
+        self.guard_pipeline = GuardPipeline.shared()
+        self.summarizer = ConversationSummarizer(self.assistant.client)
+        self.laila_avatar = asset_url("img/laila_avatar.webp")
+        self.user_avatar = asset_url("img/user.png")
+
+    @classmethod
+    def shared(cls):
+        return get_resource("chat_core", cls)
+
+
+class ChatApp:
+    """
+    Controlador de una sesión: orquesta el flujo de la conversación sobre el ChatCore compartido.
+    Se construye en cada rerun, así que solo lee el estado de la sesión.
+    """
+    # Estados del flujo y el método que los maneja
+    STATE_ACTIONS = {
+        "INTRODUCTION": "handle_flowstate_introduction",
+        "QUESTION_1": "handle_flowstate_question_1",
+        "QUESTION_2": "handle_flowstate_question_2",
+        "PREPARE": "handle_flowstate_prepare",
+        "TAROT": "handle_flowstate_tarot",
+        "CLARIFICATIONS": "handle_flowstate_clarifications",
+        "FINISH": "handle_final_response",
+    }
+
+    def __init__(self, core=None):
+        self.core = core or ChatCore.shared()
+        self.assistant = self.core.assistant
+        self.rag = self.core.rag
+        self.guard_pipeline = self.core.guard_pipeline
+        self.config = get_config()  # en memoria; se recarga sola si cambia el .env
+        self.prompts = PromptRegistry.shared()  # en memoria; se recarga si cambian los prompts
+
+        # Sesión persistente: restaura la conversación si el usuario vuelve (o llega a otra réplica)
+        self.session = Session.current()
+        self.history = ChatHistory(summarizer=self.core.summarizer, session=self.session)
         self.initialize_session_state()  # Llamado al inicio para asegurar estado inicializado
 
         # Asignar valores desde session_state al objeto
@@ -20,25 +69,15 @@ class ChatApp:
         self.info = st.session_state.info
 
         # Configurar el flujo del paso
-        self.flow_manager = FlowManager(st.session_state.step, max_steps=6)
+        self.flow_manager = FlowManager(st.session_state.step, max_steps=6, session=self.session)
         self.step = self.flow_manager.current_step + 1
 
-        # Cargar imágenes
-        self.laila_avatar = self.load_image_as_base64("frontend/static/img/laila_avatar.webp")
-        self.user_avatar = self.load_image_as_base64("frontend/static/img/user.png")
-
-        # Definir los estados y acciones del flujo
-        self.state_actions = {
-            "INTRODUCTION": self.handle_flowstate_introduction,
-            "QUESTION_1": self.handle_flowstate_question_1,
-            "QUESTION_2": self.handle_flowstate_question_2,
-            "PREPARE": self.handle_flowstate_prepare,
-            "TAROT": self.handle_flowstate_tarot,
-            "CLARIFICATIONS": self.handle_flowstate_clarifications,
-            "FINISH": self.handle_final_response
-        }
+        # Imágenes ya cargadas por el core
+        self.laila_avatar = self.core.laila_avatar
+        self.user_avatar = self.core.user_avatar
 
-        self.rag = RAG()
+        # Resultados de las verificaciones del turno ya calculados
+        self.guard_results = {}
 
     def initialize_session_state(self):
         """Inicializar todas las claves del estado de sesión en un solo lugar, incluyendo las tools."""
@@ -49,7 +88,6 @@ class ChatApp:
             "step": 0,
             "flow_state": "INTRODUCTION",
             "welcome_shown": False,
-            "messages": [],
             "disabled": False,
             "executing": False,  # Control estricto de ejecución
             "country_info": None,  
@@ -58,51 +96,62 @@ class ChatApp:
 
         # Inicializar tools solo si no están ya registradas
         if "tools" not in st.session_state:
-            st.session_state.tools = {
-                "detect_country": self.assistant.detect_country_tool,
-                "generate_welcome_message": self.assistant.generate_welcome_message_tool,
-                "is_comprensible_message": self.assistant.is_comprensible_message_tool,
-                "is_disrespectful": self.assistant.is_disrespectful_tool,
-                "laila_tarot_reading": self.assistant.laila_tarot_reading_tool
-            }
-
-        # Inicializar las claves predeterminadas
+            st.session_state.tools = self.assistant.tools
+
+        # Inicializar las claves predeterminadas (las persistentes ya las ha restaurado Session.current)
         for key, value in defaults.items():
             if key not in st.session_state:
                 st.session_state[key] = value
 
-    def load_image_as_base64(self, path):
-        """Carga una imagen y la convierte a base64."""
-        with open(path, "rb") as img_file:
-            return f"data:image/png;base64,{base64.b64encode(img_file.read()).decode()}"
+    def guard_checks(self, user_message):
+        """
+        Verificaciones del turno por orden de prioridad: (nombre, corrutina, args, valor descalificante).
+        Incluye la verificación propia del estado actual del flujo.
+        """
+        tools = self.assistant.guard_tools
+        checks = [
+            ("is_comprensible_message", tools["is_comprensible_message"], (user_message,), False),
+            ("is_disrespectful", tools["is_disrespectful"], (user_message,), True),
+        ]
+        if st.session_state.flow_state == "QUESTION_1":
+            checks.append(("is_valid_question", tools["is_valid_question"], (user_message,), False))
+        elif st.session_state.flow_state == "QUESTION_2":
+            checks.append(("is_anything_else", tools["is_anything_else"], (user_message, self.asking), False))
+        return checks
+
+    def guard_result(self, tool_name, *args):
+        """Resultado de una verificación ya lanzada por el pipeline del turno, o la ejecuta."""
+        if tool_name in self.guard_results:
+            return self.guard_results[tool_name]
+        return self.assistant.use_tool(tool_name, *args)
 
     def advance_local_step(self):
-        st.session_state.step += 1
+        self.session.set("step", st.session_state.step + 1)
 
     def advance_flowstate(self, state):
         """Actualiza el estado del flujo tanto en la clase como en la sesión de Streamlit."""
         print(f"\n➡️ {BLUE} Actualizando estado:{RESET} {st.session_state.flow_state} >> {state}{RESET}")
-        st.session_state.flow_state = state
+        self.session.set("flow_state", state)
 
     def handle_flowstate_introduction(self):
         """Manejador del estado INTRODUCTION."""   
         self.advance_local_step()     
         print(f"\n{PASTEL_YELLOW}🔮 Interacción:{RESET} {self.step} {PASTEL_YELLOW}Paso activo:{RESET} {st.session_state.flow_state}")
         self.advance_flowstate("QUESTION_1")
-        self.history.add_message("user", content=get_env_key('PROMPT_QUESTION_1'), hidden=True)
+        self.history.add_message("user", content=self.config.prompt_question_1, hidden=True)
         self.laila_response(tone="solemne y cariñosa")
 
     def handle_flowstate_question_1(self):
         """Manejador del estado QUESTION_1."""
         self.advance_local_step()
         print(f"\n{PASTEL_YELLOW}🔮 Interacción:{RESET} {self.step} {PASTEL_YELLOW}Paso activo:{RESET} {st.session_state.flow_state}")
-        st.session_state.asking = self.history.get_messages()[-1]["content"]
+        self.session.set("asking", self.history.get_last_message().content)
         self.asking = st.session_state.asking
         print(f"\n{PASTEL_YELLOW}🦉 El usuario dijo (self.asking):{RESET} {self.asking}")
-        valid_question = self.assistant.use_tool("is_valid_question", {self.asking})
+        valid_question = self.guard_result("is_valid_question", self.asking)
         if valid_question:
             self.advance_flowstate("QUESTION_2")
-            self.history.add_message("user", content=get_env_key('PROMPT_QUESTION_2'), hidden=True)
+            self.history.add_message("user", content=self.config.prompt_question_2, hidden=True)
             self.laila_response()
         else:
             self.laila_response("impaciente")
@@ -111,16 +160,16 @@ class ChatApp:
         """Manejador del estado QUESTION_2."""
         self.advance_local_step()
         print(f"\n{PASTEL_YELLOW}🔮 Interacción:{RESET} {self.step} {PASTEL_YELLOW}Paso activo:{RESET} {st.session_state.flow_state}") 
-        st.session_state.info = self.history.get_messages()[-1]["content"]
+        self.session.set("info", self.history.get_last_message().content)
         self.info = st.session_state.info
         print(f"\n{PASTEL_YELLOW}🦉 El usuario dijo (self.info):{RESET} {self.info}")
-        is_anything_else = self.assistant.use_tool("is_anything_else",{self.info},{self.asking})
+        is_anything_else = self.guard_result("is_anything_else", self.info, self.asking)
         if is_anything_else:
             self.advance_flowstate("PREPARE")
             response = self.rag.ask_question("¿En que consiste la piramide invertida de 6 cartas?")
             # print(f"{BRIGHT_GREEN}Contexto: {response}{RESET}")
             self.history.add_message("system", content=response, hidden=True)  
-            self.history.add_message("user", content=get_env_key('PROMPT_PREPARE'), hidden=True)
+            self.history.add_message("user", content=self.config.prompt_prepare, hidden=True)
             self.laila_response("solemne")
         else:
             self.history.add_message("user", content=f"Lo que se te ha dicho no aporta informacion a la pregunta que fue: {self.asking}", hidden=True)
@@ -131,7 +180,7 @@ class ChatApp:
         self.advance_local_step()
         print(f"\n{PASTEL_YELLOW}🔮 Interacción:{RESET} {self.step} {PASTEL_YELLOW}Paso activo:{RESET} {st.session_state.flow_state}")
         self.advance_flowstate("TAROT")
-        last_message = self.history.get_messages()[-1]["content"]
+        last_message = self.history.get_last_message().content
         print(f"\n{PASTEL_YELLOW}🦉 El usuario dijo:{RESET} {last_message}")
         tirada = self.assistant.use_tool("laila_tarot_reading", self.asking, self.info)
         self.history.add_message("assistant", content=tirada, hidden=True)
@@ -141,7 +190,7 @@ class ChatApp:
         """Manejador del estado TAROT."""
         self.advance_local_step()
         print(f"\n{PASTEL_YELLOW}🔮 Interacción:{RESET} {self.step} {PASTEL_YELLOW}Paso activo:{RESET} {st.session_state.flow_state}")
-        last_message = self.history.get_messages()[-1]["content"]
+        last_message = self.history.get_last_message().content
         print(f"\n{PASTEL_YELLOW}🦉 El usuario dijo:{RESET} {last_message}")
         self.laila_response("dramatica y solemne") 
 
@@ -149,26 +198,41 @@ class ChatApp:
         """Manejador del estado CLARIFICATIONS."""
         self.advance_local_step()
         print(f"\n{PASTEL_YELLOW}🔮 Interacción:{RESET} {self.step} {PASTEL_YELLOW}Paso activo:{RESET} {st.session_state.flow_state}")
-        last_message = self.history.get_messages()[-1]["content"]
+        last_message = self.history.get_last_message().content
         print(f"\n{PASTEL_YELLOW}🦉 El usuario dijo:{RESET} {last_message}")
-        self.history.add_message("user", content=get_env_key('PROMPT_CLARIFICATIONS'), hidden=True)
+        self.history.add_message("user", content=self.config.prompt_clarifications, hidden=True)
         self.laila_response("empatica")       
 
     def handle_final_response(self):
         """Manejador del estado FINISH."""
         self.advance_local_step()
         print(f"\n{PASTEL_YELLOW}🔮 Interacción:{RESET} {self.step} {PASTEL_YELLOW}Paso activo:{RESET} {st.session_state.flow_state}")
-        self.history.add_message("user", content=get_env_key('PROMPT_FINISH'), hidden=True)
+        self.history.add_message("user", content=self.config.prompt_finish, hidden=True)
         self.laila_response("dramática")
 
     def laila_response(self, tone="solemne", hidden=False):
         """Procesa y muestra la respuesta del asistente."""
-        self.history.add_message("user", content=f"Sin perder tu habitual dramatismo místico y teatralidad, adoptas un tono {tone}", hidden=True)
-        history = self.history.get_messages()
-        response = self.assistant.client.get_response(history)
-        if not hidden:            
-            st.chat_message("assistant",  avatar=self.laila_avatar).markdown(f"{response}")
+        self.history.add_message("user", content=self.prompts.render("tone", tone=tone), hidden=True)
+        client = self.assistant.client
+        # De las instrucciones de tono solo cuenta la última: se reconocen por su prefijo fijo
+        tone_prefix = self.prompts.get("tone").static_prefix
+        history = self.history.get_context_messages(client.context_budget, client.prompt_budget("chat"), (tone_prefix,))
+        # Una respuesta fallida (o cortada a medias) no se guarda: se enviaría al LLM en los turnos siguientes
+        if not hidden:
+            # Se muestran los tokens según llegan; write_stream devuelve el texto completo
+            stream = self.assistant.client.stream_response(history, use_cache=False)
+            try:
+                response = st.chat_message("assistant",  avatar=self.laila_avatar).write_stream(stream)
+            except LlmResponseError as e:
+                st.error(e.message)
+                return
+        else:
+            response = self.assistant.client.get_response(history, use_cache=False)
+            if is_error_response(response):
+                return
         self.history.add_message("assistant", content=response, hidden=hidden)
+        # Con la respuesta ya mostrada, el resumen de los mensajes antiguos sigue en segundo plano
+        self.history.schedule_summary()
     
     def laila_reading(self, text):
         st.chat_message("assistant",  avatar=self.laila_avatar).markdown(f"{text}")
@@ -230,10 +294,10 @@ class ChatApp:
         """Ejecuta la aplicación de chat con control para evitar ejecución doble."""
         # Control estricto de inicialización
         if not st.session_state.get("app_initialized", False):
-            st.session_state.app_initialized = True
+            self.session.set("app_initialized", True)
             welcome_message = self.assistant.use_tool("generate_welcome_message")
             self.history.add_message("assistant", welcome_message)
-            st.session_state.welcome_shown = True
+            self.session.set("welcome_shown", True)
 
         # Evitar doble ejecución con control explícito de reinicio
         if st.session_state.get("executing", False):
@@ -255,14 +319,16 @@ class ChatApp:
             if not st.session_state.disabled:
                 self.history.add_message("user", content=prompt)            
                 st.chat_message("user", avatar=self.user_avatar).markdown(prompt)
-                user_message = self.history.get_messages()[-1]["content"]
-                comprensible_message = self.assistant.use_tool("is_comprensible_message", user_message)
+                user_message = self.history.get_last_message().content
+                # Todas las verificaciones del turno se lanzan a la vez
+                self.guard_results = self.guard_pipeline.run(self.guard_checks(user_message))
+                comprensible_message = self.guard_results["is_comprensible_message"]
                 if comprensible_message:
-                    disrespectful_message = self.assistant.use_tool("is_disrespectful", user_message)
+                    disrespectful_message = self.guard_results["is_disrespectful"]
                     if not disrespectful_message:
                         current_state = st.session_state.flow_state
-                        if current_state in self.state_actions:
-                            self.state_actions[current_state]()
+                        if current_state in self.STATE_ACTIONS:
+                            getattr(self, self.STATE_ACTIONS[current_state])()
                         else:
                             st.error(f"Estado desconocido: {current_state}")
                     else:
@@ -277,10 +343,12 @@ class ChatApp:
                     self.laila_response("extrañada, confusa, impaciente y teatral")
             else:
                 st.chat_message("user", avatar=self.user_avatar).markdown(prompt)
-                user_message = self.history.get_messages()[-1]["content"]
-                self.history.add_message("user", content=get_env_key('PROMPT_FINISH'), hidden=True)
+                user_message = self.history.get_last_message().content
+                self.history.add_message("user", content=self.config.prompt_finish, hidden=True)
                 self.laila_response("excéntrica y teatral")
             
+        # El turno queda guardado antes de terminar el rerun: al reconectar a otra réplica ya está
+        self.session.flush()
         # Reset para permitir futuras ejecuciones controladas
         st.session_state.executing = False
 
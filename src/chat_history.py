@@ -1,45 +1,115 @@
 import streamlit as st
-import base64
-from src.utils.utils import get_env_key, THINKING, BRIGHT_GREEN, TURQUOISE, PASTEL_YELLOW, SPARKLES, RESET, RED, RAISED_HAND
+from src.message_store import MessageStore
+from src.static_assets import asset_url
+from src.utils.utils import THINKING, BRIGHT_GREEN, TURQUOISE, PASTEL_YELLOW, SPARKLES, RESET, RED, RAISED_HAND
 
 
 
 class ChatHistory:
     """Clase para manejar el histórico de mensajes."""
-    def __init__(self):
-        # Cargar y convertir imagen local
-        with open("frontend/static/img/laila_avatar.webp", "rb") as image_laila:
-            self.laila_avatar = f"data:image/png;base64,{base64.b64encode(image_laila.read()).decode()}"
-        with open("frontend/static/img/user.png", "rb") as image_user:
-            self.user_avatar = f"data:image/png;base64,{base64.b64encode(image_user.read()).decode()}"
+    def __init__(self, summarizer=None, session=None):
+        # Avatares cargados una sola vez por proceso (o servidos como ficheros estáticos)
+        self.laila_avatar = asset_url("img/laila_avatar.webp")
+        self.user_avatar = asset_url("img/user.png")
         self.avatar = self.laila_avatar
 
+        # Si hay sesión (ver Session), los mensajes y el resumen se guardan también fuera del proceso
+        self.session = session
         if "messages" not in st.session_state:
-            st.session_state.messages = []
+            st.session_state.messages = MessageStore()
+
+        # Resumen de los mensajes más antiguos (ver ConversationSummarizer) y hasta dónde llega
+        self.summarizer = summarizer
+        if "summary" not in st.session_state:
+            st.session_state.summary = None
+            st.session_state.summary_upto = 0
+        # Resumen en curso en segundo plano: (summary_upto al lanzarlo, Future)
+        if "summary_job" not in st.session_state:
+            st.session_state.summary_job = None
 
     def add_message(self, role, content, hidden=False):
         """Añade un mensaje al historial."""
-        st.session_state.messages.append({"role": role, "content": content, "hidden": hidden})
+        if self.session is not None:
+            self.session.append_message(role, content, hidden)
+        else:
+            st.session_state.messages.append(role, content, hidden)
 
     def get_messages(self):
-        """Obtiene todos los mensajes, eliminando la propiedad `hidden`."""
-        return [{"role": msg["role"], "content": msg["content"]} for msg in st.session_state.messages]
+        """Obtiene todos los mensajes, sin la propiedad `hidden` (lista compartida, no modificar)."""
+        return st.session_state.messages.all()
+
+    def get_last_message(self):
+        """Último mensaje del historial (Message), o None si está vacío."""
+        return st.session_state.messages.last()
+
+    def schedule_summary(self):
+        """
+        Lanza en segundo plano el resumen de los mensajes antiguos pendientes si se ha pasado el umbral.
+        No espera: el resumen se usa cuando esté listo, a partir del turno siguiente (ver apply_summary).
+        """
+        self.apply_summary()
+        if self.summarizer is None or st.session_state.summary_job is not None:
+            return
+        messages = st.session_state.messages
+        upto = st.session_state.summary_upto
+        if not self.summarizer.should_update(len(messages) - upto):
+            return
+        end = len(messages) - self.summarizer.keep_recent
+        st.session_state.summary_job = (upto, self.summarizer.submit(st.session_state.summary, messages[upto:end]))
+
+    def apply_summary(self):
+        """Incorpora el resumen en segundo plano si ya ha terminado, sin esperarlo."""
+        job = st.session_state.summary_job
+        if job is None or not job[1].done():
+            return
+        st.session_state.summary_job = None
+        upto, future = job
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"{RED}No se pudo actualizar el resumen:{RESET} {e}")
+            return
+        # Si entretanto se ha restaurado otra sesión o cambiado el resumen, este ya no vale
+        if result is not None and upto == st.session_state.summary_upto:
+            summary, included = result
+            self._set("summary", summary)
+            self._set("summary_upto", upto + included)
+
+    def _set(self, key, value):
+        if self.session is not None:
+            self.session.set(key, value)
+        else:
+            st.session_state[key] = value
+
+    def get_context_messages(self, context_budget, max_tokens=None, stale_prefixes=()):
+        """
+        Obtiene los mensajes para el prompt ajustados al presupuesto de tokens (ver ContextBudget).
+        Los mensajes ya resumidos se sustituyen por el resumen de la conversación.
+        """
+        self.apply_summary()
+        records = st.session_state.messages[st.session_state.summary_upto:]
+        if not st.session_state.summary:
+            return context_budget.fit_messages(records, max_tokens, stale_prefixes)
+
+        summary = {"role": "system", "content": f"## RESUMEN DE LA CONVERSACIÓN:\n{st.session_state.summary}"}
+        max_tokens = (max_tokens or context_budget.max_prompt_tokens) - context_budget.count_messages([summary])
+        return [summary] + context_budget.fit_messages(records, max_tokens, stale_prefixes)
 
     def get_visible_messages(self):
-        """Obtiene solo los mensajes que no están ocultos."""
-        return [msg for msg in st.session_state.messages if not msg.get("hidden", False)]
+        """Obtiene solo los mensajes que no están ocultos (lista compartida, no modificar)."""
+        return st.session_state.messages.visible()
 
     def display_message(self, message):
         """Muestra un único mensaje."""
         # print(f"{PASTEL_YELLOW}🔮 Mensaje de: {RESET}{message["role"]}\n {PASTEL_YELLOW}")
         
-        if message["role"] == "user":
+        if message.role == "user":
             self.avatar = self.user_avatar
         else:
             self.avatar = self.laila_avatar
 
-        with st.chat_message(message["role"],avatar=self.avatar):
-            st.markdown(message["content"])
+        with st.chat_message(message.role,avatar=self.avatar):
+            st.markdown(message.content)
 
     def display_messages(self):
         """Muestra solo los mensajes visibles del historial."""
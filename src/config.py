@@ -0,0 +1,182 @@
+import os
+import time
+import threading
+from pathlib import Path
+from dotenv import dotenv_values
+from src.utils.utils import RED, CROSS_MARK, PASTEL_YELLOW, RESET
+
+ENV_FILE = Path(__file__).resolve().parents[1] / ".env"
+
+# Variables del entorno del proceso al arrancar: tienen prioridad sobre el .env
+_PROCESS_ENV = dict(os.environ)
+
+# Claves sin las que la aplicación de chat no puede arrancar
+REQUIRED_KEYS = (
+    "PROMPT_FILE", "PROMPT_INTRO", "PROMPT_QUESTION_1", "PROMPT_QUESTION_2",
+    "PROMPT_PREPARE", "PROMPT_CLARIFICATIONS", "PROMPT_FINISH",
+)
+
+
+def _bool(value):
+    return str(value).strip().lower() in ("1", "true", "yes")
+
+
+class Config:
+    """
+    Configuración de la aplicación (.env y variables de entorno), ya convertida a su tipo.
+    Es inmutable: si el .env cambia se crea otra y get_config() pasa a devolver la nueva.
+    """
+    def __init__(self, values, file_values=None):
+        self.values = values
+        # Claves que vienen del .env (las que export() pasa a os.environ)
+        self.file_values = file_values or {}
+
+        # Prompts
+        self.prompt_file = values.get("PROMPT_FILE")
+        self.prompt_intro = values.get("PROMPT_INTRO")
+        self.prompt_question_1 = values.get("PROMPT_QUESTION_1")
+        self.prompt_question_2 = values.get("PROMPT_QUESTION_2")
+        self.prompt_prepare = values.get("PROMPT_PREPARE")
+        self.prompt_clarifications = values.get("PROMPT_CLARIFICATIONS")
+        self.prompt_finish = values.get("PROMPT_FINISH")
+
+        # Proveedores y modelos
+        self.groq_api_key = values.get("GROQ_API_KEY") or None
+        self.openai_api_key = values.get("OPENAI_API_KEY") or None
+
+        # LLM: caché, tamaño de los prompts y resúmenes
+        self.llm_cache_enabled = _bool(values.get("LLM_CACHE_ENABLED", "true"))
+        self.llm_cache_size = int(values.get("LLM_CACHE_SIZE", 512))
+        self.llm_cache_ttl = float(values.get("LLM_CACHE_TTL", 3600))
+        self.llm_cache_db = values.get("LLM_CACHE_DB") or None
+        self.llm_max_tokens = int(values.get("LLM_MAX_TOKENS", 1024))
+        self.llm_context_budget = int(values.get("LLM_CONTEXT_BUDGET", 3000))
+        self.llm_summary_threshold = int(values.get("LLM_SUMMARY_THRESHOLD", 16))
+
+        # RAG: fragmentos enviados al LLM y candidatos de cada buscador antes de fusionarlos
+        self.rag_top_k = int(values.get("RAG_TOP_K", 3))
+        self.rag_fetch_k = int(values.get("RAG_FETCH_K", 20))
+        self.rag_index_type = values.get("RAG_INDEX_TYPE", "flat").lower()
+        self.rag_index_params = values.get("RAG_INDEX_PARAMS", "")
+        self.rag_index_min_recall = float(values.get("RAG_INDEX_MIN_RECALL", 0.9))
+        self.embedding_cache_size = int(values.get("EMBEDDING_CACHE_SIZE", 4096))
+        self.embedding_cache_db = values.get("EMBEDDING_CACHE_DB") or None
+
+        # Sesiones
+        self.session_backend = values.get("SESSION_BACKEND", "sqlite").lower()
+        self.session_db = values.get("SESSION_DB", "data/sessions.db")
+        self.session_redis_url = values.get("SESSION_REDIS_URL", "redis://localhost:6379/0")
+        self.session_ttl = float(values.get("SESSION_TTL", 7 * 24 * 3600))
+
+    @classmethod
+    def load(cls, env_file=ENV_FILE):
+        """
+        Lee el .env; las variables de entorno del proceso tienen prioridad, como con load_dotenv.
+        Sin .env (contenedores, despliegues que solo usan variables de entorno) se usa solo el entorno.
+        """
+        file_values = {}
+        if Path(env_file).exists():
+            file_values = {key: value for key, value in dotenv_values(env_file).items()
+                           if value is not None and key not in _PROCESS_ENV}
+        else:
+            print(f"{PASTEL_YELLOW}⚙️ No hay archivo .env en {env_file}: se usan solo las variables de entorno{RESET}")
+        return cls({**file_values, **_PROCESS_ENV}, file_values)
+
+    def export(self):
+        """Exporta las claves del .env a os.environ para las librerías que las lean de ahí."""
+        os.environ.update(self.file_values)
+        return self
+
+    def get(self, key, default=None):
+        """Valor sin convertir de cualquier clave (p. ej. LLM_MODEL_FAST)."""
+        return self.values.get(key, default)
+
+    def llm_model(self, name, default):
+        """Modelo configurado para el backend `name` (LLM_MODEL_FAST, LLM_MODEL_DEFAULT...)."""
+        return self.values.get(f"LLM_MODEL_{name.upper()}", default)
+
+    def missing_keys(self):
+        """Claves obligatorias que faltan."""
+        missing = [key for key in REQUIRED_KEYS if not self.values.get(key)]
+        if not (self.groq_api_key or self.openai_api_key):
+            missing.append("GROQ_API_KEY u OPENAI_API_KEY")
+        return missing
+
+    def validate(self):
+        """Comprueba de una vez que están todas las claves obligatorias."""
+        missing = self.missing_keys()
+        if missing:
+            message = f"{RED}{CROSS_MARK} Error: ValueError: Faltan claves en el archivo .env o en el entorno: {', '.join(missing)}.{RESET}"
+            print(message)
+            raise ValueError(message)
+        return self
+
+
+_config = None
+_config_lock = threading.Lock()
+
+# Funciones que el hilo config-watcher llama en cada vuelta, después de mirar el .env
+# (p. ej. PromptRegistry comprueba ahí si se han editado las plantillas)
+_watchers = []
+
+
+def add_watcher(callback):
+    """Registra `callback()` para que se ejecute en cada vuelta del hilo que vigila el .env."""
+    with _config_lock:
+        _watchers.append(callback)
+
+
+def get_config():
+    """
+    Configuración del proceso, leída una sola vez. Un hilo vigila el .env y, si cambia, la vuelve
+    a cargar; las lecturas no tocan el disco. El mismo hilo ejecuta las vigilancias de add_watcher.
+    """
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                _config = Config.load().export()
+                threading.Thread(target=_watch, args=(ENV_FILE,), name="config-watcher", daemon=True).start()
+    return _config
+
+
+def reload_config():
+    """
+    Vuelve a leer el .env y sustituye la configuración del proceso. Una recarga nunca cambia una
+    configuración válida por otra que no lo es (un .env a medio editar, una clave borrada...): en ese
+    caso se mantiene la anterior y se lanza el ValueError de validate().
+    """
+    global _config
+    config = Config.load()
+    with _config_lock:
+        if _config is not None and not _config.missing_keys():
+            config.validate()
+        _config = config.export()
+    print(f"{PASTEL_YELLOW}⚙️ Configuración recargada desde {ENV_FILE}{RESET}")
+    return config
+
+
+def _modified(path):
+    """Marca de modificación del fichero, o None si no existe."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _watch(env_file, interval=2.0):
+    last_modified = _modified(env_file)
+    while True:
+        time.sleep(interval)
+        try:
+            modified = _modified(env_file)
+            if modified != last_modified:
+                last_modified = modified
+                reload_config()
+        except (OSError, ValueError) as e:
+            print(f"{RED}No se pudo recargar la configuración, se mantiene la anterior:{RESET} {e}")
+        for callback in list(_watchers):
+            try:
+                callback()
+            except Exception as e:
+                print(f"{RED}Error en la vigilancia de {getattr(callback, '__qualname__', callback)}:{RESET} {e}")
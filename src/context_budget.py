@@ -0,0 +1,182 @@
+import re
+from src.config import get_config
+from src.resources import get_versioned_resource
+from src.utils.utils import PASTEL_YELLOW, RESET
+
+try:
+    import tiktoken
+except ImportError:  # Sin tiktoken se estima con ~4 caracteres por token
+    tiktoken = None
+
+# Tokens que añade cada mensaje al prompt además de su contenido (rol y separadores)
+MESSAGE_OVERHEAD = 4
+
+# Parte mínima de un pasaje: por debajo ya no dice nada y es mejor enviar menos pasajes
+MIN_PASSAGE_TOKENS = 32
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+
+
+class ContextBudget:
+    """
+    Ajusta los mensajes y pasajes que se envían al LLM a un presupuesto de tokens.
+
+    Cuenta tokens con un tokenizador local (tiktoken) y, si el prompt no cabe:
+    1. quita los mensajes ocultos repetidos y las instrucciones antiguas ya sustituidas,
+    2. recorta los mensajes ocultos antiguos largos (contexto del RAG, respuestas ocultas...),
+    3. descarta los mensajes más antiguos,
+    4. como último recurso, recorta y descarta los mensajes ocultos recientes, y recorta la
+       instrucción del paso actual (el último mensaje oculto) a lo que quede.
+    Los mensajes visibles de los `keep_recent` últimos no se tocan.
+    """
+    def __init__(self, max_prompt_tokens=None, keep_recent=6, hidden_tokens=200, encoding="cl100k_base"):
+        if max_prompt_tokens is None:
+            max_prompt_tokens = get_config().llm_context_budget
+        self.max_prompt_tokens = max_prompt_tokens
+        self.keep_recent = keep_recent
+        self.hidden_tokens = hidden_tokens
+        # Recuento precalculado de los textos fijos (prompts de sistema de PromptRegistry)
+        self._known = {}
+        self.encoder = None
+        if tiktoken is not None:
+            try:
+                self.encoder = tiktoken.get_encoding(encoding)
+            except Exception as e:
+                print(f"{PASTEL_YELLOW}Tokenizador no disponible, se estiman los tokens:{RESET} {e}")
+
+    @classmethod
+    def shared(cls):
+        """Presupuesto del proceso; se vuelve a crear si cambia LLM_CONTEXT_BUDGET al recargar el .env."""
+        max_prompt_tokens = get_config().llm_context_budget
+        return get_versioned_resource("context_budget", max_prompt_tokens, lambda: cls(max_prompt_tokens))
+
+    def remember(self, text):
+        """Cuenta los tokens de un texto fijo una vez para no volver a tokenizarlo en cada llamada."""
+        self._known[text] = self._count(text)
+        return self._known[text]
+
+    def count(self, text):
+        """Número de tokens de un texto."""
+        known = self._known.get(text)
+        return known if known is not None else self._count(text)
+
+    def _count(self, text):
+        if self.encoder is not None:
+            return len(self.encoder.encode(text, disallowed_special=()))
+        return len(text) // 4 + 1
+
+    def count_messages(self, messages):
+        """Número de tokens de una lista de mensajes {"role", "content"}."""
+        return sum(self.count(str(m["content"])) + MESSAGE_OVERHEAD for m in messages)
+
+    def truncate(self, text, max_tokens):
+        """Recorta el texto a `max_tokens` tokens, terminando en una frase completa si es posible."""
+        if self.count(text) <= max_tokens:
+            return text
+        if self.encoder is not None:
+            head = self.encoder.decode(self.encoder.encode(text, disallowed_special=())[:max_tokens])
+        else:
+            head = text[:max_tokens * 4]
+        sentences = _SENTENCE_END.split(head)
+        if len(sentences) > 1:
+            head = " ".join(sentences[:-1])
+        return head.rstrip() + " […]"
+
+    def fit_passages(self, passages, max_tokens):
+        """
+        Reparte `max_tokens` entre los pasajes (información de las cartas, fragmentos del RAG...):
+        quita los repetidos y recorta los que se pasen de su parte. Si no hay sitio para darle a cada
+        uno MIN_PASSAGE_TOKENS, se quedan los primeros (los más relevantes); si no cabe ni uno, [].
+        """
+        if max_tokens <= 0:
+            return []
+        unique = []
+        seen = set()
+        for passage in passages:
+            key = " ".join(passage.split()).lower()
+            if key and key not in seen:
+                seen.add(key)
+                unique.append(passage)
+        unique = unique[:max(1, max_tokens // MIN_PASSAGE_TOKENS)]
+        if not unique:
+            return []
+        share = max_tokens // len(unique)
+        if share < MIN_PASSAGE_TOKENS:
+            # Un solo pasaje y menos sitio que la parte mínima: entra entero o no entra
+            return [passage for passage in unique if self.count(passage) <= share]
+        return [self.truncate(passage, share) for passage in unique]
+
+    def fit_messages(self, records, max_tokens=None, stale_prefixes=()):
+        """
+        Devuelve los mensajes {"role", "content"} que caben en el presupuesto.
+        `records` son mensajes del historial (Message, con su propiedad `hidden`); de los ocultos que empiezan
+        por alguno de `stale_prefixes` (instrucciones de tono...) solo se conserva el último.
+        """
+        budget = max_tokens or self.max_prompt_tokens
+        messages = [{"role": r.role, "content": r.content} for r in records]
+        recent_start = max(0, len(records) - self.keep_recent)
+        keep = [True] * len(records)
+
+        # 1. Ocultos repetidos (se queda el más reciente) e instrucciones sustituidas por otras posteriores.
+        #    No aportan nada, así que se quitan aunque el prompt quepa.
+        seen = set()
+        seen_prefixes = set()
+        for i in range(len(records) - 1, -1, -1):
+            content = str(records[i].content)
+            key = " ".join(content.split())
+            prefixes = {p for p in stale_prefixes if content.startswith(p)}
+            if records[i].hidden and i < recent_start:
+                if key in seen or prefixes & seen_prefixes:
+                    keep[i] = False
+            seen.add(key)
+            seen_prefixes |= prefixes
+        total = sum(self.count_messages([m]) for m, k in zip(messages, keep) if k)
+        if total <= budget:
+            return [m for m, k in zip(messages, keep) if k]
+
+        # 2. Ocultos antiguos largos: se quedan en su resumen inicial
+        for i in range(recent_start):
+            if total <= budget:
+                break
+            if keep[i] and records[i].hidden:
+                before = self.count_messages([messages[i]])
+                messages[i]["content"] = self.truncate(str(messages[i]["content"]), self.hidden_tokens)
+                total -= before - self.count_messages([messages[i]])
+
+        # 3. Mensajes más antiguos, primero los ocultos
+        for hidden_first in (True, False):
+            for i in range(recent_start):
+                if total <= budget:
+                    break
+                if keep[i] and (records[i].hidden or not hidden_first):
+                    keep[i] = False
+                    total -= self.count_messages([messages[i]])
+
+        # 4. Último recurso: los ocultos recientes (contexto del RAG, respuestas ocultas...), primero
+        #    recortados, luego descartados, salvo el último, que es la instrucción del paso actual
+        #    y se recorta a lo que quede
+        hidden_recent = [i for i in range(recent_start, len(records)) if records[i].hidden]
+        current = hidden_recent.pop() if hidden_recent else None
+        for i in hidden_recent:
+            if total <= budget:
+                break
+            before = self.count_messages([messages[i]])
+            messages[i]["content"] = self.truncate(str(messages[i]["content"]), self.hidden_tokens)
+            total -= before - self.count_messages([messages[i]])
+        for i in hidden_recent:
+            if total <= budget:
+                break
+            keep[i] = False
+            total -= self.count_messages([messages[i]])
+        if current is not None and total > budget:
+            before = self.count_messages([messages[current]])
+            room = budget - (total - before) - MESSAGE_OVERHEAD
+            if room > 0:
+                messages[current]["content"] = self.truncate(str(messages[current]["content"]), room)
+                total -= before - self.count_messages([messages[current]])
+        if total > budget:
+            print(f"{PASTEL_YELLOW}⚠️ Los mensajes visibles recientes no caben en el presupuesto:{RESET} {total} > {budget} tokens")
+
+        fitted = [m for m, k in zip(messages, keep) if k]
+        print(f"{PASTEL_YELLOW}✂️ Contexto ajustado:{RESET} {len(records)} → {len(fitted)} mensajes, {total} tokens")
+        return fitted
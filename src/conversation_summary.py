@@ -0,0 +1,77 @@
+from src.llm_client import is_error_response
+from src.rate_limiter import BACKGROUND
+from src.config import get_config
+from src.prompt_registry import PromptRegistry
+from src.utils.utils import PASTEL_YELLOW, RESET
+
+class ConversationSummarizer:
+    """
+    Resumen incremental de la conversación para que el prompt de cada turno no crezca sin límite.
+
+    Cuando hay más de `threshold` mensajes sin resumir, los más antiguos (todos menos los
+    `keep_recent` últimos) se añaden al resumen anterior con una sola llamada al LLM;
+    los mensajes ya resumidos no se vuelven a enviar. La llamada se hace en segundo plano después
+    de la respuesta de LAILA y el resumen se usa a partir del turno siguiente.
+    """
+    def __init__(self, llm_client, threshold=None, keep_recent=6, max_words=250):
+        if threshold is None:
+            threshold = get_config().llm_summary_threshold
+        self.llm_client = llm_client
+        self.threshold = threshold
+        self.keep_recent = keep_recent
+        self.max_words = max_words
+
+    @property
+    def system_prompt(self):
+        """Instrucciones fijas: el mismo prefijo en todas las llamadas mientras no se edite la plantilla."""
+        return PromptRegistry.shared().render("summary", max_words=self.max_words)
+
+    def should_update(self, pending):
+        """Indica si hay que resumir con `pending` mensajes pendientes (threshold=0 lo desactiva)."""
+        return self.threshold > 0 and pending > max(self.threshold, self.keep_recent)
+
+    def fit_transcript(self, messages, max_tokens):
+        """
+        Transcripción de los primeros `messages` que caben en `max_tokens` (los ocultos, recortados como
+        en ContextBudget). Devuelve (texto, mensajes incluidos); los que no caben quedan para el siguiente
+        resumen. Si no cabe ni el primero, se recorta para no atascar el resumen.
+        """
+        budget = self.llm_client.context_budget
+        lines, used = [], 0
+        for message in messages:
+            content = str(message.content)
+            if message.hidden:
+                content = budget.truncate(content, budget.hidden_tokens)
+            line = f"[{message.role}{' (instrucción oculta)' if message.hidden else ''}] {content}"
+            tokens = budget.count(line) + 1
+            if used + tokens > max_tokens:
+                if not lines and max_tokens > 0:
+                    lines.append(budget.truncate(line, max_tokens))
+                break
+            lines.append(line)
+            used += tokens
+        return "\n".join(lines), len(lines)
+
+    async def aupdate(self, summary, messages):
+        """
+        Devuelve (resumen con los mensajes añadidos, cuántos de `messages` incluye), o None si el LLM
+        no ha podido responder. Se ajusta al presupuesto de la ruta "summary" y va con prioridad
+        BACKGROUND, así que nunca retrasa un turno del usuario.
+        """
+        budget = self.llm_client.context_budget
+        system = {"role": "system", "content": self.system_prompt}
+        request = {"role": "user", "content": f"## RESUMEN ANTERIOR:\n{summary or '(vacío)'}\n\n## MENSAJES NUEVOS:\n"}
+        available = self.llm_client.prompt_budget("summary") - budget.count_messages([system, request])
+        transcript, included = self.fit_transcript(messages, available)
+        if not included:
+            return None
+        request["content"] += transcript
+        response = await self.llm_client.aget_response([system, request], priority=BACKGROUND, route="summary")
+        if is_error_response(response):
+            return None
+        print(f"{PASTEL_YELLOW}📜 Resumen actualizado con {included} mensajes{RESET}")
+        return response.strip(), included
+
+    def submit(self, summary, messages):
+        """Lanza aupdate en el bucle del LlmClient y devuelve su Future sin esperarlo."""
+        return self.llm_client.submit(self.aupdate(summary, messages))
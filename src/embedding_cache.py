@@ -0,0 +1,106 @@
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+from src.config import get_config
+from src.resources import get_resource
+
+
+class EmbeddingCache:
+    """
+    Caché de embeddings de consultas (las preguntas de las cartas, la de la tirada, las del usuario...).
+
+    LRU en memoria por (modelo, texto normalizado) y, opcionalmente, una copia en SQLite que sobrevive
+    a reinicios. Un acierto evita la pasada por el transformer. Lleva contadores de aciertos y fallos.
+    """
+    def __init__(self, max_entries=4096, db_path=None):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self._entries = OrderedDict()  # (modelo, texto) -> vector float32 de solo lectura
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+            self._db.commit()
+
+    @classmethod
+    def shared(cls):
+        """Caché del proceso (EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_DB)."""
+        def create():
+            config = get_config()
+            return cls(config.embedding_cache_size, config.embedding_cache_db)
+        return get_resource("embedding_cache", create)
+
+    @staticmethod
+    def normalize(text):
+        """Mismo texto salvo espacios y forma Unicode -> misma entrada."""
+        return " ".join(unicodedata.normalize("NFC", text).split())
+
+    @staticmethod
+    def _disk_key(key):
+        return hashlib.sha256("\x00".join(key).encode("utf-8")).hexdigest()
+
+    def get(self, model, text):
+        """Devuelve el vector guardado o None."""
+        key = (model, self.normalize(text))
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+
+            if self._db is not None:
+                row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (self._disk_key(key),)).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, vector)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return vector
+
+            self.misses += 1
+            return None
+
+    def set(self, model, text, vector):
+        key = (model, self.normalize(text))
+        vector = np.array(vector, dtype=np.float32).ravel()
+        vector.setflags(write=False)
+        with self._lock:
+            self._remember(key, vector)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                                 (self._disk_key(key), vector.tobytes()))
+                self._db.commit()
+        return vector
+
+    def get_or_compute(self, model, text, compute):
+        """Vector de `text`; solo llama a `compute(text)` (el modelo) si no está en la caché."""
+        vector = self.get(model, text)
+        if vector is None:
+            vector = self.set(model, text, compute(text))
+        return vector
+
+    def _remember(self, key, vector):
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+                "size": len(self._entries),
+            }
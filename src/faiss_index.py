@@ -1,19 +1,32 @@
-import os
-import faiss
-import pickle
 from sentence_transformers import SentenceTransformer
 import numpy as np
 from charset_normalizer import detect
 from nltk.tokenize import sent_tokenize
+from src.index_store import IndexStore, IncrementalIndexer
+from src.embedding_cache import EmbeddingCache
+from src import ann_index
 
 class FaissIndex:
-    def __init__(self, model_name='all-MiniLM-L6-v2', data_dir="context", index_file="data/faiss_index.pkl", fragment_size=1000):
+    def __init__(self, model_name='all-MiniLM-L6-v2', data_dir="context", index_dir="data/faiss_index", fragment_size=1000,
+                 batch_size=64, num_workers=1, index_type="flat", index_params=None,
+                 min_recall=ann_index.MIN_RECALL):
         self.model = SentenceTransformer(model_name)
+        self.model_name = model_name
+        # Las consultas repetidas no vuelven a pasar por el modelo
+        self.query_cache = EmbeddingCache.shared()
         self.data_dir = data_dir
-        self.index_file = index_file
+        self.index_dir = index_dir
+        self.store = IndexStore(index_dir)
         self.index = None
-        self.docs = []
+        self.chunks = None
         self.fragment_size = fragment_size
+        # Tamaño de lote y número de procesos usados al codificar los fragmentos
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+        # Tipo de índice de búsqueda: "flat" (exacto) o uno aproximado de src/ann_index.py
+        self.index_type = index_type
+        self.index_params = index_params
+        self.min_recall = min_recall
         self.load_or_create_index()
 
     def detect_encoding(self, file_path):
@@ -41,63 +54,76 @@ class FaissIndex:
             fragments.append(current_fragment.strip())
         return fragments
 
-    def create_index(self):
-        """Crea un índice FAISS a partir de documentos en el directorio."""
-        embeddings = []
-        for file_name in os.listdir(self.data_dir):
-            file_path = os.path.join(self.data_dir, file_name)
+    def encode_fragments(self, fragments):
+        """
+        Codifica los fragmentos por lotes y devuelve una única matriz float32 contigua.
+        Con num_workers > 1 reparte los lotes entre varios procesos.
+        """
+        if self.num_workers > 1:
+            pool = self.model.start_multi_process_pool(target_devices=["cpu"] * self.num_workers)
             try:
-                encoding = self.detect_encoding(file_path)
-                with open(file_path, 'r', encoding=encoding, errors='ignore') as f:
-                    content = f.read()
-                    fragments = self.split_into_fragments(content)
-                    for fragment in fragments:
-                        self.docs.append(fragment)
-                        embeddings.append(self.model.encode(fragment))
-            except Exception as e:
-                print(f"Error al procesar el archivo {file_name}: {e}")
+                embeddings = self.model.encode_multi_process(fragments, pool, batch_size=self.batch_size)
+            finally:
+                self.model.stop_multi_process_pool(pool)
+        else:
+            embeddings = self.model.encode(fragments, batch_size=self.batch_size, convert_to_numpy=True)
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
 
-        if not embeddings:
-            raise ValueError("No se generaron embeddings. Verifica tus documentos.")
+    def split_file(self, file_path):
+        """Lee un documento y lo divide en fragmentos (texto, metadatos)."""
+        try:
+            encoding = self.detect_encoding(file_path)
+            with open(file_path, 'r', encoding=encoding, errors='ignore') as f:
+                content = f.read()
+        except Exception as e:
+            print(f"Error al procesar el archivo {file_path}: {e}")
+            return []
+        return [(fragment, {"source": file_path}) for fragment in self.split_into_fragments(content)]
 
-        embeddings = np.array(embeddings)
-        self.index = faiss.IndexFlatL2(embeddings.shape[1])
-        self.index.add(embeddings)
+    def create_index(self):
+        """
+        Crea o actualiza el índice FAISS a partir de los documentos del directorio.
+        Solo se codifican los ficheros nuevos o modificados desde la última construcción.
+        """
+        IncrementalIndexer(self.store, self.data_dir, self.split_file, self.encode_fragments).update()
+        self._load()
+        print(f"Índice FAISS creado y guardado en {self.index_dir}")
 
-        with open(self.index_file, 'wb') as f:
-            pickle.dump((self.index, self.docs), f)
-        print(f"Índice FAISS creado y guardado en {self.index_file}")
+    def _load(self):
+        self.index, self.chunks = self.store.load(mmap=True)
+        if self.index_type != "flat":
+            self.index, _ = ann_index.load_or_build(self.store, self.index_type, self.index_params,
+                                                   min_recall=self.min_recall)
 
     def load_index(self):
-        """Carga un índice FAISS desde un archivo, con verificación de errores."""
+        """Carga el índice FAISS (mapeado en memoria) y sus fragmentos, con verificación de errores."""
         try:
-            with open(self.index_file, 'rb') as f:
-                self.index, self.docs = pickle.load(f)
-            print(f"Índice FAISS cargado correctamente desde {self.index_file}")
-        except (FileNotFoundError, pickle.UnpicklingError):
+            self._load()
+            print(f"Índice FAISS cargado correctamente desde {self.index_dir}")
+        except (FileNotFoundError, RuntimeError):
             print("Error al cargar el índice FAISS. Creando uno nuevo...")
             self.create_index()
 
     def load_or_create_index(self):
-        """Carga o crea un índice FAISS al iniciar la aplicación."""
-        if os.path.exists(self.index_file):
-            self.load_index()
-        else:
+        """Sincroniza el índice con los documentos al iniciar la aplicación y lo carga."""
+        if not self.store.exists():
             print("El archivo de índice no existe. Creando un nuevo índice FAISS...")
-            self.create_index()
+        self.create_index()
 
     def search(self, query, top_k=3, max_characters=2000):
         """Busca en el índice FAISS usando un query y limita la longitud total de los resultados."""
         if not self.index:
             raise ValueError("El índice no está cargado.")
 
-        query_vector = self.model.encode(query).reshape(1, -1)
+        query_vector = self.query_cache.get_or_compute(self.model_name, query, self.model.encode).reshape(1, -1)
         distances, indices = self.index.search(query_vector, top_k)
 
         relevant_docs = []
         current_length = 0
-        for i in indices[0]:
-            doc = self.docs[i]
+        for chunk_id in indices[0]:
+            if chunk_id == -1:
+                continue
+            doc = self.chunks.get_text(int(chunk_id))
             if current_length + len(doc) <= max_characters:
                 relevant_docs.append(doc)
                 current_length += len(doc)
@@ -114,3 +140,4 @@ if __name__ == "__main__":
     query = "la emperatriz"
     resultados = index.search(query, top_k=30)
     print("Resultados de la búsqueda:", resultados)
+    print("Caché de embeddings:", index.query_cache.stats())
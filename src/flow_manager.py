@@ -5,10 +5,18 @@ class FlowManager:
     Controla el flujo de interacciones en la conversación.
     Permite avanzar paso a paso y verifica si se alcanzó el límite de interacciones.
     """
-    def __init__(self, step, max_steps=10):
+    def __init__(self, step, max_steps=10, session=None):
         # Inicializa el número máximo de pasos y el contador actual
         self.max_steps = max_steps
         self.current_step = step
+        # Si hay sesión (ver Session), el paso se guarda también fuera del proceso
+        self.session = session
+
+    def _sync_step(self):
+        if self.session is not None:
+            self.session.set("step", self.current_step)
+        else:
+            st.session_state.step = self.current_step
 
     def can_continue(self):
         """
@@ -22,7 +30,7 @@ class FlowManager:
         """
         if self.can_continue():
             self.current_step += 1
-            st.session_state.step = self.current_step
+            self._sync_step()
         else:
             raise StopIteration("Se alcanzó el límite máximo de interacciones.")
 
@@ -31,14 +39,14 @@ class FlowManager:
         Reinicia el contador de pasos y lo sincroniza con st.session_state.
         """
         self.current_step = 0
-        st.session_state.step = self.current_step
+        self._sync_step()
 
     def finish(self):
         """
         Fija el contador de pasos al máximo permitido y lo sincroniza con st.session_state.
         """
         self.current_step = self.max_steps
-        st.session_state.step = self.current_step
+        self._sync_step()
 
 if __name__ == "__main__":
     
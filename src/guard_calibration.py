@@ -0,0 +1,105 @@
+"""
+Calibra el margen del clasificador local de verificaciones contra el LLM.
+
+Sobre un conjunto etiquetado que no se usa para los centroides, compara cada veredicto local con el
+del LLM (el camino de referencia) y elige, por comprobación, el margen más bajo a partir del cual
+el clasificador coincide con el LLM en al menos `target` de los casos que decide, decidiendo al
+menos GUARD_MIN_DECIDED. Si ningún margen lo consigue, la comprobación queda sin margen y siempre se
+consulta al LLM. El resultado se guarda en GUARD_MARGINS_FILE, que se versiona con el código.
+
+    python -m src.guard_calibration [acuerdo_mínimo]              # por defecto 1.0
+    python -m src.guard_calibration [acuerdo_mínimo] --etiquetas  # sin LLM, contra las etiquetas
+"""
+import os
+import sys
+import json
+from src.assistant import Assistant
+from src.guard_classifier import GuardClassifier, GUARD_EXAMPLES, GUARD_MARGINS_FILE, GUARD_MIN_DECIDED, LOCAL_VERDICTS
+from src.rag import load_embeddings, EMBEDDINGS_MODEL
+from src.utils.utils import BLUE, PASTEL_YELLOW, PURPLE, RED, RESET
+
+# Ejemplos de evaluación ('true' = 'sí', 'false' = 'no'), distintos de GUARD_EXAMPLES
+GUARD_EVAL_FILE = "src/guard_eval.json"
+
+LLM_CHECKS = {
+    "is_comprensible_message": "_llm_comprensible_message",
+    "is_disrespectful": "_llm_disrespectful",
+    "is_valid_question": "_llm_valid_question",
+}
+
+
+def load_eval_examples(eval_file=GUARD_EVAL_FILE):
+    """{comprobación: {True: [...], False: [...]}} desde el fichero de evaluación."""
+    with open(eval_file, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return {check: {label == "true": texts for label, texts in labelled.items()} for check, labelled in data.items()}
+
+
+def choose_margin(rows, allowed, target=1.0, min_decided=GUARD_MIN_DECIDED):
+    """
+    Margen más bajo con el que los veredictos locales permitidos (`allowed`) coinciden con la
+    referencia en al menos `target` de los casos decididos, decidiendo al menos `min_decided`.
+    None si no hay ninguno. `rows` son tuplas (veredicto local, margen, veredicto de referencia).
+    """
+    for threshold in sorted({margin for _, margin, _ in rows}):
+        decided = [(local, reference) for local, margin, reference in rows if margin >= threshold and local in allowed]
+        if len(decided) < min_decided:
+            break
+        agreement = sum(local == reference for local, reference in decided) / len(decided)
+        if agreement >= target:
+            return threshold, agreement, len(decided)
+    return None, None, 0
+
+
+def calibrate(target=1.0, margins_file=GUARD_MARGINS_FILE, reference="llm", min_decided=GUARD_MIN_DECIDED):
+    """
+    Calibra todas las comprobaciones y guarda los márgenes. `reference` es "llm" (el camino que
+    sustituye el clasificador) o "labels" (las etiquetas del conjunto, sin llamadas al LLM; útil
+    cuando no hay clave del proveedor, pero menos fiel a lo que respondería el LLM).
+    """
+    # Centroides de todas las comprobaciones, con o sin margen previo
+    classifier = GuardClassifier(load_embeddings(EMBEDDINGS_MODEL), margins={}, checks=GUARD_EXAMPLES)
+    assistant = Assistant() if reference == "llm" else None
+    report = {"target": target, "reference": reference, "min_decided": min_decided, "checks": {}}
+    for check, labelled in load_eval_examples().items():
+        rows, labels = [], []
+        for label, texts in labelled.items():
+            for text in texts:
+                local, margin = classifier.predict(check, text)
+                expected = getattr(assistant, LLM_CHECKS[check])(text) if assistant else label
+                rows.append((local, margin, expected))
+                labels.append(label)
+
+        margin, agreement, decided = choose_margin(rows, LOCAL_VERDICTS[check], target, min_decided)
+        entry = {
+            "margin": margin,
+            "examples": len(rows),
+            "reference_vs_labels": sum(expected == label for (_, _, expected), label in zip(rows, labels)) / len(rows),
+            "local_vs_reference": sum(local == expected for local, _, expected in rows) / len(rows),
+            "agreement_when_decided": agreement,
+            "decided": decided,
+            "decided_locally": decided / len(rows),
+        }
+        report["checks"][check] = entry
+
+        print(f"\n{BLUE}{check}{RESET}")
+        print(f"  Referencia ({reference}) frente a las etiquetas: {entry['reference_vs_labels']:.2f}")
+        print(f"  Local frente a la referencia (sin margen): {entry['local_vs_reference']:.2f}")
+        if margin is None:
+            print(f"  {RED}Sin margen que alcance un acuerdo de {target:.2f} en {min_decided} casos: siempre se consulta al LLM{RESET}")
+        else:
+            print(f"  {PURPLE}Margen {margin:.3f}:{RESET} acuerdo {agreement:.2f} en {decided} casos, "
+                  f"decide en local el {entry['decided_locally']:.0%} de los casos")
+
+    directory = os.path.dirname(margins_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(margins_file, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n{PASTEL_YELLOW}Márgenes guardados en {margins_file}{RESET}")
+    return report
+
+
+if __name__ == "__main__":
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    calibrate(float(args[0]) if args else 1.0, reference="labels" if "--etiquetas" in sys.argv else "llm")
@@ -0,0 +1,165 @@
+import os
+import json
+import numpy as np
+from src.rag import load_embeddings, EMBEDDINGS_MODEL
+from src.resources import get_resource
+from src.utils.utils import PASTEL_YELLOW, RESET
+
+# Margen mínimo de cada comprobación, calibrado contra el LLM con python -m src.guard_calibration.
+# Se versiona junto al código (como los prompts), no en data/
+GUARD_MARGINS_FILE = "src/guard_margins.json"
+
+# Casos decididos en local que debe cubrir la calibración para que su margen se use
+GUARD_MIN_DECIDED = 50
+
+# Veredictos que el clasificador local puede dar por sí solo. Un 'sí' a la falta de respeto cierra
+# la sesión, así que siempre lo confirma el LLM. "Información adicional" depende del tema de la
+# consulta, que el clasificador no ve, y la decide siempre el LLM.
+LOCAL_VERDICTS = {
+    "is_comprensible_message": (True, False),
+    "is_disrespectful": (False,),
+    "is_valid_question": (True, False),
+}
+
+# Ejemplos etiquetados de cada comprobación (True = 'sí', False = 'no').
+# Incluyen los ejemplos de los prompts src/prompt/guard_*.txt. Los ejemplos de evaluación, distintos
+# de estos, están en src/guard_eval.json.
+GUARD_EXAMPLES = {
+    "is_comprensible_message": {
+        True: [
+            "El sol brilla intensamente hoy.",
+            "El libro está sobre la mesaa.",
+            "Quiero saber qué me depara el futuro.",
+            "Hola, ¿cómo estás?",
+            "Me llamo Laura y vengo por una consulta.",
+            "¿Voy a encontrar trabajo este año?",
+            "Estoy preocupado por mi relación de pareja.",
+            "Gracias por la tirada, ha sido muy interesante.",
+            "No entiendo lo que me quieres decir.",
+            "Sí, quiero continuar.",
+        ],
+        False: [
+            "lorem ipsum dolor sit amet",
+            "gdfgjgdfklg",
+            "asdasd qwe qwe",
+            "jjjjjjjjjjjj",
+            "xkcd zzq plmf",
+            "123 456 789 000",
+            "ñlkjh gfdsa",
+            "qwertyuiop",
+            "aaaa bbbb cccc dddd",
+            "sdf sdf sdf sdf",
+        ],
+    },
+    "is_disrespectful": {
+        True: [
+            "Eres una estúpida.",
+            "Cállate, idiota.",
+            "Vete a la mierda.",
+            "Eres una farsante inútil, el tarot es una basura.",
+            "No sirves para nada, bruja tonta.",
+            "Qué asco me das.",
+            "Eres imbécil.",
+            "Déjate de tonterías, payasa.",
+        ],
+        False: [
+            "Quiero saber qué me depara el futuro en el amor.",
+            "Hola, ¿cómo estás?",
+            "No estoy muy convencido, pero sigamos.",
+            "Gracias por tu ayuda.",
+            "¿Puedes explicarme mejor la última carta?",
+            "Estoy pasando por un momento difícil.",
+            "No me ha gustado mucho la respuesta.",
+            "Me gustaría preguntar por mi trabajo.",
+        ],
+    },
+    "is_valid_question": {
+        True: [
+            "¿Qué me depara el futuro en el amor?",
+            "¿Debería tomar una decisión importante esta semana?",
+            "¿Cómo me irá en el trabajo este año?",
+            "¿Volveré a ver a mi ex pareja?",
+            "Quiero saber si me irá bien con mi nuevo negocio.",
+            "¿Qué energías rodean mi salud en los próximos meses?",
+            "¿Es buen momento para mudarme de ciudad?",
+            "Quiero preguntar por mi familia.",
+        ],
+        False: [
+            "Hola, ¿cómo estás?",
+            "El clima está agradable hoy.",
+            "Hablemos de criptomonedas.",
+            "Ahi va mi pregunta",
+            "Perdona, me he equivocado.",
+            "¿Sabes por qué el pollo cruzó la carretera?",
+            "¿Cuál es la capital de Francia?",
+            "Escríbeme un programa en Python.",
+        ],
+    },
+}
+
+
+class GuardClassifier:
+    """
+    Clasificador local sí/no para las comprobaciones del Assistant, sin llamadas de red.
+    Usa el modelo de embeddings ya cargado por el RAG y un centroide por clase (vecino más cercano).
+    Solo decide si la diferencia de similitud entre ambos centroides alcanza el margen calibrado de
+    la comprobación y el veredicto está en LOCAL_VERDICTS; si no (o sin calibrar), devuelve None y
+    el Assistant recurre al LLM.
+    Solo se calculan centroides de las comprobaciones indicadas en `checks` (por defecto, las que
+    tienen margen): sin calibrar no se gasta ningún embedding.
+    """
+    def __init__(self, embeddings, examples=GUARD_EXAMPLES, margins=None, checks=None):
+        self.embeddings = embeddings
+        self.margins = self.load_margins() if margins is None else margins
+        checks = self.margins if checks is None else checks
+        # centroids[check] -> matriz (2, d): fila 0 = 'no', fila 1 = 'sí'
+        self.centroids = {}
+        for check, labelled in examples.items():
+            if check not in checks:
+                continue
+            rows = [self._normalize(self._embed(labelled[label]).mean(axis=0)) for label in (False, True)]
+            self.centroids[check] = np.vstack(rows)
+
+    @classmethod
+    def shared(cls, model_path=EMBEDDINGS_MODEL):
+        """Clasificador del proceso; los centroides se calculan una sola vez."""
+        return get_resource(("guard_classifier", model_path), lambda: cls(load_embeddings(model_path)))
+
+    @staticmethod
+    def load_margins(margins_file=GUARD_MARGINS_FILE):
+        """
+        {comprobación: margen} calibrados; las que no tengan margen, o se calibraron con menos de
+        GUARD_MIN_DECIDED casos decididos, no se deciden en local.
+        """
+        if not os.path.exists(margins_file):
+            print(f"{PASTEL_YELLOW}⚡ Clasificador local sin calibrar ({margins_file}): todas las verificaciones van al LLM{RESET}")
+            return {}
+        with open(margins_file, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return {check: entry["margin"] for check, entry in data.get("checks", {}).items()
+                if entry.get("margin") is not None and entry.get("decided", 0) >= GUARD_MIN_DECIDED}
+
+    @staticmethod
+    def _normalize(vectors):
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _embed(self, texts):
+        return np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+
+    def predict(self, check, text):
+        """Devuelve (etiqueta, margen) para el texto."""
+        vector = self._normalize(np.asarray(self.embeddings.embed_query(text), dtype=np.float32))
+        no_score, yes_score = self.centroids[check] @ vector
+        return bool(yes_score > no_score), float(abs(yes_score - no_score))
+
+    def classify(self, check, text):
+        """Devuelve True/False si la predicción es fiable, o None si hay que preguntar al LLM."""
+        if check not in self.centroids or check not in self.margins:
+            return None
+        label, margin = self.predict(check, text)
+        if margin < self.margins[check] or label not in LOCAL_VERDICTS[check]:
+            print(f"{PASTEL_YELLOW}⚡ Clasificador local sin decidir ({check}: {label}, margen {margin:.3f}), se consulta al LLM{RESET}")
+            return None
+        print(f"{PASTEL_YELLOW}⚡ Clasificador local ({check}, margen {margin:.3f}):{RESET} {label}")
+        return label
@@ -0,0 +1,56 @@
+import asyncio
+from src.llm_client import LlmClient
+from src.resources import get_resource
+
+
+class GuardPipeline:
+    """
+    Ejecuta en paralelo las verificaciones de un turno (comprensible, falta de respeto, pregunta válida...).
+
+    Las verificaciones se pasan en orden de prioridad como tuplas (nombre, corrutina, args, valor_descalificante).
+    En cuanto el resultado ya está decidido —todas las verificaciones anteriores pasaron y una da su valor
+    descalificante— se devuelven los resultados sin esperar al resto, así que la decisión es la misma que
+    evaluándolas una detrás de otra, pero la latencia es la de la verificación más lenta que haga falta.
+
+    Corren en el bucle de eventos del LlmClient (clientes AsyncGroq/AsyncOpenAI), así que no hay un pool
+    de hilos que repartir entre sesiones: las llamadas de todas las sesiones esperan la red a la vez y
+    el único límite es el del RateLimitScheduler. Las que ya no hacen falta se cancelan de verdad.
+    """
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def shared(cls):
+        """Pipeline del proceso compartido por todas las sesiones."""
+        return get_resource("guard_pipeline", lambda: cls(LlmClient()))
+
+    def run(self, checks):
+        """Devuelve {nombre: resultado} con, al menos, las verificaciones necesarias para decidir."""
+        return self.client.run_sync(self.arun(checks))
+
+    async def arun(self, checks):
+        tasks = [asyncio.ensure_future(function(*args)) for _, function, args, _ in checks]
+        pending = set(tasks)
+        results = {}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for (name, _, _, _), task in zip(checks, tasks):
+                    if task in done:
+                        results[name] = task.result()
+                if self._is_decided(checks, results):
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+        return results
+
+    @staticmethod
+    def _is_decided(checks, results):
+        """Recorre las verificaciones por prioridad hasta la primera pendiente o descalificante."""
+        for name, _, _, disqualifying in checks:
+            if name not in results:
+                return False
+            if results[name] == disqualifying:
+                return True
+        return True
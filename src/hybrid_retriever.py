@@ -0,0 +1,136 @@
+import re
+import time
+import unicodedata
+import numpy as np
+from src.utils.utils import PURPLE, RESET
+
+TOKEN_RE = re.compile(r"\w+")
+
+# Palabras vacías que no distinguen un fragmento de otro ("Sota DE Copas", "the Queen OF Cups")
+STOP_WORDS = frozenset((
+    "a", "al", "con", "de", "del", "el", "en", "es", "la", "las", "lo", "los", "o", "para", "por",
+    "que", "se", "su", "sus", "un", "una", "y", "and", "in", "is", "of", "the", "to",
+))
+
+
+def tokenize(text):
+    """Términos de un texto en minúsculas y sin tildes, para que 'Ermitaño' y 'ermitano' coincidan."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return [token for token in TOKEN_RE.findall(text) if token not in STOP_WORDS]
+
+
+class BM25Index:
+    """
+    Índice invertido BM25 en memoria sobre los mismos fragmentos que el índice FAISS.
+
+    Las listas de postings se guardan en formato CSR (offsets por término, filas y pesos) y el peso
+    BM25 de cada posting se calcula al construir, así que una consulta solo suma unos pocos tramos
+    de arrays de numpy.
+    """
+    def __init__(self, ids, texts, k1=1.5, b=0.75):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        n = len(self.ids)
+        docs = [tokenize(text) for text in texts]
+        self.vocab = {}
+        term_ids = np.fromiter((self.vocab.setdefault(token, len(self.vocab)) for doc in docs for token in doc),
+                               dtype=np.int64)
+        lengths = np.fromiter(map(len, docs), dtype=np.int64, count=n)
+        rows = np.repeat(np.arange(n, dtype=np.int64), lengths)
+
+        # Pares (término, fragmento) únicos con su frecuencia; np.unique los deja ordenados por término
+        width = max(n, 1)
+        pairs, tf = np.unique(term_ids * width + rows, return_counts=True)
+        terms, rows = pairs // width, pairs % width
+        self.offsets = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(self.vocab)), out=self.offsets[1:])
+
+        df = np.diff(self.offsets)
+        idf = np.log1p((n - df + 0.5) / (df + 0.5))
+        average_length = max(lengths.mean(), 1.0) if n else 1.0
+        norm = k1 * (1 - b + b * lengths / average_length)
+        self.rows = rows.astype(np.int32)
+        self.weights = (idf[terms] * tf * (k1 + 1) / (tf + norm[rows])).astype(np.float32)
+
+    @classmethod
+    def from_chunk_store(cls, chunk_store):
+        started = time.perf_counter()
+        index = cls(chunk_store.ids, [chunk_store.texts[row] for row in range(len(chunk_store))])
+        print(f"🔎 {PURPLE}Índice BM25 construido: {len(index.ids)} fragmentos, {len(index.vocab)} términos "
+              f"({(time.perf_counter() - started) * 1000:.0f} ms).{RESET}")
+        return index
+
+    def scores(self, query):
+        """Puntuación BM25 de la consulta para cada fila del índice."""
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for token in set(tokenize(query)):
+            term = self.vocab.get(token)
+            if term is not None:
+                start, end = self.offsets[term], self.offsets[term + 1]
+                # Dentro de un término cada fila aparece una sola vez: basta una suma indexada
+                scores[self.rows[start:end]] += self.weights[start:end]
+        return scores
+
+    def search(self, query, k=20):
+        """Devuelve los ids de chunk de los `k` fragmentos con mayor puntuación BM25, de mayor a menor."""
+        scores = self.scores(query)
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(scores[candidates], -k)[-k:]]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return [int(chunk_id) for chunk_id in self.ids[candidates]]
+
+    def rank(self, query, chunk_ids):
+        """Ordena unos ids de chunk ya conocidos por su puntuación BM25 para la consulta."""
+        chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+        # Los ids del ChunkStore están ordenados: su fila se localiza con una búsqueda binaria
+        rows = np.searchsorted(self.ids, chunk_ids)
+        scores = self.scores(query)[rows]
+        return [int(chunk_id) for chunk_id in chunk_ids[np.argsort(-scores, kind="stable")]]
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fusiona varias listas ordenadas de ids: cada id suma 1 / (k + posición) en cada lista."""
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class HybridRetriever:
+    """
+    Recuperación híbrida: vecinos densos de FAISS y coincidencias léxicas de BM25 fusionados por
+    rango recíproco (RRF). BM25 acierta con los nombres exactos ("Sota de Copas") que los embeddings
+    confunden con los de otros palos, así que basta con enviar menos fragmentos al LLM.
+
+    Tiene la misma interfaz `invoke(query)` que el retriever de LangChain.
+    """
+    def __init__(self, db, lexical, k=3, fetch_k=20, rrf_k=60):
+        self.db = db
+        self.lexical = lexical
+        self.k = k
+        self.fetch_k = fetch_k
+        self.rrf_k = rrf_k
+
+    def dense_search(self, query, k):
+        vector = np.asarray([self.db.embedding_function.embed_query(query)], dtype=np.float32)
+        _, indices = self.db.index.search(vector, k)
+        return [int(chunk_id) for chunk_id in indices[0] if chunk_id != -1]
+
+    def search(self, query, lexical_ranking=None):
+        """
+        Fragmentos de la fusión. `lexical_ranking` sustituye a la búsqueda BM25 en todo el corpus
+        por una lista ya ordenada de candidatos (p. ej. los fragmentos que mencionan una carta).
+        """
+        if lexical_ranking is None:
+            lexical_ranking = self.lexical.search(query, self.fetch_k)
+        rankings = [self.dense_search(query, self.fetch_k), lexical_ranking[:self.fetch_k]]
+        return self.documents(reciprocal_rank_fusion(rankings, self.rrf_k))
+
+    def documents(self, chunk_ids):
+        """Documentos de los `k` primeros ids de una lista ya ordenada, sin búsqueda densa."""
+        return [self.db.docstore.search(str(chunk_id)) for chunk_id in chunk_ids[:self.k]]
+
+    def invoke(self, query):
+        return self.search(query)
@@ -0,0 +1,339 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import contextlib
+import faiss
+import numpy as np
+from src.utils.utils import PASTEL_YELLOW, PURPLE, RESET
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+# Flags de lectura: vectores mapeados en memoria y de solo lectura para que
+# varios procesos compartan las mismas páginas físicas del fichero.
+MMAP_FLAGS = faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY
+
+
+class _Column:
+    """Columna de cadenas UTF-8 en disco: datos concatenados + offsets, ambos mapeados en memoria."""
+    def __init__(self, directory, name):
+        offsets_path = os.path.join(directory, f"{name}_offsets.npy")
+        data_path = os.path.join(directory, f"{name}.bin")
+        self.offsets = np.load(offsets_path, mmap_mode="r")
+        # np.memmap no admite ficheros vacíos
+        if os.path.getsize(data_path):
+            self.data = np.memmap(data_path, dtype=np.uint8, mode="r")
+        else:
+            self.data = np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.data[start:end].tobytes().decode("utf-8")
+
+    @staticmethod
+    def write(directory, name, values):
+        offsets = np.zeros(len(values) + 1, dtype=np.int64)
+        with open(os.path.join(directory, f"{name}.bin"), "wb") as f:
+            for i, value in enumerate(values):
+                encoded = value.encode("utf-8")
+                f.write(encoded)
+                offsets[i + 1] = offsets[i] + len(encoded)
+        np.save(os.path.join(directory, f"{name}_offsets.npy"), offsets)
+
+
+class ChunkStore:
+    """
+    Almacén columnar de fragmentos (id, texto y metadatos) que se lee bajo demanda.
+    Abrirlo no deserializa nada: solo mapea los ficheros en memoria.
+    Los fragmentos se identifican por su id de chunk, el mismo que usa el índice FAISS.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.ids = np.load(os.path.join(directory, "ids.npy"), mmap_mode="r")
+        self.texts = _Column(directory, "texts")
+        self.metadata = _Column(directory, "metadata")
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row(self, chunk_id):
+        """Fila que ocupa un id de chunk (los ids se guardan ordenados)."""
+        row = int(np.searchsorted(self.ids, chunk_id))
+        if row >= len(self.ids) or self.ids[row] != chunk_id:
+            raise KeyError(chunk_id)
+        return row
+
+    def get_text(self, chunk_id):
+        return self.texts[self.row(chunk_id)]
+
+    def get_metadata(self, chunk_id):
+        return json.loads(self.metadata[self.row(chunk_id)])
+
+    @staticmethod
+    def write(directory, ids, texts, metadatas):
+        """Escribe los fragmentos en `directory`, ordenados por id."""
+        order = np.argsort(np.asarray(ids, dtype=np.int64), kind="stable")
+        np.save(os.path.join(directory, "ids.npy"), np.asarray(ids, dtype=np.int64)[order])
+        _Column.write(directory, "texts", [texts[i] for i in order])
+        _Column.write(directory, "metadata", [json.dumps(metadatas[i], ensure_ascii=False) for i in order])
+
+
+class IndexStore:
+    """
+    Persistencia nativa de un índice FAISS (`faiss.write_index`) junto a su ChunkStore y su manifiesto.
+
+    Cada construcción escribe una generación completa en un directorio temporal, la sincroniza con
+    el disco, la renombra (`gen-000001/`, `gen-000002/`...) y solo al final actualiza el fichero
+    CURRENT de forma atómica, así que una construcción interrumpida (o un corte de luz) nunca deja el
+    índice activo a medias. Las escrituras se serializan entre procesos con un flock sobre LOCK y se
+    conserva la generación anterior para los procesos que aún la estén abriendo.
+    """
+    INDEX_FILE = "index.faiss"
+    MANIFEST_FILE = "manifest.json"
+    CURRENT_FILE = "CURRENT"
+    LOCK_FILE = "LOCK"
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def current_generation(self):
+        """Directorio de la generación activa o None."""
+        current_path = os.path.join(self.directory, self.CURRENT_FILE)
+        if not os.path.exists(current_path):
+            return None
+        with open(current_path, "r", encoding="utf-8") as f:
+            return os.path.join(self.directory, f.read().strip())
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Bloqueo exclusivo entre procesos para leer el manifiesto, reconstruir y guardar."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, self.LOCK_FILE), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def exists(self):
+        return self.current_generation() is not None
+
+    def load_manifest(self):
+        """Manifiesto de la generación activa ({"next_id": ..., "files": {...}})."""
+        generation = self.current_generation()
+        if generation is None:
+            return {"next_id": 0, "files": {}}
+        with open(os.path.join(generation, self.MANIFEST_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_manifest(self, manifest):
+        """
+        Sustituye de forma atómica el manifiesto de la generación activa, sin tocar índice ni
+        fragmentos (ni los índices aproximados derivados). Hay que llamarlo dentro de lock().
+        """
+        generation = self.current_generation()
+        manifest_path = os.path.join(generation, self.MANIFEST_FILE)
+        with open(f"{manifest_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f"{manifest_path}.tmp", manifest_path)
+        _fsync_path(generation)
+
+    def load(self, mmap=True, attempts=3):
+        """Devuelve (índice, ChunkStore). Con `mmap` los vectores no se copian a memoria del proceso."""
+        for attempt in range(attempts):
+            generation = self.current_generation()
+            if generation is None:
+                raise FileNotFoundError(f"No hay ningún índice en {self.directory}")
+            index_path = os.path.join(generation, self.INDEX_FILE)
+            try:
+                index = faiss.read_index(index_path, MMAP_FLAGS) if mmap else faiss.read_index(index_path)
+                return index, ChunkStore(generation)
+            except (FileNotFoundError, RuntimeError):
+                # Otro proceso activó dos generaciones nuevas entre leer CURRENT y abrir los ficheros
+                if attempt == attempts - 1 or self.current_generation() == generation:
+                    raise
+                time.sleep(0.05)
+
+    def save(self, index, ids, texts, metadatas, manifest):
+        """Escribe una nueva generación y la activa al final. Hay que llamarlo dentro de lock()."""
+        os.makedirs(self.directory, exist_ok=True)
+        current = self.current_generation()
+        number = int(os.path.basename(current).split("-")[1]) + 1 if current else 1
+        name = f"gen-{number:06d}"
+
+        staging = tempfile.mkdtemp(prefix=".tmp-gen-", dir=self.directory)
+        faiss.write_index(index, os.path.join(staging, self.INDEX_FILE))
+        ChunkStore.write(staging, ids, texts, metadatas)
+        with open(os.path.join(staging, self.MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        # Todo en disco antes de que CURRENT pueda apuntar a ello
+        for entry in os.listdir(staging):
+            _fsync_path(os.path.join(staging, entry))
+        _fsync_path(staging)
+        os.rename(staging, os.path.join(self.directory, name))
+        _fsync_path(self.directory)
+
+        # Activación atómica de la nueva generación
+        current_tmp = os.path.join(self.directory, f"{self.CURRENT_FILE}.tmp")
+        with open(current_tmp, "w", encoding="utf-8") as f:
+            f.write(name)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(current_tmp, os.path.join(self.directory, self.CURRENT_FILE))
+        _fsync_path(self.directory)
+        self._remove_stale_generations(keep={name, os.path.basename(current) if current else None})
+
+    def _remove_stale_generations(self, keep):
+        """Borra las generaciones que no están en `keep` (la activa y la anterior, que algún proceso
+        puede estar abriendo todavía) y los temporales de construcciones interrumpidas."""
+        for entry in os.listdir(self.directory):
+            if (entry.startswith("gen-") and entry not in keep) or entry.startswith(".tmp-gen-"):
+                shutil.rmtree(os.path.join(self.directory, entry), ignore_errors=True)
+
+
+def _fsync_path(path):
+    """Sincroniza con el disco un fichero o directorio (los directorios no se pueden abrir en Windows)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except (IsADirectoryError, PermissionError):
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IncrementalIndexer:
+    """
+    Mantiene un IndexStore sincronizado con los ficheros de `data_dir`.
+
+    El manifiesto guarda, por fichero, tamaño, mtime, hash del contenido y los ids de chunk que
+    generó. En cada actualización solo se trocean y codifican los ficheros nuevos o modificados,
+    y los vectores de los ficheros borrados o modificados se eliminan con `remove_ids`.
+
+    :param split_file: función (ruta) -> lista de (texto, metadatos).
+    :param embed: función (lista de textos) -> matriz float32 (n, d).
+    :param new_index: función (d) -> índice FAISS vacío que acepte `add_with_ids`.
+    """
+    def __init__(self, store, data_dir, split_file, embed, new_index=None):
+        self.store = store
+        self.data_dir = data_dir
+        self.split_file = split_file
+        self.embed = embed
+        self.new_index = new_index or (lambda dim: faiss.IndexIDMap(faiss.IndexFlatL2(dim)))
+
+    def scan(self, manifest):
+        """Clasifica los ficheros de data_dir en (sin cambios, nuevos o modificados, borrados)."""
+        unchanged, changed = {}, {}
+        seen = set()
+        for file_name in sorted(os.listdir(self.data_dir)):
+            file_path = os.path.join(self.data_dir, file_name)
+            if not os.path.isfile(file_path):
+                continue
+            seen.add(file_name)
+            stat = os.stat(file_path)
+            entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+            previous = manifest["files"].get(file_name)
+            if previous and previous["size"] == entry["size"] and previous["mtime_ns"] == entry["mtime_ns"]:
+                unchanged[file_name] = previous
+                continue
+            entry["sha256"] = file_sha256(file_path)
+            if previous and previous["sha256"] == entry["sha256"]:
+                unchanged[file_name] = dict(previous, mtime_ns=entry["mtime_ns"])
+            else:
+                changed[file_name] = entry
+        deleted = [name for name in manifest["files"] if name not in seen]
+        return unchanged, changed, deleted
+
+    def update(self):
+        """
+        Sincroniza el índice con data_dir. Devuelve True si se escribió una generación nueva.
+        Con el lock del IndexStore, dos procesos que arrancan a la vez no construyen dos veces.
+        """
+        with self.store.lock():
+            return self._update()
+
+    def _update(self):
+        manifest = self.store.load_manifest()
+        unchanged, changed, deleted = self.scan(manifest)
+        touched = [name for name in changed if name in manifest["files"]] + deleted
+        if not changed and not deleted:
+            if unchanged != manifest["files"]:
+                # Solo cambiaron mtimes (git checkout, cp, touch...): basta con actualizar el manifiesto
+                # para no volver a calcular hashes; el índice y la generación siguen siendo válidos
+                self.store.save_manifest(dict(manifest, files=unchanged))
+                print(f"✅ {PASTEL_YELLOW}Índice al día; solo cambiaron fechas de modificación.{RESET}")
+                return False
+            print(f"✅ {PASTEL_YELLOW}Índice al día, no hay ficheros nuevos ni modificados.{RESET}")
+            return False
+
+        print(f"{PASTEL_YELLOW}🔄 Ficheros nuevos o modificados:{RESET} {len(changed)} "
+              f"{PASTEL_YELLOW}borrados:{RESET} {len(deleted)}")
+
+        removed_ids = [cid for name in touched for cid in manifest["files"][name]["chunk_ids"]]
+        new_ids, new_texts, new_metadatas = [], [], []
+        next_id = manifest["next_id"]
+        for file_name, entry in changed.items():
+            chunks = self.split_file(os.path.join(self.data_dir, file_name))
+            entry["chunk_ids"] = list(range(next_id, next_id + len(chunks)))
+            next_id += len(chunks)
+            new_ids.extend(entry["chunk_ids"])
+            for text, metadata in chunks:
+                new_texts.append(text)
+                new_metadatas.append(metadata)
+
+        files = dict(unchanged)
+        files.update(changed)
+        self._rewrite(next_id, files, removed_ids, new_ids, new_texts, new_metadatas)
+        return True
+
+    def _rewrite(self, next_id, files, removed_ids, new_ids, new_texts, new_metadatas):
+        """Aplica los cambios sobre el índice y los fragmentos y los guarda como generación nueva."""
+        manifest = {"next_id": next_id, "files": files}
+        index, old_chunks = self.store.load(mmap=False) if self.store.exists() else (None, None)
+
+        ids, texts, metadatas = [], [], []
+        if old_chunks is not None:
+            removed = set(removed_ids)
+            for row, chunk_id in enumerate(old_chunks.ids):
+                if int(chunk_id) not in removed:
+                    ids.append(int(chunk_id))
+                    texts.append(old_chunks.texts[row])
+                    metadatas.append(json.loads(old_chunks.metadata[row]))
+            if removed_ids:
+                index.remove_ids(np.asarray(removed_ids, dtype=np.int64))
+
+        if new_texts:
+            embeddings = np.ascontiguousarray(self.embed(new_texts), dtype=np.float32)
+            if index is None:
+                index = self.new_index(embeddings.shape[1])
+            index.add_with_ids(embeddings, np.asarray(new_ids, dtype=np.int64))
+            ids.extend(new_ids)
+            texts.extend(new_texts)
+            metadatas.extend(new_metadatas)
+
+        if index is None:
+            raise ValueError("No se generaron embeddings. Verifica tus documentos.")
+
+        self.store.save(index, ids, texts, metadatas, manifest)
+        print(f"🗂️{PURPLE} Índice FAISS actualizado: {index.ntotal} fragmentos.{RESET}")
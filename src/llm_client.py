@@ -1,9 +1,66 @@
-from groq import Groq, RateLimitError
-from openai import OpenAI
-from src.utils.utils import get_env_key, RED, TURQUOISE, RESET
+import time
+import asyncio
+import threading
+import httpx
+import groq
+import openai
+from src.response_cache import ResponseCache
+from src.rate_limiter import RateLimitScheduler, INTERACTIVE
+from src.llm_router import LlmRouter
+from src.context_budget import ContextBudget
+from src.config import get_config
+from src.utils.utils import RED, TURQUOISE, RESET
+
+RATE_LIMIT_PREFIX = "😿 ¡Ah, las cartas!"
+UNEXPECTED_ERROR_MESSAGE = "Error inesperado al procesar la solicitud."
+
+RATE_LIMIT_ERRORS = (groq.RateLimitError, openai.RateLimitError)
+# Errores transitorios que se reintentan con backoff (los timeouts heredan de APIConnectionError)
+RETRYABLE_ERRORS = RATE_LIMIT_ERRORS + (
+    groq.APIConnectionError, groq.InternalServerError,
+    openai.APIConnectionError, openai.InternalServerError,
+)
+# Cualquier error de la API hace pasar al siguiente backend de la ruta
+API_ERRORS = (groq.APIError, openai.APIError)
+# Mientras se lee el flujo los errores de red pueden llegar sin envolver por el SDK
+STREAM_ERRORS = API_ERRORS + (httpx.HTTPError,)
+
+
+def is_error_response(text):
+    """Indica si el texto es uno de los mensajes de error que devuelve get_response."""
+    return text.startswith(RATE_LIMIT_PREFIX) or text == UNEXPECTED_ERROR_MESSAGE
+
+
+class LlmResponseError(Exception):
+    """Un flujo de respuesta que no se pudo completar. `message` es el aviso para el usuario."""
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+class _AsyncRunner:
+    """Bucle de eventos en un hilo propio donde viven los clientes asíncronos y su pool de conexiones."""
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="llm-client-loop", daemon=True)
+        self.thread.start()
+
+    def run(self, coro):
+        """Ejecuta una corrutina en el bucle y espera su resultado desde código síncrono."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def submit(self, coro):
+        """Lanza una corrutina en el bucle sin esperarla; devuelve su concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    async def run_async(self, coro):
+        """Ejecuta una corrutina en el bucle desde otro bucle de eventos."""
+        if asyncio.get_running_loop() is self.loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, self.loop))
 
 class LlmClient:
-    """Clase para manejar la interacción con Groq usando el patrón Singleton."""
+    """Clase para manejar la interacción con Groq y OpenAI usando el patrón Singleton."""
     _instance = None  # Implementación de Singleton
 
     def __new__(cls, *args, **kwargs):
@@ -12,59 +69,342 @@ class LlmClient:
             cls._instance._init_instance(*args, **kwargs)  # Corregido: un solo guion bajo
         return cls._instance
 
-    # model = "gpt-3.5-turbo-0125"
-    # model = "llama-3.3-70b-versatile"
-    # model = "gemma2-9b-it"
-    # model = "mixtral-8x7b-32768" # No responde bien... 
-    # model = "llama-3.1-8b-instant"
-    model = "llama3-8b-8192"
-    def _init_instance(self, llm_model=model):  # Corregido a un solo guion bajo
-        self.llm_model = llm_model
-        print(f"🤖 {TURQUOISE}Iniciando con el LLM: {llm_model}{RESET}\n")
-
-        if self.llm_model.startswith("gpt-"):
-            openai_api_key = get_env_key('OPENAI_API_KEY')
-            if not openai_api_key:
-                raise ValueError("La clave OPENAI_API_KEY no está definida en las variables de entorno.")
-            self.client = OpenAI(api_key=openai_api_key)
-        else:           
-            groq_api_key = get_env_key('GROQ_API_KEY')
-            if not groq_api_key:
-                raise ValueError("La clave GROQ_API_KEY no está definida en las variables de entorno.")
-            self.client = Groq()
-
-    def get_response(self, messages_with_context):
-        try:
-            response_stream = self.client.chat.completions.create(
-                messages=messages_with_context,
-                model=self.llm_model,
-                temperature=0.2,
-                max_tokens=1024,
-                top_p=1,
-                stream=True
+    sampling = {"temperature": 0.2, "max_tokens": 1024, "top_p": 1}
+
+    def _init_instance(self, llm_model=None):  # Corregido a un solo guion bajo
+        # Varios backends a la vez (Groq y/o OpenAI); cada tipo de llamada ("guard", "rag", "chat",
+        # "reading") va al suyo y, si falla o se pasa de su SLO de latencia, al siguiente de la ruta.
+        # `llm_model` sustituye al modelo del backend "default".
+        self.router = LlmRouter(default_model=llm_model)
+        self.llm_model = self.router.primary("chat").model
+        print(f"🤖 {TURQUOISE}Iniciando con el LLM: {self.llm_model}{RESET}\n")
+
+        # Caché de respuestas: LRU en memoria con TTL y, si se indica LLM_CACHE_DB, nivel en SQLite
+        config = get_config()
+        self.cache = None
+        if config.llm_cache_enabled:
+            self.cache = ResponseCache(
+                max_entries=config.llm_cache_size,
+                ttl=config.llm_cache_ttl,
+                db_path=config.llm_cache_db,
             )
 
-            response_text = ""
-            for chunk in response_stream:
-                try:
-                    content = chunk.choices[0].delta.content
-                    if content:  
-                        response_text += content
-                except (AttributeError, IndexError, KeyError) as e:
-                    print(f"Error al procesar chunk: {e}")
+        # Tokens de salida (LLM_MAX_TOKENS); el presupuesto del prompt (LLM_CONTEXT_BUDGET) es context_budget
+        self.sampling = dict(self.sampling, max_tokens=config.llm_max_tokens)
+
+        # Ritmo de las llamadas según los límites de cada modelo y reintentos con backoff
+        # (los reintentos propios de los SDK se desactivan para que no se dupliquen)
+        self.scheduler = RateLimitScheduler()
+
+        # Los clientes asíncronos se crean dentro de su propio bucle de eventos la primera vez que se usan
+        self._runner = None
+        self._async_lock = threading.Lock()
+
+    @property
+    def context_budget(self):
+        """Presupuesto de tokens vigente (sigue a LLM_CONTEXT_BUDGET si se recarga el .env)."""
+        return ContextBudget.shared()
 
+    def _get_runner(self):
+        with self._async_lock:
+            if self._runner is None:
+                self._runner = _AsyncRunner()
+            return self._runner
+
+    def run_sync(self, coro):
+        """Ejecuta una corrutina (por ejemplo varias llamadas con asyncio.gather) desde código síncrono."""
+        return self._get_runner().run(coro)
+
+    def submit(self, coro):
+        """Lanza una corrutina en segundo plano (resúmenes...) y devuelve su Future sin esperarla."""
+        return self._get_runner().submit(coro)
+
+    def prompt_budget(self, route="chat"):
+        """Tokens de prompt que caben en todos los backends de la ruta sin pasar del presupuesto configurado."""
+        window = min(backend.context_window for backend in self.router.candidates(route))
+        return min(self.context_budget.max_prompt_tokens, window - self.sampling["max_tokens"])
+
+    def _sampling(self, backend, prompt_tokens):
+        """Parámetros de muestreo con los tokens de salida limitados a lo que deja libre la ventana del modelo."""
+        max_tokens = min(self.sampling["max_tokens"], backend.context_window - prompt_tokens)
+        return dict(self.sampling, max_tokens=max(1, max_tokens))
+
+    def _stream_deltas(self, messages_with_context, priority=INTERACTIVE, route="chat", restartable=False, answered=None):
+        """
+        Fragmentos de texto de la respuesta del primer backend de la ruta que la entregue.
+
+        Si un backend falla antes de enviar el primer fragmento se pasa al siguiente. Con `restartable`
+        (quien llama junta la respuesta entera antes de usarla) también si falla a mitad: se descarta
+        lo recibido y se pide de nuevo al siguiente backend. Si se pasa la lista `answered`, al terminar
+        se le añade el backend que dio la respuesta.
+        """
+        candidates = self.router.candidates(route)
+        for index, backend in enumerate(candidates):
+            last = index == len(candidates) - 1
+            # Solo el último backend agota los reintentos; los demás ceden el turno al siguiente
+            retries = self.scheduler.max_retries if last else 0
+            response_stream, parts, ttft = None, [], None
+            try:
+                response_stream, started = self._open_stream(backend, messages_with_context, priority, route, retries)
+                for content in self._iter_deltas(response_stream):
+                    if ttft is None:
+                        ttft = time.monotonic() - started
+                    parts.append(content)
+                    if not restartable:
+                        yield content
+            except STREAM_ERRORS as e:
+                if response_stream is not None:
+                    # Los errores al abrir el flujo ya los anota _open_stream
+                    self.router.record(route, backend, ttft, time.monotonic() - started, error=e)
+                    response_stream.close()
+                if last or (ttft is not None and not restartable):
+                    raise
+                self.router.record_failover(route, backend, e)
+                continue
+            self.router.record(route, backend, ttft, time.monotonic() - started)
+            self.scheduler.record_output(backend.model, route, self.context_budget.count("".join(parts)))
+            if answered is not None:
+                answered.append(backend)
+            if restartable:
+                yield from parts
+            return
+
+    def _open_stream(self, backend, messages_with_context, priority, route, retries):
+        """
+        Abre el flujo con un backend respetando su presupuesto y reintentando errores transitorios.
+        Devuelve el flujo y el instante en que se hizo la petición que lo abrió.
+        """
+        prompt_tokens = self.context_budget.count_messages(messages_with_context)
+        sampling = self._sampling(backend, prompt_tokens)
+        tokens = prompt_tokens + self.scheduler.expected_output(backend.model, route, sampling["max_tokens"])
+        for attempt in range(retries + 1):
+            self.scheduler.acquire(backend.model, tokens, priority)
+            started = time.monotonic()
+            try:
+                raw_response = backend.client.chat.completions.with_raw_response.create(
+                    messages=messages_with_context,
+                    model=backend.model,
+                    stream=True,
+                    timeout=self.router.timeout(route),
+                    **sampling
+                )
+                self.scheduler.update_from_headers(backend.model, raw_response.headers, backend.request_limit_window)
+                return raw_response.parse(), started
+            except API_ERRORS as e:
+                self.router.record(route, backend, None, time.monotonic() - started, error=e)
+                if attempt == retries or not isinstance(e, RETRYABLE_ERRORS):
+                    raise
+                delay = self._retry_delay(backend, e, attempt)
+                print(f"⏳ {RED}Reintento {attempt + 1} en {delay:.1f}s:{RESET} {type(e).__name__}")
+                time.sleep(delay)
+
+    def _retry_delay(self, backend, error, attempt):
+        response = getattr(error, "response", None)
+        headers = response.headers if response is not None else {}
+        if response is not None:
+            self.scheduler.update_from_headers(backend.model, headers, backend.request_limit_window)
+        return self.scheduler.backoff(attempt, headers.get("retry-after"))
+
+    def _cache_key(self, messages_with_context, use_cache, route):
+        """Clave de la respuesta del backend principal de la ruta (None si no se usa la caché)."""
+        if not use_cache or self.cache is None:
+            return None
+        model = self.router.primary(route).model
+        return ResponseCache.make_key(model, messages_with_context, **self.sampling)
+
+    def _cache_response(self, cache_key, route, answered, response_text):
+        """
+        Guarda la respuesta solo si la dio el backend principal: la de un backend de reserva no puede
+        quedar en la caché con la clave del principal, y con la suya nunca se consultaría.
+        """
+        if cache_key is None or not answered:
+            return
+        if answered[0] is self.router.primary(route):
+            self.cache.set(cache_key, response_text)
+
+    def cache_stats(self):
+        """Aciertos/fallos de la caché de respuestas (None si está desactivada)."""
+        return self.cache.stats() if self.cache is not None else None
+
+    def get_metrics(self):
+        """Métricas de enrutado (backend que atendió cada ruta, failovers) y de latencia por backend."""
+        return {"routing": self.router.metrics(), "cache": self.cache_stats()}
+
+    async def _astream_deltas(self, messages_with_context, priority=INTERACTIVE, route="chat", restartable=False, answered=None):
+        """Variante asíncrona de _stream_deltas."""
+        candidates = self.router.candidates(route)
+        for index, backend in enumerate(candidates):
+            last = index == len(candidates) - 1
+            retries = self.scheduler.max_retries if last else 0
+            response_stream, parts, ttft = None, [], None
+            try:
+                response_stream, started = await self._aopen_stream(backend, messages_with_context, priority, route, retries)
+                async for content in self._aiter_deltas(response_stream):
+                    if ttft is None:
+                        ttft = time.monotonic() - started
+                    parts.append(content)
+                    if not restartable:
+                        yield content
+            except STREAM_ERRORS as e:
+                if response_stream is not None:
+                    self.router.record(route, backend, ttft, time.monotonic() - started, error=e)
+                    await response_stream.close()
+                if last or (ttft is not None and not restartable):
+                    raise
+                self.router.record_failover(route, backend, e)
+                continue
+            self.router.record(route, backend, ttft, time.monotonic() - started)
+            self.scheduler.record_output(backend.model, route, self.context_budget.count("".join(parts)))
+            if answered is not None:
+                answered.append(backend)
+            for content in parts if restartable else ():
+                yield content
+            return
+
+    async def _aopen_stream(self, backend, messages_with_context, priority, route, retries):
+        client = backend.get_async_client()
+        prompt_tokens = self.context_budget.count_messages(messages_with_context)
+        sampling = self._sampling(backend, prompt_tokens)
+        tokens = prompt_tokens + self.scheduler.expected_output(backend.model, route, sampling["max_tokens"])
+        for attempt in range(retries + 1):
+            await self.scheduler.aacquire(backend.model, tokens, priority)
+            started = time.monotonic()
+            try:
+                raw_response = await client.chat.completions.with_raw_response.create(
+                    messages=messages_with_context,
+                    model=backend.model,
+                    stream=True,
+                    timeout=self.router.timeout(route),
+                    **sampling
+                )
+                self.scheduler.update_from_headers(backend.model, raw_response.headers, backend.request_limit_window)
+                return await raw_response.parse(), started
+            except API_ERRORS as e:
+                self.router.record(route, backend, None, time.monotonic() - started, error=e)
+                if attempt == retries or not isinstance(e, RETRYABLE_ERRORS):
+                    raise
+                delay = self._retry_delay(backend, e, attempt)
+                print(f"⏳ {RED}Reintento {attempt + 1} en {delay:.1f}s:{RESET} {type(e).__name__}")
+                await asyncio.sleep(delay)
+
+    async def _aiter_deltas(self, response_stream):
+        async for chunk in response_stream:
+            try:
+                content = chunk.choices[0].delta.content
+                if content:
+                    yield content
+            except (AttributeError, IndexError, KeyError) as e:
+                print(f"Error al procesar chunk: {e}")
+
+    def _iter_deltas(self, response_stream):
+        """Extrae el texto de cada chunk del flujo de respuesta."""
+        for chunk in response_stream:
+            try:
+                content = chunk.choices[0].delta.content
+                if content:
+                    yield content
+            except (AttributeError, IndexError, KeyError) as e:
+                print(f"Error al procesar chunk: {e}")
+
+    def _rate_limit_message(self, e):
+        try:
+            error_code = e.response.json().get('error', {}).get('code', 'unknown_error')
+        except AttributeError:
+            error_code = 'unknown_error'
+        print(f"😿 {RED}Error:{RESET} {e.message}")
+        return f"{RATE_LIMIT_PREFIX} Misteriosas y caprichosas... algo interfiere en mi sagrada conexión con ellas...\n❌ Error: {error_code} ❌\nLas energías se agitan, y cuando esto sucede, la verdad se oculta tras un manto de sombras. Sin embargo, no temas, pues lo que el tarot guarda, tarde o temprano será revelado. Necesito un momento para purificar la conexión... y entonces, corazón, el mensaje se revelará con la fuerza de lo inevitable."
+
+    def get_response(self, messages_with_context, use_cache=True, priority=INTERACTIVE, route="chat"):
+        """
+        Devuelve la respuesta completa del LLM.
+        Con `use_cache=False` se omite la caché (respuestas conversacionales que deben variar).
+        `priority` (INTERACTIVE o BACKGROUND) decide quién pasa primero cuando se agota el presupuesto.
+        `route` ("guard", "rag", "chat" o "reading") elige los backends que atienden la llamada.
+        """
+        cache_key = self._cache_key(messages_with_context, use_cache, route)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        try:
+            answered = []
+            response_text = "".join(self._stream_deltas(messages_with_context, priority, route, restartable=True,
+                                                        answered=answered))
             if not response_text:
                 raise ValueError("El flujo de respuesta está vacío o no contiene texto válido.")
+            self._cache_response(cache_key, route, answered, response_text)
             return response_text
 
-        except RateLimitError as e:
-            try:
-                error_code = e.response.json().get('error', {}).get('code', 'unknown_error')
-            except AttributeError:
-                error_code = 'unknown_error'
-            print(f"😿 {RED}Error:{RESET} {e.message}")
-            return f"😿 ¡Ah, las cartas! Misteriosas y caprichosas... algo interfiere en mi sagrada conexión con ellas...\n❌ Error: {error_code} ❌\nLas energías se agitan, y cuando esto sucede, la verdad se oculta tras un manto de sombras. Sin embargo, no temas, pues lo que el tarot guarda, tarde o temprano será revelado. Necesito un momento para purificar la conexión... y entonces, corazón, el mensaje se revelará con la fuerza de lo inevitable."
+        except RATE_LIMIT_ERRORS as e:
+            return self._rate_limit_message(e)
+
+        except Exception as e:
+            print(f"Error inesperado: {e}")
+            return UNEXPECTED_ERROR_MESSAGE
+
+    async def aget_response(self, messages_with_context, use_cache=True, priority=INTERACTIVE, route="chat"):
+        """
+        Variante asíncrona de get_response sobre AsyncGroq/AsyncOpenAI.
+        Se puede esperar desde cualquier bucle de eventos: la llamada se ejecuta en el del cliente.
+        """
+        return await self._get_runner().run_async(self._aget_response(messages_with_context, use_cache, priority, route))
+
+    async def _aget_response(self, messages_with_context, use_cache, priority, route):
+        cache_key = self._cache_key(messages_with_context, use_cache, route)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        try:
+            answered = []
+            parts = [content async for content in self._astream_deltas(messages_with_context, priority, route, restartable=True,
+                                                                       answered=answered)]
+            response_text = "".join(parts)
+            if not response_text:
+                raise ValueError("El flujo de respuesta está vacío o no contiene texto válido.")
+            self._cache_response(cache_key, route, answered, response_text)
+            return response_text
+
+        except RATE_LIMIT_ERRORS as e:
+            return self._rate_limit_message(e)
+
+        except Exception as e:
+            print(f"Error inesperado: {e}")
+            return UNEXPECTED_ERROR_MESSAGE
+
+    def get_responses(self, conversations, use_cache=True, priority=INTERACTIVE, route="chat"):
+        """Lanza varias conversaciones a la vez y devuelve sus respuestas en el mismo orden."""
+        async def gather():
+            return await asyncio.gather(*(self._aget_response(c, use_cache, priority, route) for c in conversations))
+        return self.run_sync(gather())
+
+    def stream_response(self, messages_with_context, use_cache=True, priority=INTERACTIVE, route="chat"):
+        """
+        Generador con los fragmentos de texto de la respuesta según van llegando,
+        pensado para `st.write_stream`. Ante un error lanza LlmResponseError con el mismo mensaje
+        que devolvería get_response, en lugar de mezclarlo con el texto ya emitido.
+        """
+        cache_key = self._cache_key(messages_with_context, use_cache, route)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        try:
+            parts, answered = [], []
+            for content in self._stream_deltas(messages_with_context, priority, route, answered=answered):
+                parts.append(content)
+                yield content
+            if not parts:
+                raise ValueError("El flujo de respuesta está vacío o no contiene texto válido.")
+            self._cache_response(cache_key, route, answered, "".join(parts))
+
+        except RATE_LIMIT_ERRORS as e:
+            raise LlmResponseError(self._rate_limit_message(e)) from e
 
         except Exception as e:
             print(f"Error inesperado: {e}")
-            return "Error inesperado al procesar la solicitud."
+            raise LlmResponseError(UNEXPECTED_ERROR_MESSAGE) from e
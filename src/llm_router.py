@@ -0,0 +1,179 @@
+import threading
+import httpx
+import groq
+import openai
+from groq import Groq, AsyncGroq
+from openai import OpenAI, AsyncOpenAI
+from src.config import get_config
+from src.utils.utils import PASTEL_YELLOW, TURQUOISE, RESET
+
+# Otros modelos probados: "llama-3.3-70b-versatile", "gemma2-9b-it", "mixtral-8x7b-32768" (no responde bien...)
+# Modelos disponibles a la vez: nombre -> (modelo, ventana de contexto en tokens)
+# Se pueden cambiar con LLM_MODEL_FAST, LLM_MODEL_DEFAULT y LLM_MODEL_LARGE en el .env
+BACKENDS = {
+    "fast": ("llama-3.1-8b-instant", 131072),
+    "default": ("llama3-8b-8192", 8192),
+    "large": ("gpt-3.5-turbo-0125", 16385),
+}
+
+# Tipo de llamada -> backends por orden de preferencia (si uno falla se pasa al siguiente)
+ROUTES = {
+    "guard": ["fast", "default"],    # verificaciones sí/no: baratas y rápidas
+    "rag": ["default", "fast"],      # información de cartas y de la tirada
+    "chat": ["default", "fast"],     # respuestas de LAILA en la conversación
+    "reading": ["large", "default"], # interpretación final de la tirada
+    "summary": ["fast", "default"],  # resumen incremental de la conversación
+}
+
+# SLO de latencia (segundos): hasta el primer fragmento de texto y hasta el final de la respuesta.
+# Incumplirlos no corta la llamada, se anota en las métricas del backend.
+FIRST_TOKEN_SLO = {"guard": 2.0, "rag": 5.0, "chat": 5.0, "reading": 10.0, "summary": 5.0}
+LATENCY_SLO = {"guard": 5.0, "rag": 15.0, "chat": 15.0, "reading": 30.0, "summary": 15.0}
+
+# Tiempo máximo de espera de cada lectura del flujo (múltiplo del SLO total): solo para backends
+# que se han quedado colgados, que entonces cuentan como error y se pasa al siguiente
+HARD_TIMEOUT_FACTOR = 4
+
+# Errores por exceder el tiempo máximo de la llamada (cuentan como incumplimiento del SLO)
+TIMEOUT_ERRORS = (groq.APITimeoutError, openai.APITimeoutError, httpx.TimeoutException)
+
+# Pool de conexiones HTTP de cada backend (keep-alive entre peticiones)
+HTTP_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=60)
+
+
+class LlmBackend:
+    """Un modelo de un proveedor (Groq u OpenAI) con sus clientes síncrono y asíncrono."""
+    def __init__(self, name, model, context_window):
+        self.name = name
+        self.model = model
+        self.context_window = context_window
+        # Segundos que cubren las cabeceras x-ratelimit-*-requests: OpenAI da el límite por minuto y Groq por día
+        self.request_limit_window = 60 if model.startswith("gpt-") else 24 * 3600
+
+        # Los reintentos de los SDK se desactivan: de eso se encarga el planificador del LlmClient
+        if model.startswith("gpt-"):
+            api_key = get_config().openai_api_key
+            if not api_key:
+                raise ValueError("La clave OPENAI_API_KEY no está definida en las variables de entorno.")
+            self.client = OpenAI(api_key=api_key, max_retries=0,
+                                 http_client=openai.DefaultHttpxClient(limits=HTTP_LIMITS))
+            self._async_client_factory = lambda: AsyncOpenAI(
+                api_key=api_key, max_retries=0, http_client=openai.DefaultAsyncHttpxClient(limits=HTTP_LIMITS))
+        else:
+            api_key = get_config().groq_api_key
+            if not api_key:
+                raise ValueError("La clave GROQ_API_KEY no está definida en las variables de entorno.")
+            self.client = Groq(api_key=api_key, max_retries=0,
+                               http_client=groq.DefaultHttpxClient(limits=HTTP_LIMITS))
+            self._async_client_factory = lambda: AsyncGroq(
+                api_key=api_key, max_retries=0, http_client=groq.DefaultAsyncHttpxClient(limits=HTTP_LIMITS))
+
+        # El cliente asíncrono se crea dentro del bucle de eventos del LlmClient la primera vez que se usa
+        self._async_client = None
+
+    def get_async_client(self):
+        if self._async_client is None:
+            self._async_client = self._async_client_factory()
+        return self._async_client
+
+
+class LlmRouter:
+    """
+    Decide qué backend atiende cada tipo de llamada y lleva las métricas de enrutado.
+
+    Por backend: llamadas, errores, incumplimientos de los SLO, latencia hasta el primer fragmento
+    (TTFT) y latencia total de la respuesta.
+    Por ruta: cuántas llamadas atendió cada backend y cuántas veces hubo que pasar al siguiente.
+    """
+    def __init__(self, backends=None, routes=ROUTES, latency_slo=LATENCY_SLO, first_token_slo=FIRST_TOKEN_SLO,
+                 default_model=None):
+        self.routes = routes
+        self.latency_slo = latency_slo
+        self.first_token_slo = first_token_slo
+        self.backends = {}
+        config = get_config()
+        for name, (model, context_window) in (backends or BACKENDS).items():
+            model = config.llm_model(name, model)
+            if name == "default" and default_model:
+                model = default_model
+            try:
+                self.backends[name] = LlmBackend(name, model, context_window)
+                print(f"🤖 {TURQUOISE}Backend {name}: {model}{RESET}")
+            except ValueError as e:
+                print(f"{PASTEL_YELLOW}Backend {name} ({model}) desactivado:{RESET} {e}")
+        if not self.backends:
+            raise ValueError("No hay ningún LLM disponible: configura GROQ_API_KEY u OPENAI_API_KEY.")
+
+        self._lock = threading.Lock()
+        self._backend_stats = {name: {"calls": 0, "errors": 0, "ttft_breaches": 0, "slo_breaches": 0,
+                                      "ttft_calls": 0, "ttft_total": 0.0, "ttft_max": 0.0,
+                                      "latency_total": 0.0, "latency_max": 0.0} for name in self.backends}
+        self._route_stats = {}
+
+    def candidates(self, route):
+        """Backends disponibles para la ruta, por orden; si no queda ninguno, cualquier disponible."""
+        names = [name for name in self.routes.get(route, self.routes["chat"]) if name in self.backends]
+        if not names:
+            names = list(self.backends)
+        return [self.backends[name] for name in names]
+
+    def primary(self, route):
+        return self.candidates(route)[0]
+
+    def slo(self, route):
+        return self.latency_slo.get(route)
+
+    def timeout(self, route):
+        """Tiempo máximo de cada lectura del flujo para la ruta (None: el de los SDK)."""
+        slo = self.slo(route)
+        return slo * HARD_TIMEOUT_FACTOR if slo is not None else None
+
+    def record(self, route, backend, ttft, latency, error=None):
+        """
+        Anota el resultado de un intento de `backend` para la ruta `route`: segundos hasta el primer
+        fragmento (`ttft`, None si no llegó ninguno) y hasta el final o el error (`latency`).
+        """
+        first_token_slo = self.first_token_slo.get(route)
+        slo = self.slo(route)
+        timed_out = isinstance(error, TIMEOUT_ERRORS)
+        # Sin primer fragmento, la espera hasta el error también cuenta contra el SLO del primer fragmento
+        waited = ttft if ttft is not None else latency
+        ttft_breach = (ttft is None and timed_out) or (first_token_slo is not None and waited > first_token_slo)
+        slo_breach = timed_out or (slo is not None and latency > slo)
+        with self._lock:
+            stats = self._backend_stats[backend.name]
+            stats["calls"] += 1
+            stats["latency_total"] += latency
+            stats["latency_max"] = max(stats["latency_max"], latency)
+            if ttft is not None:
+                stats["ttft_calls"] += 1
+                stats["ttft_total"] += ttft
+                stats["ttft_max"] = max(stats["ttft_max"], ttft)
+            stats["ttft_breaches"] += int(ttft_breach)
+            stats["slo_breaches"] += int(slo_breach)
+            if error is not None:
+                stats["errors"] += 1
+            else:
+                served_by = self._route(route)["served_by"]
+                served_by[backend.name] = served_by.get(backend.name, 0) + 1
+
+    def record_failover(self, route, backend, error):
+        """Anota que `backend` no pudo atender la ruta y se pasa al siguiente."""
+        with self._lock:
+            self._route(route)["failovers"] += 1
+        print(f"🔀 {PASTEL_YELLOW}{backend.name} ({backend.model}) falló en '{route}', se pasa al siguiente backend:{RESET} {type(error).__name__}")
+
+    def _route(self, route):
+        return self._route_stats.setdefault(route, {"served_by": {}, "failovers": 0})
+
+    def metrics(self):
+        """Copia de las métricas de enrutado y latencia."""
+        with self._lock:
+            backends = {}
+            for name, stats in self._backend_stats.items():
+                backends[name] = dict(stats, model=self.backends[name].model,
+                                      latency_avg=stats["latency_total"] / stats["calls"] if stats["calls"] else 0.0,
+                                      ttft_avg=stats["ttft_total"] / stats["ttft_calls"] if stats["ttft_calls"] else 0.0)
+            routes = {route: {"served_by": dict(stats["served_by"]), "failovers": stats["failovers"]}
+                      for route, stats in self._route_stats.items()}
+            return {"backends": backends, "routes": routes}
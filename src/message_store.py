@@ -0,0 +1,54 @@
+class Message:
+    """Mensaje del historial (rol, contenido y si se muestra o no en el chat)."""
+    __slots__ = ("role", "content", "hidden")
+
+    def __init__(self, role, content, hidden=False):
+        self.role = role
+        self.content = content
+        self.hidden = hidden
+
+    def __repr__(self):
+        return f"Message(role={self.role!r}, hidden={self.hidden!r}, content={self.content[:40]!r})"
+
+
+class MessageStore:
+    """
+    Historial de mensajes de solo escritura al final.
+
+    Mantiene al día, mensaje a mensaje, las vistas "todos" (dicts {"role", "content"} listos para
+    el LLM) y "visibles", así que consultarlas o leer el último mensaje no copia el historial.
+    Las vistas son compartidas: no se deben modificar desde fuera.
+    """
+    __slots__ = ("_records", "_all", "_visible")
+
+    def __init__(self):
+        self._records = []
+        self._all = []
+        self._visible = []
+
+    def append(self, role, content, hidden=False):
+        message = Message(role, content, hidden)
+        self._records.append(message)
+        self._all.append({"role": role, "content": content})
+        if not hidden:
+            self._visible.append(message)
+        return message
+
+    def last(self):
+        """Último mensaje, o None si el historial está vacío."""
+        return self._records[-1] if self._records else None
+
+    def all(self):
+        return self._all
+
+    def visible(self):
+        return self._visible
+
+    def __len__(self):
+        return len(self._records)
+
+    def __getitem__(self, index):
+        return self._records[index]
+
+    def __iter__(self):
+        return iter(self._records)
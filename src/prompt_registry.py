@@ -0,0 +1,118 @@
+import os
+import string
+import threading
+from pathlib import Path
+from src.config import get_config, add_watcher
+from src.context_budget import ContextBudget
+from src.utils.utils import PASTEL_YELLOW, RED, RESET
+
+PROMPT_DIR = Path(__file__).resolve().parent / "prompt"
+
+
+class PromptTemplate:
+    """
+    Plantilla con sus variables ya localizadas: render() solo concatena trozos.
+    El texto anterior a la primera variable (`static_prefix`) es idéntico en todas las llamadas.
+    """
+    __slots__ = ("name", "text", "parts", "has_fields", "static_prefix", "static_tokens")
+
+    def __init__(self, name, text, budget, static=False):
+        self.name = name
+        self.text = text
+        self.parts = [(text, None)] if static else [(literal, field) for literal, field, _, _ in string.Formatter().parse(text)]
+        self.has_fields = any(field is not None for _, field in self.parts)
+        self.static_prefix = self.parts[0][0] if self.has_fields else text
+        # Tokens del texto fijo calculados una vez (y recordados por el ContextBudget)
+        self.static_tokens = budget.remember(self.static_prefix)
+
+    def render(self, **values):
+        if not self.has_fields:
+            return self.text
+        return "".join(literal + (str(values[field]) if field is not None else "") for literal, field in self.parts)
+
+
+def _files_signature(paths):
+    """Ruta y fecha de modificación de cada fichero: cambia si se edita, añade o borra alguno."""
+    signature = []
+    for path in sorted(set(paths)):
+        try:
+            signature.append((str(path), os.stat(path).st_mtime_ns))
+        except FileNotFoundError:
+            signature.append((str(path), None))
+    return tuple(signature)
+
+
+class PromptRegistry:
+    """
+    Prompts de la aplicación: la personalidad de LAILA (PROMPT_FILE) y las plantillas de
+    src/prompt/*.txt (verificaciones, tono, tirada, resumen...). Se cargan una vez y se vuelven a
+    cargar cuando cambian PROMPT_FILE, algún fichero o el ContextBudget compartido.
+
+    Los cambios los detecta el hilo config-watcher (ver add_watcher), que construye el registro nuevo
+    y lo sustituye; shared() solo lee el vigente, sin tocar el disco.
+    """
+    _shared = {}  # prompt_dir -> (versión, registro)
+    _failed = {}  # prompt_dir -> versión que no se pudo cargar (no se reintenta hasta otro cambio)
+    _shared_lock = threading.Lock()
+
+    def __init__(self, prompt_dir=PROMPT_DIR, prompt_file=None, budget=None):
+        self.budget = budget or ContextBudget.shared()
+        self.templates = {}
+        prompt_file = Path(prompt_file or get_config().prompt_file).resolve()
+        try:
+            personality = prompt_file.read_text(encoding="utf-8")
+        except FileNotFoundError:
+            raise ValueError("Error: No se encontró el archivo de prompt.")
+        self.templates["personality"] = PromptTemplate("personality", personality, self.budget, static=True)
+
+        for path in sorted(Path(prompt_dir).glob("*.txt")):
+            if path.resolve() != prompt_file:
+                text = path.read_text(encoding="utf-8").rstrip("\n")
+                self.templates[path.stem] = PromptTemplate(path.stem, text, self.budget)
+
+    @classmethod
+    def shared(cls, prompt_dir=PROMPT_DIR):
+        """Registro vigente; la primera vez se carga y se empieza a vigilar."""
+        entry = cls._shared.get(prompt_dir)
+        if entry is None:
+            with cls._shared_lock:
+                entry = cls._shared.get(prompt_dir)
+                if entry is None:
+                    version, budget, prompt_file = cls._version(prompt_dir)
+                    entry = cls._shared[prompt_dir] = (version, cls(prompt_dir, prompt_file, budget))
+                    add_watcher(lambda: cls.refresh(prompt_dir))
+        return entry[1]
+
+    @staticmethod
+    def _version(prompt_dir):
+        """Lo que obliga a recargar: el ContextBudget compartido, PROMPT_FILE y las fechas de los ficheros."""
+        budget = ContextBudget.shared()
+        prompt_file = Path(get_config().prompt_file).resolve()
+        version = (id(budget), str(prompt_file), _files_signature([prompt_file, *Path(prompt_dir).glob("*.txt")]))
+        return version, budget, prompt_file
+
+    @classmethod
+    def refresh(cls, prompt_dir=PROMPT_DIR):
+        """Vuelve a cargar el registro si ha cambiado algo (lo llama el hilo config-watcher)."""
+        version, budget, prompt_file = cls._version(prompt_dir)
+        if version in (cls._shared[prompt_dir][0], cls._failed.get(prompt_dir)):
+            return
+        try:
+            registry = cls(prompt_dir, prompt_file, budget)
+        except (OSError, ValueError) as e:
+            cls._failed[prompt_dir] = version
+            print(f"{RED}No se pudieron recargar los prompts, se mantienen los anteriores:{RESET} {e}")
+            return
+        with cls._shared_lock:
+            cls._shared[prompt_dir] = (version, registry)
+        print(f"{PASTEL_YELLOW}📝 Prompts recargados{RESET}")
+
+    def get(self, name):
+        return self.templates[name]
+
+    def text(self, name):
+        """Texto de una plantilla sin variables (siempre el mismo objeto, byte a byte)."""
+        return self.templates[name].text
+
+    def render(self, name, **values):
+        return self.templates[name].render(**values)
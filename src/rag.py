@@ -2,99 +2,127 @@ from langchain_huggingface import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_community.docstore.base import Docstore
 from langchain_community.document_loaders import TextLoader, PyPDFLoader
-import os
-import pickle
+import asyncio
+import numpy as np
 import torch
-import streamlit as st
 from src.llm_client import LlmClient
+from src.rate_limiter import INTERACTIVE
+from src.index_store import IndexStore, IncrementalIndexer
+from src.hybrid_retriever import BM25Index, HybridRetriever
+from src.card_index import CardIndex, tag_chunk
+from src import ann_index
+from src.config import get_config
+from src.resources import get_resource
+from src.embedding_cache import EmbeddingCache
 from src.utils.utils import BLUE, PURPLE, RESET, RED, PASTEL_YELLOW
 
-class RAG:
-    def __init__(self, data_dir="context", index_file="faiss_index.pkl"):
-        self.index_file = index_file
-        self.docs = []
-
-        # Controlar carga de FAISS usando st.session_state y cache
-        if "faiss_index_loaded" not in st.session_state:
-            st.session_state.faiss_index_loaded = False
-            st.session_state.db = None
-            st.session_state.retriever = None
-
-        if not st.session_state.faiss_index_loaded:
-            self._load_or_create_index(data_dir)
-        else:
-            print(f"\n✅ {PASTEL_YELLOW}Índice FAISS ya cargado.{RESET}")
-            self.db = st.session_state.db
-            self.retriever = st.session_state.retriever
+EMBEDDINGS_MODEL = "sentence-transformers/all-mpnet-base-v2"
 
-        # Inicializar LLM Client
-        self.llm_client = LlmClient()
 
-    # @st.cache_data
-    # def _load_or_create_index(_self, data_dir):
-    #     if os.path.exists(_self.index_file):
-    #         print(f"\n🌀 {BLUE}Cargando índice FAISS desde archivo...{RESET}\n")
-    #         with open(_self.index_file, 'rb') as f:
-    #             st.session_state.db = pickle.load(f)
-    #             st.session_state.retriever = st.session_state.db.as_retriever(search_kwargs={"k": 4})
-    #         st.session_state.faiss_index_loaded = True
-    #     else:
-    #         print("\n📍 El archivo de índice no existe. Creando un nuevo índice FAISS...")
-    #         _self._create_index(data_dir)
-
-    def _load_or_create_index(_self, data_dir):
-        """Carga el índice FAISS sin spinner ni caché"""
-        if os.path.exists(_self.index_file):
-            with open(_self.index_file, 'rb') as f:
-                st.session_state.db = pickle.load(f)
-                st.session_state.retriever = st.session_state.db.as_retriever(search_kwargs={"k": 4})
-            st.session_state.faiss_index_loaded = True
-        else:
-            _self._create_index(data_dir)
+class CachedEmbeddings(Embeddings):
+    """Embeddings de LangChain con las consultas pasadas por el EmbeddingCache; los documentos no se cachean."""
+    def __init__(self, embeddings, model_name, cache):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache
 
+    def embed_documents(self, texts):
+        return self.embeddings.embed_documents(texts)
 
+    def embed_query(self, text):
+        return self.cache.get_or_compute(self.model_name, text, self.embeddings.embed_query).tolist()
 
-    def _create_index(self, data_dir):
-        # Cargar documentos desde la carpeta 'data'
-        for file_name in os.listdir(data_dir):
-            file_path = os.path.join(data_dir, file_name)
-            if file_name.endswith(".txt"):
-                loader = TextLoader(file_path, encoding="utf-8")
-            elif file_name.endswith(".pdf"):
-                loader = PyPDFLoader(file_path)
-            else:
-                print(f"{PASTEL_YELLOW}📜 Formato no soportado:{RESET} {file_name}")
-                continue
 
-            self.docs.extend(loader.load())
+def load_embeddings(model_path=EMBEDDINGS_MODEL):
+    """Modelo de embeddings compartido por todo el proceso (RAG, clasificadores locales...)."""
+    return get_resource(("embeddings", model_path), lambda: CachedEmbeddings(HuggingFaceEmbeddings(
+        model_name=model_path,
+        model_kwargs={'device': 'cuda' if torch.cuda.is_available() else 'cpu'},
+        encode_kwargs={'normalize_embeddings': False, 'batch_size': 64},
+    ), model_path, EmbeddingCache.shared()))
 
-        print(f"{PASTEL_YELLOW}🙌 Documentos cargados:{RESET} {len(self.docs)}")
 
-        # Dividir los textos
+class ChunkDocstore(Docstore):
+    """Docstore de solo lectura que lee los fragmentos bajo demanda desde un ChunkStore."""
+    def __init__(self, chunk_store):
+        self.chunk_store = chunk_store
+
+    def search(self, search):
+        chunk_id = int(search)
+        return Document(page_content=self.chunk_store.get_text(chunk_id), metadata=self.chunk_store.get_metadata(chunk_id))
+
+
+class RAG:
+    def __init__(self, data_dir="context", index_dir="data/rag_index"):
+        self.index_dir = index_dir
         self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150)
-        self.docs = self.text_splitter.split_documents(self.docs)
-
-        # Configurar Embeddings
-        model_path = "sentence-transformers/all-mpnet-base-v2"
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name=model_path,
-            model_kwargs={'device': 'cuda' if torch.cuda.is_available() else 'cpu'},
-            encode_kwargs={'normalize_embeddings': False},
+
+        # El índice y el modelo de embeddings se cargan una sola vez por proceso y se
+        # comparten (solo lectura) entre todas las sesiones y componentes
+        self.db = get_resource(("rag_index", data_dir, index_dir), lambda: self._load_or_create_index(data_dir))
+        self.embeddings = self.db.embedding_function
+        # Índice BM25 sobre los mismos fragmentos, fusionado con FAISS en cada búsqueda
+        self.lexical = get_resource(("rag_bm25", data_dir, index_dir),
+                                    lambda: BM25Index.from_chunk_store(self.db.docstore.chunk_store))
+        # Postings de cartas: candidatos léxicos de las preguntas sobre una carta
+        self.card_index = get_resource(("rag_cards", data_dir, index_dir),
+                                       lambda: CardIndex.from_chunk_store(self.db.docstore.chunk_store))
+        config = get_config()
+        self.retriever = HybridRetriever(self.db, self.lexical, k=config.rag_top_k, fetch_k=config.rag_fetch_k)
+
+        # Inicializar LLM Client
+        self.llm_client = LlmClient()
+
+    def _load_or_create_index(self, data_dir):
+        """Sincroniza el índice con `data_dir` (solo reindexa lo nuevo o modificado) y lo abre."""
+        store = IndexStore(self.index_dir)
+        IncrementalIndexer(store, data_dir, self._split_file, self._embed_documents).update()
+        return self._load_index(store)
+
+    def _load_embeddings(self):
+        """Modelo de embeddings usado tanto al indexar como al consultar (uno por proceso)."""
+        return load_embeddings()
+
+    def _load_index(self, store):
+        """Abre el índice y los fragmentos mapeados en memoria, sin deserializarlos."""
+        print(f"\n🌀 {BLUE}Cargando índice FAISS desde {self.index_dir}...{RESET}\n")
+        index, chunk_store = store.load(mmap=True)
+        # Con RAG_INDEX_TYPE distinto de "flat" se busca en un índice aproximado derivado del plano
+        config = get_config()
+        if config.rag_index_type != "flat":
+            index, meta = ann_index.load_or_build(store, config.rag_index_type,
+                                                  ann_index.parse_params(config.rag_index_params),
+                                                  min_recall=config.rag_index_min_recall)
+            if "fallback" not in meta:
+                print(f"🧮 {PURPLE}Índice {config.rag_index_type}: recall@{ann_index.RECALL_K} "
+                      f"{meta[f'recall@{ann_index.RECALL_K}']:.3f} frente al plano.{RESET}")
+        return FAISS(
+            embedding_function=self._load_embeddings(),
+            index=index,
+            docstore=ChunkDocstore(chunk_store),
+            index_to_docstore_id={int(chunk_id): str(int(chunk_id)) for chunk_id in chunk_store.ids},
         )
 
-        # Crear FAISS con todos los documentos
-        self.db = FAISS.from_documents(self.docs, self.embeddings)
-        self.retriever = self.db.as_retriever(search_kwargs={"k": 4})
-        st.session_state.db = self.db
-        st.session_state.retriever = self.retriever
-        st.session_state.faiss_index_loaded = True
-        print(f"🗂️{PURPLE} FAISS creado con {len(self.docs)} documentos.{RESET}")
+    def _split_file(self, file_path):
+        """Carga un documento y lo divide en fragmentos (texto, metadatos)."""
+        if file_path.endswith(".txt"):
+            loader = TextLoader(file_path, encoding="utf-8")
+        elif file_path.endswith(".pdf"):
+            loader = PyPDFLoader(file_path)
+        else:
+            print(f"{PASTEL_YELLOW}📜 Formato no soportado:{RESET} {file_path}")
+            return []
+
+        docs = self.text_splitter.split_documents(loader.load())
+        print(f"{PASTEL_YELLOW}🙌 {file_path}:{RESET} {len(docs)} fragmentos")
+        # Cada fragmento se etiqueta con las cartas y palos que menciona (ver src/card_index.py)
+        return [(doc.page_content, {**doc.metadata, **tag_chunk(doc.page_content)}) for doc in docs]
 
-        # Guardar índice FAISS en archivo
-        with open(self.index_file, 'wb') as f:
-            pickle.dump(self.db, f)
-        print(f"📑 Índice FAISS guardado en {self.index_file}")
+    def _embed_documents(self, texts):
+        return np.asarray(self._load_embeddings().embed_documents(texts), dtype=np.float32)
 
     def chat(self):
         """Modo chat interactivo con contexto persistente."""
@@ -116,18 +144,41 @@ class RAG:
             conversation_history.append({"role": "system", "content": f"Contexto proporcionado:\n{context}"})
 
             # Generación de respuesta
-            response = self.llm_client.get_response(conversation_history)
+            response = self.llm_client.get_response(conversation_history, route="rag")
             print(f"RAG: {response}")
 
-    def ask_question(self, question):
+    def _question_messages(self, question, results):
+        # Fragmentos sin repetir y recortados al presupuesto de tokens que deja la pregunta
+        budget = self.llm_client.context_budget
+        message = {"role": "user", "content": f"{question}\n\nContexto proporcionado:\n"}
+        available = self.llm_client.prompt_budget("rag") - budget.count_messages([message])
+        message["content"] += "\n".join(budget.fit_passages([doc.page_content for doc in results], available))
+        return [message]
+
+    def retrieve(self, question, card=None):
+        """
+        Fragmentos para la pregunta. Con `card`, los fragmentos que mencionan la carta (postings del
+        CardIndex) ordenados por BM25, sin embedding de la consulta ni búsqueda en FAISS; si la carta
+        no aparece en ningún fragmento, búsqueda híbrida normal.
+        """
+        chunk_ids = self.card_index.lookup(card) if card else ()
+        if len(chunk_ids):
+            return self.retriever.documents(self.lexical.rank(question, chunk_ids))
+        return self.retriever.search(question)
+
+    def ask_question(self, question, card=None):
         """Método para realizar una consulta sin modo chat."""
-        results = self.retriever.invoke(question)
-        context = "\n".join([doc.page_content for doc in results])
-        messages_with_context = [{"role": "user", "content": f"{question}\n\nContexto proporcionado:\n{context}"}]
-        response = self.llm_client.get_response(messages_with_context)
+        results = self.retrieve(question, card)
+        response = self.llm_client.get_response(self._question_messages(question, results), route="rag")
         return response
 
+    async def aask_question(self, question, priority=INTERACTIVE, card=None):
+        """Variante asíncrona de ask_question: la búsqueda va a un hilo y la llamada al LLM no bloquea."""
+        results = await asyncio.to_thread(self.retrieve, question, card)
+        return await self.llm_client.aget_response(self._question_messages(question, results), priority=priority, route="rag")
+
 if __name__ == "__main__":
     rag_chat = RAG()
     response = rag_chat.ask_question("¿En que consiste la piramide invertida de 6 cartas?")
     print("Respuesta:", response)
+    print("Caché de embeddings:", EmbeddingCache.shared().stats())
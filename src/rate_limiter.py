@@ -0,0 +1,212 @@
+import re
+import math
+import time
+import random
+import asyncio
+import threading
+
+# Prioridades: los turnos del usuario pasan por delante del trabajo en segundo plano
+INTERACTIVE = 0
+BACKGROUND = 1
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_duration(value):
+    """Convierte duraciones de las cabeceras de rate limit ("2m59.56s", "7.66s", "120ms", "3") a segundos."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_SECONDS[unit] for amount, unit in parts)
+
+
+# Tokens de salida que se reservan para una ruta de la que aún no se ha visto ninguna respuesta,
+# y peso de cada respuesta nueva en la media de los tokens de salida observados
+DEFAULT_OUTPUT_TOKENS = 256
+OUTPUT_SMOOTHING = 0.2
+
+
+class _Bucket:
+    """
+    Token bucket: `capacity` unidades que se recargan a `rate` unidades por segundo.
+    Las cabeceras del proveedor pueden bajar la capacidad configurada, pero nunca subirla.
+    """
+    def __init__(self, capacity, rate):
+        self.configured = float(capacity)
+        self.capacity = float(capacity)
+        self.rate = float(rate)
+        self.available = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        amount = min(amount, self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.rate if self.rate > 0 else 1.0
+
+    def sync(self, limit, remaining, reset_seconds, now):
+        """Ajusta el bucket con lo que informa el proveedor."""
+        if limit:
+            self.capacity = min(self.configured, float(limit))
+        if remaining is not None:
+            self.available = min(self.capacity, float(remaining))
+        if reset_seconds and self.capacity > self.available:
+            self.rate = (self.capacity - self.available) / reset_seconds
+        self.updated = now
+
+
+class RateLimitScheduler:
+    """
+    Planificador de llamadas al LLM que respeta los límites de peticiones y tokens de cada modelo.
+
+    Mantiene dos token buckets por modelo (peticiones y tokens por minuto), los recalibra con las
+    cabeceras x-ratelimit-* de cada respuesta, espera antes de enviar si no hay presupuesto y calcula
+    el backoff con jitter de los reintentos. Mientras haya llamadas interactivas esperando, las de
+    segundo plano no consumen presupuesto.
+
+    Las cabeceras de peticiones no significan lo mismo en todos los proveedores: en OpenAI son por
+    minuto y en Groq por día. Las que no son por minuto alimentan un tercer bucket con su propia
+    ventana, en lugar de hacerse pasar por el límite por minuto.
+
+    Cada llamada reserva su prompt más los tokens de salida que suele generar su ruta en ese modelo
+    (media de las respuestas anteriores), no el máximo de salida permitido.
+    """
+    def __init__(self, requests_per_minute=30, tokens_per_minute=6000,
+                 max_retries=4, base_delay=1.0, max_delay=30.0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._buckets = {}  # modelo -> (bucket de peticiones, bucket de tokens)
+        self._window_buckets = {}  # modelo -> bucket de peticiones de las cabeceras que no son por minuto
+        self._output_tokens = {}  # (modelo, ruta) -> media de tokens de salida por respuesta
+        self._waiting_interactive = {}
+        self._lock = threading.Lock()
+
+    def _model_buckets(self, model):
+        if model not in self._buckets:
+            self._buckets[model] = (
+                _Bucket(self.requests_per_minute, self.requests_per_minute / 60),
+                _Bucket(self.tokens_per_minute, self.tokens_per_minute / 60),
+            )
+        return self._buckets[model]
+
+    def reserve(self, model, tokens, priority=INTERACTIVE):
+        """Consume presupuesto si lo hay y devuelve 0; si no, devuelve los segundos que conviene esperar."""
+        with self._lock:
+            if priority != INTERACTIVE and self._waiting_interactive.get(model, 0):
+                return 0.25
+            now = time.monotonic()
+            requests, token_bucket = self._model_buckets(model)
+            requests.refill(now)
+            token_bucket.refill(now)
+            window = self._window_buckets.get(model)
+            if window is not None:
+                window.refill(now)
+            delay = max(requests.wait_time(1), token_bucket.wait_time(tokens),
+                        window.wait_time(1) if window is not None else 0.0)
+            if delay > 0:
+                return delay
+            requests.available -= 1
+            token_bucket.available -= min(tokens, token_bucket.capacity)
+            if window is not None:
+                window.available -= 1
+            return 0.0
+
+    def _enter(self, model, priority):
+        if priority == INTERACTIVE:
+            with self._lock:
+                self._waiting_interactive[model] = self._waiting_interactive.get(model, 0) + 1
+
+    def _leave(self, model, priority):
+        if priority == INTERACTIVE:
+            with self._lock:
+                self._waiting_interactive[model] -= 1
+
+    def acquire(self, model, tokens, priority=INTERACTIVE):
+        """Bloquea el hilo hasta que la llamada cabe en el presupuesto del modelo."""
+        self._enter(model, priority)
+        try:
+            while True:
+                delay = self.reserve(model, tokens, priority)
+                if delay <= 0:
+                    return
+                time.sleep(min(delay, 1.0))
+        finally:
+            self._leave(model, priority)
+
+    async def aacquire(self, model, tokens, priority=INTERACTIVE):
+        """Versión asíncrona de acquire."""
+        self._enter(model, priority)
+        try:
+            while True:
+                delay = self.reserve(model, tokens, priority)
+                if delay <= 0:
+                    return
+                await asyncio.sleep(min(delay, 1.0))
+        finally:
+            self._leave(model, priority)
+
+    def update_from_headers(self, model, headers, request_window=60):
+        """
+        Recalibra los buckets con las cabeceras x-ratelimit-* de la respuesta. `request_window` son
+        los segundos que cubre el límite de peticiones del proveedor (60 en OpenAI, un día en Groq).
+        """
+        def number(name):
+            value = headers.get(name)
+            try:
+                return float(value) if value is not None else None
+            except ValueError:
+                return None
+
+        with self._lock:
+            now = time.monotonic()
+            requests, token_bucket = self._model_buckets(model)
+            request_limit = number("x-ratelimit-limit-requests")
+            request_headers = (request_limit, number("x-ratelimit-remaining-requests"),
+                               parse_duration(headers.get("x-ratelimit-reset-requests")), now)
+            if request_window == 60:
+                requests.sync(*request_headers)
+            elif request_limit:
+                if model not in self._window_buckets:
+                    self._window_buckets[model] = _Bucket(request_limit, request_limit / request_window)
+                self._window_buckets[model].sync(*request_headers)
+            token_bucket.sync(number("x-ratelimit-limit-tokens"), number("x-ratelimit-remaining-tokens"),
+                              parse_duration(headers.get("x-ratelimit-reset-tokens")), now)
+
+    def backoff(self, attempt, retry_after=None):
+        """Espera antes del reintento `attempt` (0, 1, ...): retry-after si lo hay, si no exponencial con jitter."""
+        retry_after = parse_duration(retry_after)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay) + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def expected_output(self, model, route, max_tokens):
+        """Tokens de salida que se reservan para una llamada: lo que suele generar la ruta, sin pasar del máximo."""
+        with self._lock:
+            average = self._output_tokens.get((model, route), DEFAULT_OUTPUT_TOKENS)
+        return max(1, min(max_tokens, math.ceil(average)))
+
+    def record_output(self, model, route, tokens):
+        """Anota los tokens de salida de una respuesta completa para las reservas siguientes."""
+        with self._lock:
+            average = self._output_tokens.get((model, route))
+            self._output_tokens[(model, route)] = tokens if average is None else \
+                average + OUTPUT_SMOOTHING * (tokens - average)
+
+    def estimate_tokens(self, messages, max_tokens, model=None, route="chat"):
+        """Estimación rápida de los tokens de una petición (prompt + salida esperada)."""
+        return sum(len(str(m["content"])) for m in messages) // 4 + self.expected_output(model, route, max_tokens)
@@ -0,0 +1,37 @@
+"""
+Mide el coste de un rerun de Streamlit sin la interfaz ni las llamadas al LLM: construir el
+ChatApp de la sesión sobre el ChatCore ya cargado (lo que ocurre en cada interacción).
+
+    python -m src.rerun_benchmark [repeticiones]
+"""
+import sys
+import time
+import statistics
+from src.chat_app import ChatApp, ChatCore
+from src.utils.utils import BLUE, PASTEL_YELLOW, RESET
+
+
+def benchmark(repetitions=1000):
+    started = time.perf_counter()
+    core = ChatCore.shared()
+    core_seconds = time.perf_counter() - started
+
+    ChatApp(core)  # primera construcción: crea y restaura la sesión
+    timings = []
+    for _ in range(repetitions):
+        started = time.perf_counter()
+        ChatApp(core)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+
+    print(f"\n{BLUE}⏱️ Carga del ChatCore (una vez por proceso):{RESET} {core_seconds:.2f} s")
+    print(f"{BLUE}⏱️ Rerun ({repetitions} repeticiones):{RESET} "
+          f"media {statistics.mean(timings):.3f} ms, "
+          f"p50 {timings[len(timings) // 2]:.3f} ms, "
+          f"p95 {timings[int(len(timings) * 0.95) - 1]:.3f} ms")
+    return timings
+
+
+if __name__ == "__main__":
+    print(f"{PASTEL_YELLOW}Ejecutando fuera de Streamlit: se ignoran los avisos de ScriptRunContext{RESET}")
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,48 @@
+import threading
+
+# Registro de recursos pesados compartidos por todo el proceso (índices, modelos de embeddings...).
+# Streamlit solo re-ejecuta el script principal en cada rerun, así que los módulos importados,
+# y con ellos este registro, sobreviven entre reruns y entre sesiones.
+_resources = {}
+_registry_lock = threading.Lock()
+_key_locks = {}
+_versions = {}  # nombre -> clave de la versión vigente (get_versioned_resource)
+
+
+def get_resource(key, factory):
+    """
+    Devuelve el recurso `key`, creándolo con `factory()` la primera vez.
+    Cada clave tiene su propio lock: dos sesiones que piden el mismo recurso a la vez
+    esperan a una única carga, y una fábrica puede pedir a su vez otros recursos.
+    """
+    if key in _resources:
+        return _resources[key]
+
+    with _registry_lock:
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+
+    with key_lock:
+        if key not in _resources:
+            _resources[key] = factory()
+        return _resources[key]
+
+
+def get_versioned_resource(name, version, factory):
+    """
+    Como get_resource, pero el recurso se vuelve a crear cuando cambia `version` (un valor de la
+    configuración, las fechas de modificación de unos ficheros...). Solo se conserva la última versión.
+    """
+    key = (name, version)
+    resource = get_resource(key, factory)
+    with _registry_lock:
+        previous = _versions.get(name)
+        _versions[name] = key
+    if previous is not None and previous != key:
+        clear_resource(previous)
+    return resource
+
+
+def clear_resource(key):
+    """Elimina un recurso del registro para que se vuelva a crear en el siguiente acceso."""
+    with _registry_lock:
+        _resources.pop(key, None)
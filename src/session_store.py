@@ -0,0 +1,282 @@
+import os
+import json
+import time
+import uuid
+import atexit
+import sqlite3
+import threading
+import streamlit as st
+from src.message_store import MessageStore
+from src.resources import get_resource
+from src.config import get_config
+from src.utils.utils import PASTEL_YELLOW, RED, RESET
+
+# Claves de st.session_state que se guardan fuera del proceso (las tools y los flags de ejecución no)
+PERSISTED_KEYS = (
+    "app_initialized", "welcome_shown", "asking", "info", "step", "flow_state",
+    "country_info", "summary", "summary_upto",
+)
+
+
+class SqliteSessionBackend:
+    """
+    Sesiones en SQLite: una fila por campo y los mensajes en una tabla de solo inserción cuyo orden
+    lo asigna la base de datos (AUTOINCREMENT), así que dos procesos que escriban en la misma sesión
+    nunca se pisan. Solo es compartida entre réplicas si todas ven el mismo fichero.
+    """
+    def __init__(self, db_path="data/sessions.db", ttl=7 * 24 * 3600):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.ttl = ttl
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA busy_timeout=5000")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS session_fields (session_id TEXT, key TEXT, value TEXT NOT NULL, "
+            "PRIMARY KEY (session_id, key))"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS session_log (id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, "
+            "role TEXT NOT NULL, content TEXT NOT NULL, hidden INTEGER NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS session_log_session ON session_log (session_id, id)")
+        # Última actividad de cada sesión, para caducarlas igual que el TTL del backend Redis
+        self._db.execute("CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, updated_at REAL NOT NULL)")
+        self._migrate()
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def _migrate(self):
+        """Pasa los mensajes de la tabla antigua (posición calculada por cada réplica) a session_log."""
+        exists = self._db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'session_messages'").fetchone()
+        if exists:
+            self._db.execute(
+                "INSERT INTO session_log (session_id, role, content, hidden) "
+                "SELECT session_id, role, content, hidden FROM session_messages ORDER BY session_id, seq")
+            self._db.execute("DROP TABLE session_messages")
+        self._db.execute(
+            "INSERT OR IGNORE INTO sessions (session_id, updated_at) "
+            "SELECT DISTINCT session_id, ? FROM session_fields", (time.time(),))
+
+    def load(self, session_id):
+        with self._lock:
+            fields = {key: json.loads(value) for key, value in self._db.execute(
+                "SELECT key, value FROM session_fields WHERE session_id = ?", (session_id,))}
+            messages = [(role, content, bool(hidden)) for role, content, hidden in self._db.execute(
+                "SELECT role, content, hidden FROM session_log WHERE session_id = ? ORDER BY id", (session_id,))]
+        return fields, messages
+
+    def write(self, batch):
+        """Escribe en una sola transacción los cambios pendientes de varias sesiones."""
+        now = time.time()
+        with self._lock, self._db:
+            for session_id, (fields, messages) in batch.items():
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO session_fields (session_id, key, value) VALUES (?, ?, ?)",
+                    [(session_id, key, json.dumps(value, ensure_ascii=False)) for key, value in fields.items()],
+                )
+                self._db.executemany(
+                    "INSERT INTO session_log (session_id, role, content, hidden) VALUES (?, ?, ?, ?)",
+                    [(session_id, role, content, int(hidden)) for role, content, hidden in messages],
+                )
+                self._db.execute("INSERT OR REPLACE INTO sessions (session_id, updated_at) VALUES (?, ?)",
+                                 (session_id, now))
+
+    def expire(self):
+        """Borra las sesiones sin actividad desde hace más de `ttl` segundos. Devuelve cuántas."""
+        cutoff = time.time() - self.ttl
+        with self._lock, self._db:
+            expired = [row[0] for row in self._db.execute(
+                "SELECT session_id FROM sessions WHERE updated_at < ?", (cutoff,))]
+            for table in ("session_fields", "session_log", "sessions"):
+                self._db.executemany(f"DELETE FROM {table} WHERE session_id = ?", [(sid,) for sid in expired])
+        return len(expired)
+
+
+class RedisSessionBackend:
+    """
+    Sesiones en un servidor compatible con Redis (Redis, Valkey, KeyDB...), compartido por todas las réplicas.
+    Campos en el hash `laila:session:<id>` y mensajes en la lista `laila:session:<id>:log` (RPUSH: el
+    orden lo decide el servidor). Las claves caducan tras `ttl` segundos sin actividad.
+    """
+    def __init__(self, url="redis://localhost:6379/0", ttl=7 * 24 * 3600):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("Para SESSION_BACKEND=redis hay que instalar el paquete 'redis'.")
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self.ttl = ttl
+
+    @staticmethod
+    def _key(session_id):
+        return f"laila:session:{session_id}"
+
+    def load(self, session_id):
+        key = self._key(session_id)
+        fields = {name: json.loads(value) for name, value in self._redis.hgetall(key).items()}
+        messages = [tuple(json.loads(item)) for item in self._redis.lrange(f"{key}:log", 0, -1)]
+        return fields, messages
+
+    def write(self, batch):
+        pipe = self._redis.pipeline()
+        for session_id, (fields, messages) in batch.items():
+            key = self._key(session_id)
+            if fields:
+                pipe.hset(key, mapping={name: json.dumps(value, ensure_ascii=False) for name, value in fields.items()})
+            if messages:
+                pipe.rpush(f"{key}:log", *(json.dumps([role, content, hidden], ensure_ascii=False)
+                                           for role, content, hidden in messages))
+            pipe.expire(key, self.ttl)
+            pipe.expire(f"{key}:log", self.ttl)
+        pipe.execute()
+
+    def expire(self):
+        """Redis caduca las claves por sí mismo."""
+        return 0
+
+
+class SessionStore:
+    """
+    Estado de las sesiones fuera de st.session_state, para que cualquier réplica pueda retomar una sesión.
+
+    Las escrituras de un turno se acumulan en memoria y se envían al backend en un solo lote al final
+    del turno (Session.flush), antes de que el usuario pueda reconectarse a otra réplica. Un hilo envía
+    además lo pendiente cada `flush_interval` segundos (y al cerrar el proceso) y caduca las sesiones
+    antiguas cada `expire_interval`.
+    """
+    def __init__(self, backend, flush_interval=0.5, expire_interval=3600):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.expire_interval = expire_interval
+        self._pending = {}  # session_id -> (campos, mensajes nuevos)
+        self._lock = threading.Lock()
+        # Un solo envío a la vez: mientras un lote está en vuelo, load() espera a que termine
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._flush_loop, name="session-store", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    @classmethod
+    def shared(cls):
+        """Almacén del proceso, según SESSION_BACKEND ('sqlite' por defecto o 'redis')."""
+        def create():
+            config = get_config()
+            kind = config.session_backend
+            if kind == "redis":
+                backend = RedisSessionBackend(config.session_redis_url, config.session_ttl)
+            else:
+                backend = SqliteSessionBackend(config.session_db, config.session_ttl)
+            print(f"{PASTEL_YELLOW}💾 Sesiones en {kind}{RESET}")
+            return cls(backend)
+        return get_resource("session_store", create)
+
+    def _entry(self, session_id):
+        return self._pending.setdefault(session_id, ({}, []))
+
+    def set(self, session_id, key, value):
+        with self._lock:
+            self._entry(session_id)[0][key] = value
+
+    def append_message(self, session_id, role, content, hidden):
+        with self._lock:
+            self._entry(session_id)[1].append((role, content, hidden))
+
+    def load(self, session_id):
+        """Devuelve (campos, mensajes) de la sesión, incluidas las escrituras aún sin enviar."""
+        with self._flush_lock:
+            fields, messages = self.backend.load(session_id)
+            with self._lock:
+                pending_fields, pending_messages = self._pending.get(session_id, ({}, []))
+                fields.update(pending_fields)
+                messages = messages + list(pending_messages)
+        return fields, messages
+
+    def flush(self):
+        """Envía al backend todas las escrituras pendientes."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+            if not batch:
+                return
+            try:
+                self.backend.write(batch)
+            except Exception as e:
+                print(f"{RED}Error al guardar las sesiones:{RESET} {e}")
+                # Se devuelven a la cola sin pisar lo que haya llegado mientras tanto
+                with self._lock:
+                    for session_id, (fields, messages) in batch.items():
+                        entry = self._entry(session_id)
+                        entry[0].update({key: value for key, value in fields.items() if key not in entry[0]})
+                        entry[1][:0] = messages
+
+    def expire(self):
+        try:
+            expired = self.backend.expire()
+        except Exception as e:
+            print(f"{RED}Error al caducar las sesiones:{RESET} {e}")
+            return
+        if expired:
+            print(f"{PASTEL_YELLOW}💾 {expired} sesiones caducadas{RESET}")
+
+    def _flush_loop(self):
+        last_expire = 0.0
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+            if time.monotonic() - last_expire >= self.expire_interval:
+                last_expire = time.monotonic()
+                self.expire()
+
+
+class Session:
+    """
+    Sesión de chat del usuario: st.session_state como caché local y el SessionStore como respaldo.
+    Se identifica con el parámetro `sid` de la URL, así que al reconectar (en esta u otra réplica)
+    se recupera la conversación. El `sid` es la única credencial: quien tenga la URL tiene la sesión.
+    """
+    def __init__(self, store, session_id):
+        self.store = store
+        self.session_id = session_id
+
+    @classmethod
+    def current(cls):
+        """Sesión de la pestaña actual; la primera vez restaura su estado guardado."""
+        if "session" not in st.session_state:
+            session_id = st.query_params.get("sid") or uuid.uuid4().hex
+            st.query_params["sid"] = session_id
+            session = cls(SessionStore.shared(), session_id)
+            session.restore()
+            st.session_state.session = session
+        return st.session_state.session
+
+    def restore(self):
+        started = time.perf_counter()
+        fields, messages = self.store.load(self.session_id)
+        for key, value in fields.items():
+            st.session_state[key] = value
+        store = MessageStore()
+        for role, content, hidden in messages:
+            store.append(role, content, hidden)
+        st.session_state.messages = store
+        if fields or messages:
+            print(f"{PASTEL_YELLOW}💾 Sesión {self.session_id} recuperada ({len(messages)} mensajes, "
+                  f"{(time.perf_counter() - started) * 1000:.1f} ms){RESET}")
+
+    def set(self, key, value):
+        """Asigna un valor en st.session_state y, si es de las claves persistentes, lo guarda."""
+        st.session_state[key] = value
+        if key in PERSISTED_KEYS:
+            self.store.set(self.session_id, key, value)
+
+    def append_message(self, role, content, hidden=False):
+        """Añade un mensaje al historial de la sesión y lo guarda."""
+        self.store.append_message(self.session_id, role, content, hidden)
+        return st.session_state.messages.append(role, content, hidden)
+
+    def flush(self):
+        """Guarda ya lo escrito en el turno: otra réplica (u otra pestaña) puede retomar la sesión."""
+        self.store.flush()
@@ -0,0 +1,48 @@
+import os
+import base64
+import mimetypes
+import streamlit as st
+from src.resources import get_resource
+
+# Carpeta `static` junto a frontend/app.py: con server.enableStaticServing Streamlit la sirve en /app/static
+STATIC_DIR = "frontend/static"
+STATIC_URL = "/app/static"
+
+
+def _cached(kind, path, load):
+    """Carga el fichero una vez por proceso; si cambia en disco (p. ej. el CSS compilado) se vuelve a cargar."""
+    full_path = os.path.join(STATIC_DIR, path)
+    return get_resource((kind, full_path, os.stat(full_path).st_mtime_ns), lambda: load(full_path))
+
+
+def _data_uri(full_path):
+    mime_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+    with open(full_path, "rb") as f:
+        return f"data:{mime_type};base64,{base64.b64encode(f.read()).decode()}"
+
+
+def _text(full_path):
+    with open(full_path, encoding="utf-8") as f:
+        return f.read()
+
+
+def static_serving_enabled():
+    return bool(st.get_option("server.enableStaticServing"))
+
+
+def asset_url(path, relative=False):
+    """
+    URL de una imagen de frontend/static (p. ej. "img/user.png").
+    Con el servidor estático activo es una URL que el navegador descarga una vez y guarda en caché
+    (`relative=True` la da relativa a la página, para CSS y markdown); si no, un data URI
+    codificado una sola vez por proceso.
+    """
+    if static_serving_enabled():
+        url = f"{STATIC_URL}/{path}"
+        return url.lstrip("/") if relative else url
+    return _cached("asset_data_uri", path, _data_uri)
+
+
+def asset_text(path):
+    """Contenido de un fichero de texto de frontend/static (CSS...), leído una vez por proceso."""
+    return _cached("asset_text", path, _text)
@@ -1,44 +1,64 @@
 import random
+import asyncio
 from src.rag import RAG
+from src.card_cache import CardCache, card_question, spread_question
 from src.llm_client import LlmClient
-from src.utils.utils import get_env_key, BLUE, PURPLE, RESET, RED, PASTEL_YELLOW
+from src.rate_limiter import INTERACTIVE
+from src.prompt_registry import PromptRegistry
+from src.card_index import TAROT_CARDS
+from src.utils.utils import BLUE, PURPLE, RESET, RED, PASTEL_YELLOW
 
 class TarotReader:
-    def __init__(self):
+    def __init__(self, max_workers=4):
         self.rag = RAG()  # Carga el índice una vez al crear la instancia
-        self.llm_client = LlmClient(ll_model = "gpt-3.5-turbo-0125")
-        # Lista de cartas del Tarot almacenada correctamente como un atributo de la instancia
-        self.tarot_cards = [
-            "El Loco", "El Mago", "La Sacerdotisa", "La Emperatriz", "El Emperador", 
-            "El Hierofante", "Los Enamorados", "El Carro", "La Justicia", "El Ermitaño",
-            "La Rueda de la Fortuna", "La Fuerza", "El Colgado", "La Muerte", "La Templanza",
-            "El Diablo", "La Torre", "La Estrella", "La Luna", "El Sol", "El Juicio", "El Mundo",
-            
-            # Arcanos Menores - Bastos (As al Rey)
-            "As de Bastos", "Dos de Bastos", "Tres de Bastos", "Cuatro de Bastos", "Cinco de Bastos",
-            "Seis de Bastos", "Siete de Bastos", "Ocho de Bastos", "Nueve de Bastos", "Diez de Bastos",
-            "Sota de Bastos", "Caballo de Bastos", "Reina de Bastos", "Rey de Bastos",
-            
-            # Arcanos Menores - Copas (As al Rey)
-            "As de Copas", "Dos de Copas", "Tres de Copas", "Cuatro de Copas", "Cinco de Copas",
-            "Seis de Copas", "Siete de Copas", "Ocho de Copas", "Nueve de Copas", "Diez de Copas",
-            "Sota de Copas", "Caballo de Copas", "Reina de Copas", "Rey de Copas",
-            
-            # Arcanos Menores - Espadas (As al Rey)
-            "As de Espadas", "Dos de Espadas", "Tres de Espadas", "Cuatro de Espadas", "Cinco de Espadas",
-            "Seis de Espadas", "Siete de Espadas", "Ocho de Espadas", "Nueve de Espadas", "Diez de Espadas",
-            "Sota de Espadas", "Caballo de Espadas", "Reina de Espadas", "Rey de Espadas",
-            
-            # Arcanos Menores - Oros (As al Rey)
-            "As de Oros", "Dos de Oros", "Tres de Oros", "Cuatro de Oros", "Cinco de Oros",
-            "Seis de Oros", "Siete de Oros", "Ocho de Oros", "Nueve de Oros", "Diez de Oros",
-            "Sota de Oros", "Caballo de Oros", "Reina de Oros", "Rey de Oros"
-        ]
+        # Número máximo de consultas RAG simultáneas durante una tirada
+        self.max_workers = max_workers
+        # Resúmenes precalculados de las cartas (python -m src.card_cache)
+        self.card_cache = CardCache.shared()
+        # La interpretación final va por la ruta "reading" (modelo grande, ver src/llm_router.py)
+        self.llm_client = LlmClient()
+        # Las 78 cartas del Tarot (Arcanos Mayores y Menores de As a Rey, ver src/card_index.py)
+        self.tarot_cards = list(TAROT_CARDS)
 
-    def rag_question(self, question):
-        response = self.rag.ask_question(question)
+    def rag_question(self, question, card=None):
+        # Con `card` la parte léxica de la búsqueda se limita a los fragmentos que mencionan la carta
+        response = self.rag.ask_question(question, card)
         return response  # Retorna la respuesta correctamente
+
+    def rag_questions(self, questions, priority=INTERACTIVE, cards=None):
+        """
+        Lanza varias consultas RAG a la vez, como mucho `max_workers` simultáneas.
+        `cards` indica, para cada pregunta, la carta por la que pregunta (o None).
+        Devuelve las respuestas en el mismo orden que las preguntas.
+        """
+        cards = cards or [None] * len(questions)
+        return self.llm_client.run_sync(self._arag_questions(questions, priority, cards))
+
+    async def _arag_questions(self, questions, priority, cards):
+        semaphore = asyncio.Semaphore(max(1, self.max_workers))
+
+        async def ask(question, card):
+            async with semaphore:
+                return await self.rag.aask_question(question, priority, card)
+
+        return await asyncio.gather(*(ask(question, card) for question, card in zip(questions, cards)))
     
+    def get_cards_info(self, cards):
+        """
+        Obtiene la información de las cartas y de la tirada, en ese orden.
+        Se usa la caché precalculada y solo se consulta al RAG lo que falte.
+        """
+        cards_info = [self.card_cache.get(card) for card in cards]
+        cards_info.append(self.card_cache.get_spread())
+
+        missing = [i for i, info in enumerate(cards_info) if info is None]
+        if missing:
+            questions = [card_question(cards[i]) if i < len(cards) else spread_question() for i in missing]
+            question_cards = [cards[i] if i < len(cards) else None for i in missing]
+            for i, answer in zip(missing, self.rag_questions(questions, cards=question_cards)):
+                cards_info[i] = answer
+        return cards_info
+
     def get_random_cards(self):
         """
         Genera y devuelve una lista de 6 cartas aleatorias únicas del Tarot.
@@ -53,20 +73,26 @@ class TarotReader:
         Realiza una tirada de Tarot con la pirámide invertida de 6 cartas y genera la interpretación.
         """
         cards = self.get_random_cards()
-        # Utilizando un bucle para recopilar la información de todas las cartas
-        cards_info = [self.rag_question(f"Dame toda la información sobre la carta {card}") for card in cards]
-        # Agregando la explicación de la reading al final
-        cards_info.append(self.rag_question("Explícame la reading 'Pirámide Invertida de 6 cartas'"))
-        info_cards = "\n".join(cards_info)
+        # Información de cada carta y, al final, la explicación de la tirada
+        cards_info = self.get_cards_info(cards)
 
         # Interacción con el modelo LLM
         conversation_history = []
-        question = f"Se ha hecho una tirada (Piramide invertida de 6 cartas) y han salido en este orden: {cards}. Pregunta: {asking}. Info adicional: {info}. (Realiza la tirada de forma dramática, esotérica y teatral, puedes usar emojis)"
+        prompts = PromptRegistry.shared()
+        question = prompts.render("reading_question", cards=cards, asking=asking, info=info)
         print(f"\n{PURPLE}Se ha hecho una tirada (Piramide invertida de 6 cartas) y han salido en este orden:\n{RESET}{cards}\n{PURPLE}Pregunta:{RESET} {asking}.\n{PURPLE}Info adicional:{RESET} {info}.")
-        conversation_history.append({"role": "system", "content": f"{get_env_key('PROMPT_FILE')}"})
-        conversation_history.append({"role": "system", "content": f"## CONTEXTO:\n{info_cards}"})
+        conversation_history.append({"role": "system", "content": prompts.text("personality")})
         conversation_history.append({"role": "user", "content": question})
-        response = self.llm_client.get_response(conversation_history)
+
+        # La información de las cartas se reparte lo que queda del presupuesto de tokens
+        budget = self.llm_client.context_budget
+        context_message = {"role": "system", "content": "## CONTEXTO:\n"}
+        available = self.llm_client.prompt_budget("reading") - budget.count_messages(conversation_history + [context_message])
+        passages = budget.fit_passages(cards_info, available)
+        if passages:
+            context_message["content"] += "\n".join(passages)
+            conversation_history.insert(1, context_message)
+        response = self.llm_client.get_response(conversation_history, use_cache=False, route="reading")
         return response
 
 if __name__ == "__main__":
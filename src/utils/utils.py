@@ -1,6 +1,4 @@
-from dotenv import load_dotenv
 from pathlib import Path
-import os
 import streamlit as st
 
 # Definición de colores e iconos
@@ -43,41 +41,35 @@ CELEBRATION = "\U0001F389"   # 🎉
 THINKING = "\U0001F914"      # 🤔
 RAISED_HAND = "\U0000270B"   # ✋
 
-def get_env_key(env_key, levels_up=2, env_file_name=".env"):
+_REQUIRED = object()
+
+def get_env_key(env_key, levels_up=2, env_file_name=".env", default=_REQUIRED):
     """
     Obtiene una clave específica de un archivo .env ubicado en un nivel superior.
+    El .env del proyecto se lee una sola vez por proceso (ver src.config.get_config).
 
     Parameters:
     - env_key (str): El nombre de la clave que se quiere recuperar.
     - levels_up (int): Cuántos niveles hacia arriba buscar el archivo .env (por defecto, 2).
     - env_file_name (str): El nombre del archivo .env (por defecto, ".env").
+    - default: Valor a devolver si la clave no está configurada (si se omite, la clave es obligatoria).
 
     Returns:
     - str: El valor de la clave solicitada.
     """
-    try:
-        # Resolver la ruta al archivo .env
-        dotenv_path = Path(__file__).resolve().parents[levels_up] / env_file_name
-        if not dotenv_path.exists():
-            message = f"{RED}{CROSS_MARK} Error: FileNotFoundError: No se encontró el archivo .env en {dotenv_path}{RESET}"
-            print(message)
-            raise FileNotFoundError(message)
-
-        # Cargar las variables del archivo .env
-        load_dotenv(dotenv_path=dotenv_path)
-
-        # Obtener la clave API
-        key = os.environ.get(env_key)
-        if key is None:
-            message = f"{RED}{CROSS_MARK} Error: ValueError: La clave '{env_key}' no está configurada en el archivo .env.{RESET}"
-            print(message)
-            raise ValueError(message)
+    from src.config import Config, get_config, ENV_FILE  # src.config importa los colores de este módulo
 
-        return key
+    dotenv_path = Path(__file__).resolve().parents[levels_up] / env_file_name
+    config = get_config() if dotenv_path == ENV_FILE else Config.load(dotenv_path).export()
 
-    except (FileNotFoundError, ValueError):
-        # El mensaje ya se imprime dentro de los bloques anteriores
-        raise
+    key = config.get(env_key)
+    if key is None and default is not _REQUIRED:
+        return default
+    if key is None:
+        message = f"{RED}{CROSS_MARK} Error: ValueError: La clave '{env_key}' no está configurada en el archivo .env.{RESET}"
+        print(message)
+        raise ValueError(message)
+    return key
 
 def local_css(file_name):
     with open(file_name) as f:
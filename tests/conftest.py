@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Los módulos se importan como `src.*`, igual que desde run.py
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
@@ -0,0 +1,35 @@
+from src.card_index import CARD_TAGS_VERSION, CardIndex, tag_chunk
+
+
+def test_minor_card_and_suit():
+    tags = tag_chunk("La Sota de Copas anuncia noticias; las copas son el agua.")
+    assert tags["cards"] == ["Sota de Copas"]
+    assert tags["suits"] == ["Copas"]
+    assert tags["card_tags_version"] == CARD_TAGS_VERSION
+
+
+def test_english_and_rank_aliases():
+    assert tag_chunk("The Queen of Cups and the Ace of Wands.")["cards"] == ["Reina de Copas", "As de Bastos"]
+    assert tag_chunk("El Paje de Espadas")["cards"] == ["Sota de Espadas"]
+
+
+def test_ocr_noise():
+    assert tag_chunk("Cinco de 0ros")["cards"] == ["Cinco de Oros"]
+    assert tag_chunk("El Ermi-\ntaño busca la verdad")["cards"] == ["El Ermitaño"]
+
+
+def test_ambiguous_major_names_need_capitals_or_context():
+    assert tag_chunk("viajó por el mundo entero bajo el sol")["cards"] == []
+    assert tag_chunk("El Mundo cierra el ciclo")["cards"] == ["El Mundo"]
+    assert tag_chunk("en la carta, el mundo aparece como una figura")["cards"] == ["El Mundo"]
+
+
+def test_order_without_repeats():
+    tags = tag_chunk("La Torre, luego el Rey de Oros y otra vez La Torre.")
+    assert tags["cards"] == ["La Torre", "Rey de Oros"]
+
+
+def test_card_index_lookup():
+    index = CardIndex({"La Torre": [3, 7]})
+    assert list(index.lookup("La Torre")) == [3, 7]
+    assert len(index.lookup("El Loco")) == 0
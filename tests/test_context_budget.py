@@ -0,0 +1,64 @@
+from src.context_budget import ContextBudget
+from src.message_store import Message
+
+LONG = "Frase del contexto recuperado sobre las cartas. " * 120
+
+
+def budget(max_prompt_tokens=3000, **kwargs):
+    return ContextBudget(max_prompt_tokens=max_prompt_tokens, **kwargs)
+
+
+def conversation():
+    return [
+        Message("user", "hola"),
+        Message("assistant", "Bienvenida, corazón."),
+        Message("user", LONG, hidden=True),
+        Message("user", "¿Qué me depara el amor?"),
+        Message("assistant", "Las cartas hablan de un encuentro. " * 5),
+        Message("user", LONG, hidden=True),
+        Message("user", "Responde con tono solemne. " * 40, hidden=True),
+    ]
+
+
+def test_fits_unchanged():
+    records = [Message("user", "hola"), Message("assistant", "bienvenida")]
+    assert budget().fit_messages(records) == [{"role": "user", "content": "hola"},
+                                              {"role": "assistant", "content": "bienvenida"}]
+
+
+def test_drops_repeated_and_stale_hidden_messages_even_if_it_fits():
+    records = [
+        Message("user", "TONO: solemne", hidden=True),
+        Message("user", "contexto", hidden=True),
+        Message("user", "contexto", hidden=True),
+        Message("user", "TONO: alegre", hidden=True),
+    ]
+    fitted = budget(keep_recent=1).fit_messages(records, stale_prefixes=("TONO:",))
+    assert [m["content"] for m in fitted] == ["contexto", "TONO: alegre"]
+
+
+def test_result_respects_a_tight_budget():
+    context_budget = budget(300)
+    fitted = context_budget.fit_messages(conversation())
+    assert context_budget.count_messages(fitted) <= 300
+    # Los mensajes visibles recientes llegan intactos y la instrucción del paso actual se conserva
+    contents = [m["content"] for m in fitted]
+    assert "¿Qué me depara el amor?" in contents
+    assert "Las cartas hablan de un encuentro. " * 5 in contents
+    assert contents[-1].startswith("Responde con tono solemne.")
+
+
+def test_older_messages_go_first():
+    context_budget = budget(1200)
+    fitted = context_budget.fit_messages(conversation())
+    assert context_budget.count_messages(fitted) <= 1200
+    # Lo primero que sale es lo más antiguo; los mensajes recientes siguen
+    assert len(fitted) < len(conversation())
+    assert fitted[-1]["content"] == conversation()[-1].content
+
+
+def test_fit_passages():
+    context_budget = budget()
+    assert context_budget.fit_passages(["uno", "uno ", "dos"], 1000) == ["uno", "dos"]
+    assert context_budget.fit_passages([LONG, LONG + "x"], 0) == []
+    assert context_budget.fit_passages([LONG, "otro " * 200], 40) == [context_budget.truncate(LONG, 40)]
@@ -0,0 +1,47 @@
+from src.hybrid_retriever import BM25Index, reciprocal_rank_fusion, tokenize
+
+TEXTS = [
+    "La Sota de Copas anuncia un mensaje emocional.",
+    "La Sota de Espadas habla de vigilancia.",
+    "El Rey de Copas es un hombre maduro y sereno.",
+    "Las copas representan el agua y las emociones, copas y más copas.",
+]
+IDS = [10, 11, 15, 20]  # ids de chunk con huecos, como tras borrar fragmentos
+
+
+def test_tokenize_folds_accents_and_drops_stop_words():
+    assert tokenize("El Ermitaño de la Luz") == ["ermitano", "luz"]
+
+
+def test_search_ranks_exact_names_first():
+    index = BM25Index(IDS, TEXTS)
+    results = index.search("Sota de Copas", k=3)
+    assert results[0] == 10
+    assert set(results) <= set(IDS)
+    assert len(results) == 3
+
+
+def test_search_ignores_unknown_terms_and_empty_matches():
+    index = BM25Index(IDS, TEXTS)
+    assert index.search("xyzzy") == []
+    assert index.search("espadas") == [11]
+
+
+def test_rank_orders_known_ids():
+    index = BM25Index(IDS, TEXTS)
+    # 20 repite "copas" y es el único con "emociones"; 11 no es candidato aunque coincida
+    assert index.rank("emociones copas", [10, 15, 20]) == [20, 10, 15]
+    # Sin coincidencias se conserva el orden recibido
+    assert index.rank("xyzzy", [15, 10]) == [15, 10]
+
+
+def test_empty_index():
+    index = BM25Index([], [])
+    assert index.search("copas") == []
+
+
+def test_reciprocal_rank_fusion():
+    # 1 es primero y segundo; 3 es tercero y primero: 1/61 + 1/62 > 1/63 + 1/61
+    assert reciprocal_rank_fusion([[1, 2, 3], [3, 1]], k=60) == [1, 3, 2]
+    assert reciprocal_rank_fusion([[5, 6], []]) == [5, 6]
+    assert reciprocal_rank_fusion([]) == []
@@ -0,0 +1,113 @@
+import os
+import hashlib
+import numpy as np
+import pytest
+from src.index_store import IndexStore, IncrementalIndexer
+
+DIM = 8
+
+
+def split_lines(file_path):
+    with open(file_path, "r", encoding="utf-8") as f:
+        return [(line, {"source": os.path.basename(file_path)}) for line in f.read().splitlines() if line]
+
+
+def embed(texts):
+    """Vectores deterministas a partir del hash de cada texto."""
+    rows = [np.frombuffer(hashlib.sha256(text.encode()).digest()[:DIM], dtype=np.uint8) for text in texts]
+    return np.asarray(rows, dtype=np.float32)
+
+
+class Recorder:
+    """Anota qué ficheros se trocean y cuántos textos se codifican."""
+    def __init__(self):
+        self.split, self.embedded = [], 0
+
+    def split_file(self, file_path):
+        self.split.append(os.path.basename(file_path))
+        return split_lines(file_path)
+
+    def embed(self, texts):
+        self.embedded += len(texts)
+        return embed(texts)
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    data_dir = tmp_path / "context"
+    data_dir.mkdir()
+    (data_dir / "a.txt").write_text("El Loco\nEl Mago\n", encoding="utf-8")
+    (data_dir / "b.txt").write_text("La Torre\n", encoding="utf-8")
+    return data_dir
+
+
+def make_indexer(tmp_path, corpus):
+    recorder = Recorder()
+    store = IndexStore(str(tmp_path / "index"))
+    return IncrementalIndexer(store, str(corpus), recorder.split_file, recorder.embed), store, recorder
+
+
+def chunk_texts(store):
+    _, chunks = store.load(mmap=False)
+    return {int(chunk_id): chunks.get_text(int(chunk_id)) for chunk_id in chunks.ids}
+
+
+def test_add_indexes_every_file(tmp_path, corpus):
+    indexer, store, recorder = make_indexer(tmp_path, corpus)
+    assert indexer.update() is True
+    index, _ = store.load(mmap=False)
+    assert index.ntotal == 3
+    assert sorted(chunk_texts(store).values()) == ["El Loco", "El Mago", "La Torre"]
+    manifest = store.load_manifest()
+    assert manifest["next_id"] == 3
+    assert manifest["files"]["a.txt"]["chunk_ids"] == [0, 1]
+    assert recorder.split == ["a.txt", "b.txt"]
+
+
+def test_noop_keeps_generation(tmp_path, corpus):
+    indexer, store, recorder = make_indexer(tmp_path, corpus)
+    indexer.update()
+    generation = store.current_generation()
+    assert indexer.update() is False
+    assert store.current_generation() == generation
+    assert recorder.split == ["a.txt", "b.txt"]
+    assert recorder.embedded == 3
+
+
+def test_change_reindexes_only_that_file(tmp_path, corpus):
+    indexer, store, recorder = make_indexer(tmp_path, corpus)
+    indexer.update()
+    (corpus / "a.txt").write_text("El Loco\nLa Emperatriz\nEl Carro\n", encoding="utf-8")
+    assert indexer.update() is True
+    assert recorder.split == ["a.txt", "b.txt", "a.txt"]
+    texts = chunk_texts(store)
+    assert sorted(texts.values()) == ["El Carro", "El Loco", "La Emperatriz", "La Torre"]
+    # Los fragmentos antiguos de a.txt desaparecen y los de b.txt conservan su id
+    assert texts[2] == "La Torre"
+    assert not {0, 1} & set(texts)
+    assert store.load(mmap=False)[0].ntotal == 4
+
+
+def test_delete_removes_its_chunks(tmp_path, corpus):
+    indexer, store, _ = make_indexer(tmp_path, corpus)
+    indexer.update()
+    os.remove(corpus / "b.txt")
+    assert indexer.update() is True
+    assert sorted(chunk_texts(store).values()) == ["El Loco", "El Mago"]
+    assert "b.txt" not in store.load_manifest()["files"]
+    assert store.load(mmap=False)[0].ntotal == 2
+
+
+def test_mtime_only_change_rewrites_just_the_manifest(tmp_path, corpus):
+    indexer, store, recorder = make_indexer(tmp_path, corpus)
+    indexer.update()
+    generation = store.current_generation()
+    stat = os.stat(corpus / "a.txt")
+    os.utime(corpus / "a.txt", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    assert indexer.update() is False
+    assert store.current_generation() == generation
+    assert store.load_manifest()["files"]["a.txt"]["mtime_ns"] == stat.st_mtime_ns + 10**9
+    assert recorder.split == ["a.txt", "b.txt"]
+    # Con el manifiesto al día la siguiente pasada ni siquiera recalcula el hash
+    assert indexer.scan(store.load_manifest())[1] == {}
@@ -0,0 +1,70 @@
+import pytest
+from src.session_store import SessionStore, SqliteSessionBackend
+
+
+class FlakyBackend:
+    """Backend en memoria que falla en las primeras `failures` escrituras."""
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.fields, self.messages = {}, {}
+
+    def load(self, session_id):
+        return dict(self.fields.get(session_id, {})), list(self.messages.get(session_id, []))
+
+    def write(self, batch):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("backend caído")
+        for session_id, (fields, messages) in batch.items():
+            self.fields.setdefault(session_id, {}).update(fields)
+            self.messages.setdefault(session_id, []).extend(messages)
+
+    def expire(self):
+        return 0
+
+
+@pytest.fixture
+def sqlite_store(tmp_path):
+    # Sin el hilo de fondo enviando lotes por su cuenta: los tests llaman a flush()
+    return SessionStore(SqliteSessionBackend(str(tmp_path / "sessions.db")), flush_interval=3600)
+
+
+def test_messages_keep_append_order(sqlite_store):
+    sqlite_store.append_message("s1", "user", "hola", False)
+    sqlite_store.append_message("s1", "assistant", "bienvenida", False)
+    sqlite_store.flush()
+    sqlite_store.append_message("s1", "user", "instrucción", True)
+
+    # Lo ya guardado y lo pendiente, en el orden en que se añadió
+    _, messages = sqlite_store.load("s1")
+    assert messages == [("user", "hola", False), ("assistant", "bienvenida", False), ("user", "instrucción", True)]
+
+    sqlite_store.flush()
+    assert sqlite_store.backend.load("s1")[1] == messages
+
+
+def test_sessions_do_not_mix(sqlite_store):
+    sqlite_store.append_message("s1", "user", "uno", False)
+    sqlite_store.append_message("s2", "user", "dos", False)
+    sqlite_store.set("s1", "step", 3)
+    sqlite_store.flush()
+    assert sqlite_store.load("s1") == ({"step": 3}, [("user", "uno", False)])
+    assert sqlite_store.load("s2") == ({}, [("user", "dos", False)])
+
+
+def test_failed_flush_is_requeued_in_order():
+    backend = FlakyBackend(failures=1)
+    store = SessionStore(backend, flush_interval=3600)
+    store.set("s1", "step", 1)
+    store.append_message("s1", "user", "primero", False)
+    store.flush()  # falla: vuelve a la cola
+    assert backend.messages == {}
+
+    # Lo que llega después no se pisa con lo reencolado y los mensajes siguen en orden
+    store.set("s1", "step", 2)
+    store.append_message("s1", "user", "segundo", False)
+    assert store.load("s1") == ({"step": 2}, [("user", "primero", False), ("user", "segundo", False)])
+
+    store.flush()
+    assert backend.fields["s1"] == {"step": 2}
+    assert backend.messages["s1"] == [("user", "primero", False), ("user", "segundo", False)]